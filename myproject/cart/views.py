@@ -1,6 +1,8 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
 from store.models import Product
+from orders.reservations import available_to_sell
+from orders.services import cart_lines
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 
@@ -12,32 +14,8 @@ def get_cart_total(cart):
 
 def cart_detail(request):
     cart = request.session.get("cart", {})
-
-    cart_items = []
-    total = 0
-
-    for product_id, item in cart.items():
-        if not isinstance(item, dict):
-            continue
-            
-        try:
-            product = get_object_or_404(Product, id=product_id)
-
-            quantity = item.get("quantity", 1)
-            price = float(item.get("price", 0))
-            subtotal = price * quantity
-
-            cart_items.append({
-                "product": product,
-                "quantity": quantity,
-                "price": price,
-                "subtotal": subtotal,
-            })
-
-            total += subtotal
-        except (ValueError, Product.DoesNotExist):
-            continue
-
+    # One query for every line's product and what's left to sell of it
+    cart_items, total = cart_lines(cart)
     return render(request, "cart/cart_detail.html", {"cart_items": cart_items, "total": total})
 
 
@@ -55,9 +33,10 @@ def cart_add(request, product_id):
     
     new_quantity = current_quantity + 1
     
-    # Check Stock Availability
-    if new_quantity > product.stock:
-        msg = f"Sorry, only {product.stock} items available in stock."
+    # Check Stock Availability (less what pending orders hold)
+    available = available_to_sell([product.pk]).get(product.pk, 0)
+    if new_quantity > available:
+        msg = f"Sorry, only {available} items available in stock."
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'status': 'error', 'message': msg})
             
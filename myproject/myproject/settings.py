@@ -75,6 +75,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'store.context_processors.catalog',
             ],
         },
     },
@@ -94,6 +95,55 @@ DATABASES = {
 }
 
 
+# Cache
+# Catalog pages and fragments are cached under a version stamp that is bumped
+# on every catalog change. Set REDIS_URL (requires the redis package) so all
+# workers share one cache; otherwise each process keeps its own.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'rise-catalog',
+        }
+    }
+
+# Seconds a rendered catalog page or product card may be served from cache
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300))
+# Seconds a worker may go on using the catalog version it last read from the
+# database before checking it again (see store.cache)
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', 1))
+
+
+# Email
+# Order emails are queued in an outbox table and sent by
+# `manage.py send_outbox_emails` (see orders.outbox). Without EMAIL_HOST
+# they are printed to the console instead.
+
+if os.environ.get('EMAIL_HOST'):
+    EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    EMAIL_HOST = os.environ['EMAIL_HOST']
+    EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+    EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+    EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+    EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'true').lower() == 'true'
+else:
+    EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'RISE <noreply@rise.example.com>')
+
+# Tries before a queued email is marked failed, and the first retry delay in
+# seconds (doubling after each failure)
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_RETRY_DELAY = int(os.environ.get('OUTBOX_RETRY_DELAY', 60))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -143,3 +193,10 @@ CLOUDINARY_STORAGE = {
 }
 
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+
+# Sized product image variants for templates (see store.images). Set
+# PRODUCT_IMAGE_BACKEND=store.images.LocalImageBackend to resize originals
+# under MEDIA_ROOT with Pillow instead, e.g. when working offline.
+PRODUCT_IMAGE_BACKEND = os.environ.get('PRODUCT_IMAGE_BACKEND', 'store.images.CloudinaryImageBackend')
+if PRODUCT_IMAGE_BACKEND == 'store.images.LocalImageBackend':
+    MEDIA_ROOT = BASE_DIR / 'media'
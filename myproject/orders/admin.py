@@ -1,8 +1,12 @@
+from django import forms
 from django.contrib import admin
 from django.utils.html import format_html
 from django.contrib import messages
+from store.exports import export_actions
+from store.pagination import EstimatedCountPaginator
+from .exports import ORDER_EXPORT, ORDER_ITEM_EXPORT
 from .models import Order, OrderItem
-import csv
+from .services import bulk_transition, stock_shortfall
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -14,8 +18,29 @@ class OrderItemInline(admin.TabularInline):
         return obj.get_total_price()
     get_subtotal.short_description = 'Subtotal'
 
+class OrderAdminForm(forms.ModelForm):
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        order = self.instance
+        becomes_sale = (
+            cleaned_data.get('payment_status', order.payment_status) == 'completed'
+            and cleaned_data.get('status', order.status) != 'cancelled'
+        )
+        # Saving would take the stock; say so here rather than fail in save()
+        if order.pk and becomes_sale and not order.counts_as_sale():
+            short = stock_shortfall(order.get_product_quantities(), order)
+            if short:
+                raise forms.ValidationError(f'Insufficient stock for {short}.')
+        return cleaned_data
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
+    form = OrderAdminForm
     list_display = (
         'id',
         'user',
@@ -27,6 +52,9 @@ class OrderAdmin(admin.ModelAdmin):
 
     list_filter = ('paid', 'status', 'created_at')
     search_fields = ('id', 'user__username', 'email')
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     readonly_fields = (
         'user',
@@ -40,12 +68,16 @@ class OrderAdmin(admin.ModelAdmin):
     
     inlines = [OrderItemInline]
     
-    actions = ['mark_as_paid']
+    actions = [
+        'mark_as_paid', 'mark_as_processing', 'mark_as_shipped', 'mark_as_delivered', 'mark_as_cancelled',
+        *export_actions(ORDER_EXPORT),
+    ]
 
     def get_total_price(self, obj):
-        return obj.total_price()
+        # The stored total; summing the items here cost a query per row
+        return obj.total_amount
     get_total_price.short_description = 'Total Price'
-    get_total_price.admin_order_field = 'total_amount' # Assumes total_amount is stored in DB for sorting
+    get_total_price.admin_order_field = 'total_amount'
 
     def status_badge(self, obj):
         color = "orange"
@@ -67,10 +99,36 @@ class OrderAdmin(admin.ModelAdmin):
     
     @admin.action(description="Mark selected orders as Paid")
     def mark_as_paid(self, request, queryset):
-        # Use timezone.now() for timezone-aware datetimes
-        from django.utils import timezone
-        updated = queryset.update(paid=True, payment_status='completed', paid_at=timezone.now())
-        self.message_user(request, f"{updated} orders marked as paid.", messages.SUCCESS)
+        self._transition(request, queryset, 'paid', 'marked as paid')
+
+    @admin.action(description="Mark selected orders as Processing")
+    def mark_as_processing(self, request, queryset):
+        self._transition(request, queryset, 'processing', 'marked as processing')
+
+    @admin.action(description="Mark selected orders as Shipped")
+    def mark_as_shipped(self, request, queryset):
+        self._transition(request, queryset, 'shipped', 'marked as shipped')
+
+    @admin.action(description="Mark selected orders as Delivered")
+    def mark_as_delivered(self, request, queryset):
+        self._transition(request, queryset, 'delivered', 'marked as delivered')
+
+    @admin.action(description="Cancel selected orders")
+    def mark_as_cancelled(self, request, queryset):
+        self._transition(request, queryset, 'cancelled', 'cancelled')
+
+    def _transition(self, request, queryset, target, done):
+        # Set-based: timelines, stock and sales counters in one transaction
+        updated, skipped, short = bulk_transition(queryset, target, user=request.user)
+        self.message_user(request, f"{updated} orders {done}.", messages.SUCCESS)
+        if skipped:
+            self.message_user(
+                request, f"{skipped} orders skipped: the change doesn't apply to their status.", messages.WARNING,
+            )
+        if short:
+            self.message_user(
+                request, f"{short} orders skipped: not enough stock to cover them.", messages.WARNING,
+            )
 
     def has_delete_permission(self, request, obj=None):
         return False
@@ -87,6 +145,11 @@ class OrderItemAdmin(admin.ModelAdmin):
     )
 
     search_fields = ('order__id', 'product__name')
+    list_select_related = ('order', 'product')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    actions = export_actions(ORDER_ITEM_EXPORT)
 
     def get_subtotal(self, obj):
         return obj.get_total_price()
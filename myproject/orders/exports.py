@@ -0,0 +1,48 @@
+"""Export layouts for orders and order lines (see store.exports)."""
+from store.exports import ExportSpec
+
+
+ORDER_EXPORT = ExportSpec(
+    'orders',
+    [
+        ('id', 'id'),
+        ('created_at', 'created_at'),
+        ('status', 'status'),
+        ('payment_status', 'payment_status'),
+        ('paid', 'paid'),
+        ('total_amount', 'total_amount'),
+        ('user', 'user.username'),
+        ('full_name', 'full_name'),
+        ('email', 'email'),
+        ('phone', 'phone'),
+        ('address_line1', 'address_line1'),
+        ('address_line2', 'address_line2'),
+        ('landmark', 'landmark'),
+        ('city', 'city'),
+        ('state', 'state'),
+        ('pincode', 'pincode'),
+        ('paid_at', 'paid_at'),
+        ('shipped_at', 'shipped_at'),
+        ('delivered_at', 'delivered_at'),
+    ],
+    select_related=['user'],
+)
+
+ORDER_ITEM_EXPORT = ExportSpec(
+    'order-items',
+    [
+        ('id', 'id'),
+        ('order_id', 'order_id'),
+        ('order_created_at', 'order.created_at'),
+        ('order_status', 'order.status'),
+        ('product_id', 'product_id'),
+        ('product', 'product.name'),
+        ('product_slug', 'product.slug'),
+        ('category', 'product.category.name'),
+        ('price', 'price'),
+        ('quantity', 'quantity'),
+        ('subtotal', 'subtotal'),
+    ],
+    select_related=['order', 'product__category'],
+    date_field='order__created_at',
+)
@@ -0,0 +1,89 @@
+"""
+Idempotency keys for checkout and payment submissions.
+
+Each checkout and payment form carries a one-off key in a hidden
+``idempotency_key`` field (API clients may send an ``Idempotency-Key``
+header instead). ``run_once`` records the key in the same transaction as
+the work it guards, under a unique ``(scope, key)`` constraint, along with
+the URL the customer was sent on to:
+
+- a repeat of a finished submission is answered from that row, without
+  reading or writing orders, items or products;
+- a repeat arriving while the first is still running waits on the unique
+  index, then sees the committed row;
+- if the work fails, the key is rolled back with it and can be retried.
+
+Submissions without a key are handled as before. ``manage.py
+prune_idempotency_keys`` deletes keys older than ``IDEMPOTENCY_KEY_TTL``.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 64
+
+
+def get_key_ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+
+def new_key():
+    """A fresh key for a form about to be rendered."""
+    return uuid.uuid4().hex
+
+
+def request_key(request):
+    key = request.POST.get(FIELD) or request.headers.get(HEADER) or ''
+    return key.strip()[:MAX_KEY_LENGTH]
+
+
+def _stored(scope, key, user):
+    record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if record is not None and record.user_id != (user.pk if user else None):
+        # Someone else's submission; don't replay it for this user
+        raise PermissionDenied
+    return record
+
+
+def run_once(request, scope, action):
+    """
+    Run ``action()`` (which returns a URL to redirect to) once per key.
+
+    Returns the URL, from the original run for repeated submissions.
+    Exceptions from ``action`` propagate and leave the key unused.
+    """
+    key = request_key(request)
+    if not key:
+        return action()
+    user = request.user if request.user.is_authenticated else None
+    stored = _stored(scope, key, user)
+    if stored is not None:
+        return stored.response_url
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(scope=scope, key=key, user=user)
+        except IntegrityError:
+            # A concurrent submission got there first and has committed
+            record = None
+        if record is None:
+            return _stored(scope, key, user).response_url
+        record.response_url = action()
+        record.save(update_fields=['response_url'])
+    return record.response_url
+
+
+def prune(older_than=None):
+    """Delete keys created before ``older_than`` (default: the TTL ago)."""
+    older_than = older_than or timezone.now() - timedelta(seconds=get_key_ttl())
+    return IdempotencyKey.objects.filter(created_at__lt=older_than).delete()[0]
@@ -0,0 +1,57 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from orders.models import Order
+from orders.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups from order history, a chunk of days at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None,
+                            help='First day to rebuild, YYYY-MM-DD (default: the first paid order)')
+        parser.add_argument('--until', default=None,
+                            help='Last day to rebuild, YYYY-MM-DD (default: today)')
+        parser.add_argument('--chunk-days', type=int, default=31,
+                            help='Days recomputed per transaction')
+
+    def parse_date(self, value, option):
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'--{option} must be YYYY-MM-DD, not {value!r}')
+
+    def handle(self, *args, **options):
+        until = self.parse_date(options['until'], 'until') if options['until'] else timezone.localdate()
+        if options['since']:
+            since = self.parse_date(options['since'], 'since')
+        else:
+            first_paid = Order.objects.filter(payment_status='completed').aggregate(
+                first=Min(Coalesce('paid_at', 'created_at')),
+            )['first']
+            if first_paid is None:
+                self.stdout.write('No paid orders to roll up.')
+                return
+            since = timezone.localdate(first_paid)
+        if since > until:
+            raise CommandError('--since is after --until.')
+
+        started = time.monotonic()
+        chunk = datetime.timedelta(days=max(options['chunk_days'], 1))
+        days = 0
+        start = since
+        while start <= until:
+            end = min(start + chunk - datetime.timedelta(days=1), until)
+            days += rebuild_rollups(start, end)
+            self.stdout.write(f'{start} to {end}: done')
+            start = end + datetime.timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt sales rollups from {since} to {until}: {days} day(s) with sales, '
+            f'{time.monotonic() - started:.1f}s.'
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from orders.idempotency import get_key_ttl, prune
+
+
+class Command(BaseCommand):
+    help = 'Delete checkout and payment idempotency keys older than IDEMPOTENCY_KEY_TTL'
+
+    def handle(self, *args, **options):
+        deleted = prune()
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} idempotency key(s) older than {get_key_ttl()}s.'
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired stock reservations of abandoned checkouts, a batch at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Reservations deleted per statement')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        released = release_expired(batch_size=max(options['batch_size'], 1))
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {released} expired reservation(s) in {time.monotonic() - started:.1f}s.'
+        ))
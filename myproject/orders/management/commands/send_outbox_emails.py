@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.outbox import send_pending
+
+
+class Command(BaseCommand):
+    help = 'Send the queued order emails in batches over one mail connection, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Emails claimed and sent per batch')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        sent, failed = send_pending(batch_size=max(options['batch_size'], 1))
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {sent} email(s), {failed} failed and will be retried or given up on, '
+            f'in {time.monotonic() - started:.1f}s.'
+        ))
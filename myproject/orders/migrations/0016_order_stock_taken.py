@@ -0,0 +1,21 @@
+# Generated by Django 5.2.10 on 2026-10-17 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0015_idempotency_keys'),
+    ]
+
+    operations = [
+        # Existing orders start at False: orders marked paid by the old admin
+        # action never took stock, and there's no telling them apart from
+        # storefront payments, so none of them restock when cancelled
+        migrations.AddField(
+            model_name='order',
+            name='stock_taken',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
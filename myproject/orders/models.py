@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from store.models import Product
+from store.models import Category, Product
+from store.bestsellers import record_sales
+from store.related import record_co_purchases
 from django.utils import timezone
 
 
@@ -48,6 +50,9 @@ class Order(models.Model):
     paid_at = models.DateTimeField(null=True, blank=True, verbose_name="Payment Completed At")
     shipped_at = models.DateTimeField(null=True, blank=True, verbose_name="Shipped At")
     delivered_at = models.DateTimeField(null=True, blank=True, verbose_name="Delivered At")
+
+    # Whether the items' units are off stock, so cancelling gives back only what was taken
+    stock_taken = models.BooleanField(default=False, editable=False)
     
     # Audit Field
     updated_by = models.ForeignKey(
@@ -59,6 +64,14 @@ class Order(models.Model):
         verbose_name="Last Updated By"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+            models.Index(fields=['status'], name='order_status_idx'),
+            # Sales are booked by payment time (see orders.rollups)
+            models.Index(fields=['paid_at'], name='order_paid_idx'),
+        ]
+
     def update_total(self):
         total = 0
         for item in self.items.all():
@@ -66,28 +79,125 @@ class Order(models.Model):
         self.total_amount = total
         self.save()
     
+    def counts_as_sale(self):
+        """Paid and not cancelled: the order's units count towards sales"""
+        return self.payment_status == 'completed' and self.status != 'cancelled'
+
+    def get_product_quantities(self):
+        """Units ordered per product id"""
+        quantities = {}
+        for product_id, quantity in self.items.values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        return quantities
+
+    def record_sales(self, sign, paid_at=None):
+        """
+        Add (1) or remove (-1) this order from sales counters, co-purchases and rollups.
+        ``paid_at`` is when a sale being removed was booked, if the order no longer says.
+        """
+        from .rollups import record_order_rollups
+
+        quantities = self.get_product_quantities()
+        record_sales(quantities, sign)
+        record_co_purchases(quantities, sign)
+        record_order_rollups(self, sign, paid_at)
+
+    # Fields save() compares against their stored values
+    TRACKED_FIELDS = ('status', 'payment_status', 'paid_at', 'stock_taken')
+    # Fields save() may fill in itself, so they're written when they change
+    DERIVED_FIELDS = ('paid', 'paid_at', 'shipped_at', 'delivered_at', 'stock_taken')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        # Also how deferred fields get loaded, one at a time
+        self._remember_loaded(fields)
+
+    def _remember_loaded(self, fields=None):
+        """Snapshot the loaded column values (or just ``fields``), as the database now has them"""
+        if fields is None:
+            self._loaded_values = {}
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (
+                fields is None or field.name in fields or field.attname in fields
+            ):
+                loaded[field.attname] = self.__dict__[field.attname]
+
+    def _stored_values(self):
+        """Tracked fields as stored, from the snapshot or (if not loaded) one query"""
+        loaded = getattr(self, '_loaded_values', {})
+        missing = [name for name in self.TRACKED_FIELDS if name not in loaded]
+        if missing:
+            stored = Order.objects.filter(pk=self.pk).values(*missing).get()
+            for name, value in stored.items():
+                # A deferred field is loaded along the way, an assigned one kept
+                if name not in self.__dict__:
+                    self.__dict__[name] = value
+                    if hasattr(self, '_loaded_values'):
+                        self._loaded_values[name] = value
+            loaded = {**loaded, **stored}
+        return loaded
+
+    def changed_fields(self):
+        """Names of the loaded (or since assigned) fields that differ from the snapshot"""
+        loaded = getattr(self, '_loaded_values', {})
+        return [
+            field.name
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname])
+        ]
+
     def save(self, *args, **kwargs):
-        """Auto-update timeline fields based on status changes"""
-        if self.pk:  # Existing order
-            old_order = Order.objects.get(pk=self.pk)
-            
+        """
+        Auto-update timeline fields based on status changes.
+
+        Old values come from the snapshot taken when the order was loaded,
+        so there's no extra SELECT, and a loaded order writes only the
+        columns that changed (nothing at all if none did).
+
+        Stock follows the same rule as ``orders.services.bulk_transition``:
+        becoming a sale takes every line's stock or raises ``PaymentError``
+        with nothing saved; no longer being one gives back what was taken.
+        """
+        from .reservations import release
+        from .services import settle_stock
+
+        existing = bool(self.pk)
+        was_sale = False
+        was_paid_at = None
+        was_cancelled = False
+        stock_was_taken = False
+        if existing:
+            old_order = self._stored_values()
+            was_sale = old_order['payment_status'] == 'completed' and old_order['status'] != 'cancelled'
+            was_paid_at = old_order['paid_at']
+            was_cancelled = old_order['status'] == 'cancelled'
+            stock_was_taken = old_order['stock_taken']
+
             # Track payment completion
-            if old_order.payment_status != 'completed' and self.payment_status == 'completed':
+            if old_order['payment_status'] != 'completed' and self.payment_status == 'completed':
                 if not self.paid_at:
                     self.paid_at = timezone.now()
                 self.paid = True # Sync paid boolean
-            
+
             # Track shipping
-            if old_order.status != 'shipped' and self.status == 'shipped':
+            if old_order['status'] != 'shipped' and self.status == 'shipped':
                 if not self.shipped_at:
                     self.shipped_at = timezone.now()
-            
+
             # Track delivery
-            if old_order.status != 'delivered' and self.status == 'delivered':
+            if old_order['status'] != 'delivered' and self.status == 'delivered':
                 if not self.delivered_at:
                     self.delivered_at = timezone.now()
         
-        # Strict sync: paid is True ONLY if payment_status is completed
         # Strict sync: paid is True ONLY if payment_status is completed
         self.paid = (self.payment_status == 'completed')
 
@@ -97,7 +207,33 @@ class Order(models.Model):
         elif not self.paid:
              self.paid_at = None
 
+        if self.counts_as_sale() == was_sale:
+            self._write(args, kwargs)
+        else:
+            # Stock, best-seller counters and rollups move with the order row
+            with transaction.atomic():
+                self.stock_taken = settle_stock(self, take=not was_sale, taken=stock_was_taken)
+                self._write(args, kwargs)
+                self.record_sales(1 if not was_sale else -1, paid_at=was_paid_at if was_sale else None)
+
+        # Paying or cancelling ends the order's stock holds
+        if existing and ((self.counts_as_sale() and not was_sale) or (self.status == 'cancelled' and not was_cancelled)):
+            release([self.pk])
+
+    def _write(self, args, kwargs):
+        if self.pk and hasattr(self, '_loaded_values') and not args and not kwargs.get('force_insert'):
+            changed = self.changed_fields()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = changed
+            else:
+                update_fields = [*update_fields, *(name for name in self.DERIVED_FIELDS if name in changed)]
+            if update_fields:
+                update_fields = {*update_fields, 'updated_at'}
+            kwargs['update_fields'] = update_fields
+
         super().save(*args, **kwargs)
+        self._remember_loaded()
 
     # ✅ METHOD USED BY ADMIN
     def total_price(self):
@@ -126,3 +262,112 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
+
+
+class StockReservation(models.Model):
+    """Units a pending order holds until it is paid or the hold expires (see orders.reservations)"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Active holds per product, and the sweeper's expired ones
+            models.Index(fields=['product', 'expires_at'], name='reservation_product_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x product #{self.product_id} for order #{self.order_id}"
+
+
+class OutboxEmail(models.Model):
+    """An email queued with the order change that caused it, sent later by a worker (see orders.outbox)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='emails')
+    template = models.CharField(max_length=200)
+    subject = models.CharField(max_length=200)
+    to = models.EmailField(max_length=254)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's queue: pending emails that are due
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """A checkout or payment submission already handled, and where it sent the customer (see orders.idempotency)"""
+    SCOPE_CHOICES = [
+        ('checkout', 'Checkout'),
+        ('payment', 'Payment'),
+    ]
+
+    scope = models.CharField(max_length=20, choices=SCOPE_CHOICES)
+    key = models.CharField(max_length=64)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    response_url = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='idempotency_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key}"
+
+
+class SalesRollup(models.Model):
+    """Net sales of one day: paid orders, less the ones cancelled since"""
+    date = models.DateField()
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    class Meta:
+        verbose_name_plural = "Daily sales"
+        constraints = [
+            models.UniqueConstraint(fields=['date'], name='daily_sales_date_uniq'),
+        ]
+
+
+class CategoryDailySales(SalesRollup):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        verbose_name_plural = "Category daily sales"
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'date'], name='category_daily_sales_uniq'),
+        ]
+
+
+class ProductDailySales(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        verbose_name_plural = "Product daily sales"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='product_daily_sales_uniq'),
+        ]
@@ -0,0 +1,128 @@
+"""
+Transactional email outbox.
+
+Emails about an order are not sent from the request that changes it.
+``queue_order_email`` writes an ``OutboxEmail`` row inside the same
+transaction as the order change, so the email exists exactly when the
+change committed and no request waits on SMTP.
+
+``manage.py send_outbox_emails`` drains the outbox: it claims due rows a
+batch at a time, renders each batch's templates with one query for the
+orders and their items, and sends them all over a single reused mail
+connection. A failed email is retried with exponential backoff
+(``OUTBOX_RETRY_DELAY`` seconds, doubling) and marked failed after
+``OUTBOX_MAX_ATTEMPTS``.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import Order, OrderItem, OutboxEmail
+
+
+ORDER_CONFIRMATION = 'orders/order_confirmation_email.html'
+# How long a claimed batch is kept from other workers
+CLAIM_TIMEOUT = timedelta(minutes=10)
+MAX_RETRY_DELAY = timedelta(hours=6)
+
+
+def get_max_attempts():
+    return getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+
+
+def get_retry_delay():
+    return getattr(settings, 'OUTBOX_RETRY_DELAY', 60)
+
+
+def retry_delay(attempts):
+    """Wait before the next try of an email that has failed ``attempts`` times."""
+    return min(timedelta(seconds=get_retry_delay() * 2 ** (attempts - 1)), MAX_RETRY_DELAY)
+
+
+def queue_order_email(order, subject, template=ORDER_CONFIRMATION):
+    """Queue an email about ``order`` to its customer; call it in the order's transaction."""
+    if not order.email:
+        return None
+    return OutboxEmail.objects.create(order=order, template=template, subject=subject, to=order.email)
+
+
+def _claim(batch_size):
+    """Due emails, pushed back by ``CLAIM_TIMEOUT`` so concurrent workers skip them."""
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'pk')[:batch_size]
+        )
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(next_attempt_at=now + CLAIM_TIMEOUT)
+    return emails
+
+
+def _orders(emails):
+    return Order.objects.prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+    ).in_bulk({email.order_id for email in emails})
+
+
+def _message(email, order):
+    html = render_to_string(email.template, {'order': order})
+    message = EmailMultiAlternatives(email.subject, strip_tags(html), settings.DEFAULT_FROM_EMAIL, [email.to])
+    message.attach_alternative(html, 'text/html')
+    return message
+
+
+def _send_batch(emails, connection):
+    orders = _orders(emails)
+    sent, failed = [], []
+    for email in emails:
+        try:
+            message = _message(email, orders[email.order_id])
+            message.connection = connection
+            message.send()
+        except Exception as e:
+            failed.append((email, e))
+            # The server may have dropped us; start the rest on a fresh connection
+            try:
+                connection.close()
+                connection.open()
+            except Exception:
+                pass
+        else:
+            sent.append(email.pk)
+
+    now = timezone.now()
+    OutboxEmail.objects.filter(pk__in=sent).update(status='sent', sent_at=now, last_error='')
+    for email, error in failed:
+        email.attempts += 1
+        email.last_error = f'{type(error).__name__}: {error}'
+        if email.attempts >= get_max_attempts():
+            email.status = 'failed'
+        else:
+            email.next_attempt_at = now + retry_delay(email.attempts)
+    OutboxEmail.objects.bulk_update(
+        [email for email, _error in failed], ['attempts', 'last_error', 'status', 'next_attempt_at'],
+    )
+    return len(sent), len(failed)
+
+
+def send_pending(batch_size=100):
+    """Send every due email, ``batch_size`` at a time; returns ``(sent, failed)``."""
+    sent = failed = 0
+    emails = _claim(batch_size)
+    if not emails:
+        return sent, failed
+    # One connection for the whole run, opened only when there is mail
+    with get_connection() as connection:
+        while emails:
+            batch_sent, batch_failed = _send_batch(emails, connection)
+            sent += batch_sent
+            failed += batch_failed
+            emails = _claim(batch_size)
+    return sent, failed
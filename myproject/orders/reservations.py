@@ -0,0 +1,81 @@
+"""
+Stock holds for pending orders.
+
+Checkout places a ``StockReservation`` per line that lasts
+``STOCK_RESERVATION_TTL`` seconds. Stock itself is only taken at payment,
+so what can still be sold is the stock minus the active (unexpired) holds:
+``with_available_to_sell`` annotates that onto any product queryset with
+one correlated subquery, and ``available_to_sell`` reads it for a set of
+products in one query.
+
+Paying or cancelling an order releases its holds. Abandoned orders' holds
+simply stop counting once they expire; ``manage.py
+release_expired_reservations`` deletes them in batches to keep the table
+small.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from store.models import Product
+from .models import StockReservation
+
+
+def get_reservation_ttl():
+    return getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60)
+
+
+def active_reservations():
+    return StockReservation.objects.filter(expires_at__gt=timezone.now())
+
+
+def held_units(product_ref='pk', exclude_order=None):
+    """Units held by active reservations of the product ``product_ref`` points at."""
+    holds = active_reservations().filter(product=OuterRef(product_ref))
+    if exclude_order is not None:
+        holds = holds.exclude(order=exclude_order)
+    totals = holds.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(totals), Value(0), output_field=IntegerField())
+
+
+def with_available_to_sell(queryset):
+    """Annotate ``available_to_sell`` (stock less active holds, at least 0)."""
+    return queryset.annotate(available_to_sell=Greatest(F('stock') - held_units(), Value(0)))
+
+
+def available_to_sell(product_ids):
+    """``{product_id: units}`` for ``product_ids``, in one query."""
+    return dict(
+        with_available_to_sell(Product.objects.filter(pk__in=product_ids)).values_list('pk', 'available_to_sell')
+    )
+
+
+def reserve(order, quantities):
+    """Hold ``{product_id: units}`` for ``order`` for the reservation TTL, one INSERT."""
+    expires_at = timezone.now() + timedelta(seconds=get_reservation_ttl())
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in quantities.items()
+        if quantity
+    ])
+
+
+def release(order_ids):
+    """Drop every hold of ``order_ids`` (paid or cancelled)."""
+    return StockReservation.objects.filter(order_id__in=order_ids).delete()[0]
+
+
+def release_expired(batch_size=1000, now=None):
+    """Delete expired holds ``batch_size`` at a time; returns how many went."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        batch = list(
+            StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return released
+        released += StockReservation.objects.filter(pk__in=batch).delete()[0]
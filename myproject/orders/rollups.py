@@ -0,0 +1,223 @@
+"""
+Daily sales rollups: totals per day, per category and day, per product and day.
+
+An order counts on the day it was paid (``paid_at`` in the current time
+zone), the same sales ``Order.counts_as_sale`` defines. Paying adds it to
+the three tables and cancelling takes it off again (``Order.record_sales``),
+with one insert-if-missing and one UPDATE of ``F()`` deltas per table.
+``manage.py backfill_sales_rollups`` recomputes any date range from
+order history, a chunk of days at a time; bulk order changes recompute
+just the days they touched (``refresh_rollups``).
+
+Charts read only these tables (``sales_series``), so their cost depends
+on the number of days shown, not the number of orders.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import CategoryDailySales, DailySales, Order, OrderItem, ProductDailySales
+
+
+GRANULARITIES = ('day', 'week', 'month')
+TRUNCATE = {'week': TruncWeek, 'month': TruncMonth}
+
+
+def sale_date(order, paid_at=None):
+    """Day an order's sale is booked on."""
+    return timezone.localdate(paid_at or order.paid_at or order.created_at)
+
+
+def _apply(model, key_field, deltas, day):
+    """Add ``deltas`` ({key: (orders, units, revenue)}) to ``day``'s rows of ``model``."""
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+    model.objects.bulk_create(
+        [model(**{'date': day, key_field: key}) for key in deltas],
+        ignore_conflicts=True,
+    )
+
+    def change(position, output_field):
+        return Case(
+            *[When(**{key_field: key}, then=Value(delta[position])) for key, delta in deltas.items()],
+            default=Value(0),
+            output_field=output_field,
+        )
+
+    model.objects.filter(date=day, **{f'{key_field}__in': deltas}).update(
+        orders=F('orders') + change(0, IntegerField()),
+        units=F('units') + change(1, IntegerField()),
+        revenue=F('revenue') + change(2, DecimalField(max_digits=14, decimal_places=2)),
+    )
+    if any(delta[0] < 0 for delta in deltas.values()):
+        # Drop rows the removal emptied, as a rebuild would not write them
+        model.objects.filter(date=day, orders=0, **{f'{key_field}__in': deltas}).delete()
+
+
+def record_order_rollups(order, sign=1, paid_at=None):
+    """
+    Add (``sign=1``) or remove (``sign=-1``) one order from the rollups.
+
+    ``paid_at`` overrides the order's own, for removing a sale whose
+    payment has since been cleared.
+    """
+    day = sale_date(order, paid_at)
+    products = defaultdict(lambda: [sign, 0, Decimal('0')])
+    categories = defaultdict(lambda: [sign, 0, Decimal('0')])
+    for product_id, category_id, quantity, subtotal in order.items.values_list(
+        'product_id', 'product__category_id', 'quantity', 'subtotal',
+    ):
+        for totals in (products[product_id], categories[category_id]):
+            totals[1] += quantity * sign
+            totals[2] += subtotal * sign
+    units = sum(units for _orders, units, _revenue in products.values())
+
+    with transaction.atomic():
+        _apply(DailySales, 'date', {day: (sign, units, order.total_amount * sign)}, day)
+        _apply(CategoryDailySales, 'category_id', categories, day)
+        _apply(ProductDailySales, 'product_id', products, day)
+
+
+def _sales(start, end):
+    """Orders counting as sales, booked on days ``start`` to ``end`` inclusive."""
+    tz = timezone.get_current_timezone()
+    since = timezone.make_aware(datetime.datetime.combine(start, datetime.time.min), tz)
+    until = timezone.make_aware(datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min), tz)
+    return Order.objects.filter(payment_status='completed').exclude(status='cancelled').filter(
+        Q(paid_at__gte=since, paid_at__lt=until)
+        | Q(paid_at__isnull=True, created_at__gte=since, created_at__lt=until)
+    )
+
+
+def rebuild_rollups(start, end):
+    """
+    Recompute the rollups of days ``start`` to ``end`` from order history.
+
+    A few grouped queries; the range's rows are replaced in one transaction.
+    Returns the number of daily rows written.
+    """
+    tz = timezone.get_current_timezone()
+    orders = _sales(start, end)
+    booked_on = TruncDate(Coalesce('paid_at', 'created_at'), tzinfo=tz)
+    item_booked_on = TruncDate(Coalesce('order__paid_at', 'order__created_at'), tzinfo=tz)
+    items = OrderItem.objects.filter(order__in=orders).annotate(day=item_booked_on)
+
+    daily = {
+        row['day']: DailySales(date=row['day'], orders=row['orders'], revenue=row['revenue'])
+        for row in orders.annotate(day=booked_on).values('day').annotate(
+            orders=Count('pk'), revenue=Sum('total_amount'),
+        ).order_by()
+    }
+    for row in items.values('day').annotate(units=Sum('quantity')).order_by():
+        daily[row['day']].units = row['units']
+    per_category = [
+        CategoryDailySales(date=row['day'], category_id=row['product__category'], **{
+            key: row[key] for key in ('orders', 'units', 'revenue')
+        })
+        for row in items.values('day', 'product__category').annotate(
+            orders=Count('order', distinct=True), units=Sum('quantity'), revenue=Sum('subtotal'),
+        ).order_by()
+    ]
+    per_product = [
+        ProductDailySales(date=row['day'], product_id=row['product'], **{
+            key: row[key] for key in ('orders', 'units', 'revenue')
+        })
+        for row in items.values('day', 'product').annotate(
+            orders=Count('order', distinct=True), units=Sum('quantity'), revenue=Sum('subtotal'),
+        ).order_by()
+    ]
+
+    with transaction.atomic():
+        for model in (DailySales, CategoryDailySales, ProductDailySales):
+            model.objects.filter(date__gte=start, date__lte=end).delete()
+        DailySales.objects.bulk_create(daily.values(), batch_size=1000)
+        CategoryDailySales.objects.bulk_create(per_category, batch_size=1000)
+        ProductDailySales.objects.bulk_create(per_product, batch_size=1000)
+    return len(daily)
+
+
+def booked_days(order_ids):
+    """The days the sales of ``order_ids`` are (or would be) booked on."""
+    return {
+        timezone.localdate(paid_at or created_at)
+        for paid_at, created_at in Order.objects.filter(pk__in=order_ids).values_list('paid_at', 'created_at')
+    }
+
+
+def refresh_rollups(days):
+    """
+    Recompute the rollups of ``days`` after a bulk change to their orders.
+
+    Runs of consecutive days are rebuilt together. Returns the number of
+    daily rows written.
+    """
+    written = 0
+    start = previous = None
+    for day in sorted(days) + [None]:
+        if start is not None and (day is None or day - previous > datetime.timedelta(days=1)):
+            written += rebuild_rollups(start, previous)
+            start = None
+        if start is None:
+            start = day
+        previous = day
+    return written
+
+
+def _bucket_starts(start, end, granularity):
+    if granularity == 'week':
+        day = start - datetime.timedelta(days=start.weekday())
+    elif granularity == 'month':
+        day = start.replace(day=1)
+    else:
+        day = start
+    while day <= end:
+        yield day
+        if granularity == 'week':
+            day += datetime.timedelta(days=7)
+        elif granularity == 'month':
+            day = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        else:
+            day += datetime.timedelta(days=1)
+
+
+def sales_series(start, end, granularity='day', category_id=None, product_id=None):
+    """
+    Orders, units and revenue per day/week/month from the rollups alone.
+
+    Returns one ``{'date', 'orders', 'units', 'revenue'}`` per bucket from
+    ``start`` to ``end``, empty buckets included.
+    """
+    if product_id is not None:
+        rows = ProductDailySales.objects.filter(product_id=product_id)
+    elif category_id is not None:
+        rows = CategoryDailySales.objects.filter(category_id=category_id)
+    else:
+        rows = DailySales.objects.all()
+    rows = rows.filter(date__gte=start, date__lte=end)
+    if granularity in TRUNCATE:
+        rows = rows.annotate(bucket=TRUNCATE[granularity]('date'))
+    else:
+        rows = rows.annotate(bucket=F('date'))
+    totals = {
+        row['bucket']: row
+        for row in rows.values('bucket').annotate(
+            total_orders=Sum('orders'), total_units=Sum('units'), total_revenue=Sum('revenue'),
+        ).order_by()
+    }
+
+    series = []
+    for day in _bucket_starts(start, end, granularity):
+        row = totals.get(day, {})
+        series.append({
+            'date': day,
+            'orders': row.get('total_orders') or 0,
+            'units': row.get('total_units') or 0,
+            'revenue': row.get('total_revenue') or Decimal('0'),
+        })
+    return series
@@ -0,0 +1,450 @@
+"""
+Order workflows that touch many rows at once.
+
+``place_order`` turns a session cart into a pending order: the cart's
+products are locked and loaded in one query, every line is checked
+against available-to-sell, and the order, its items (one ``bulk_create``),
+their stock holds and the saved address are written in one transaction,
+so the query count doesn't grow with the cart.
+
+``pay_order`` completes the payment: with the order row locked, every
+line's stock is taken in a single conditional UPDATE (stock less other
+orders' holds ``>= n``), and the order is only marked paid if all of them
+had enough. Its confirmation email is queued in the same transaction
+(``orders.outbox``).
+
+Stock follows one rule wherever an order changes (``Order.save``,
+``pay_order``, ``bulk_transition``): an order that becomes a sale takes
+all of its lines' stock, counting other orders' holds as gone, or none of
+it; ``Order.stock_taken`` records that it did, and an order that stops
+being a sale gives back exactly that and nothing more.
+
+``bulk_transition`` moves a selection of orders to a new status (or marks
+them paid) with set-based UPDATEs instead of a ``save()`` per order: the
+eligible orders are locked, their timeline fields are filled with
+``Coalesce`` so existing timestamps are kept, and the side effects
+``Order.save`` would have had (sales counters, co-purchases, rollups) are
+applied for the whole batch: products with one UPDATE per distinct
+quantity, rollups by recomputing the days touched. Stock follows the same
+rule as the storefront: marking paid checks each order against the stock
+left by the ones before it (less other orders' holds) and leaves short
+orders unpaid; ``Order.stock_taken`` records which orders took stock, and
+cancelling gives back only theirs. It all runs in one transaction,
+``CHUNK_SIZE`` orders per statement.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import UserProfile
+from store.bestsellers import sales_updates
+from store.cache import bump_catalog_version
+from store.models import Category, Product
+from store.related import record_co_purchases_many
+from .models import Order, OrderItem
+from .outbox import queue_order_email
+from .reservations import active_reservations, held_units, release, reserve, with_available_to_sell
+from .rollups import booked_days, refresh_rollups
+
+
+CHUNK_SIZE = 2000
+
+ADDRESS_FIELDS = ('pincode', 'address_line1', 'address_line2', 'landmark', 'city', 'state')
+
+# Statuses each status can be reached from
+STATUS_TRANSITIONS = {
+    'processing': ('pending',),
+    'shipped': ('pending', 'processing'),
+    'delivered': ('pending', 'processing', 'shipped'),
+    'cancelled': ('pending', 'processing', 'shipped'),
+}
+TRANSITIONS = ('paid', *STATUS_TRANSITIONS)
+
+
+def _changes(target, now):
+    """Eligibility filter and column updates of one transition."""
+    if target == 'paid':
+        return (
+            ~Q(payment_status='completed') & ~Q(status='cancelled'),
+            {'payment_status': 'completed', 'paid': True, 'paid_at': Coalesce(F('paid_at'), Value(now))},
+        )
+    changes = {'status': target}
+    if target in ('shipped', 'delivered'):
+        changes['shipped_at'] = Coalesce(F('shipped_at'), Value(now))
+    if target == 'delivered':
+        changes['delivered_at'] = Coalesce(F('delivered_at'), Value(now))
+    return Q(status__in=STATUS_TRANSITIONS[target]), changes
+
+
+def apply_sales(sold, stock, sign):
+    """
+    Count (``sign=1``) or uncount (``sign=-1``) sold units and take or give
+    back stock, both ``{product_id: units}``.
+
+    One UPDATE per distinct ``(sold, stock)`` pair rather than a ``CASE`` arm
+    per product. ``stock`` must be what was checked (taking) or recorded as
+    taken (giving back), so it is moved exactly. A restock makes the
+    product available; a product sold down to zero becomes unavailable.
+    """
+    groups = defaultdict(list)
+    for product_id in sold.keys() | stock.keys():
+        key = (sold.get(product_id, 0), stock.get(product_id, 0))
+        if any(key):
+            groups[key].append(product_id)
+    now = timezone.now()
+    for (units, moved), product_ids in groups.items():
+        products = Product.objects.filter(pk__in=product_ids)
+        updates = {'updated_at': now}
+        if units:
+            updates.update(sales_updates(sign * units))
+        if moved:
+            updates['stock'] = F('stock') - sign * moved
+            if sign > 0:
+                updates['is_available'] = Case(When(stock=moved, then=Value(False)), default=F('is_available'))
+                # Checked under lock already; this only guards against that check being bypassed
+                products = products.filter(stock__gte=moved)
+            else:
+                updates['is_available'] = Value(True)
+        if products.update(**updates) != len(product_ids):
+            raise PaymentError('Stock changed while the orders were being paid; try again.')
+
+
+def _order_lines(order_ids):
+    """``{order_id: {product_id: units}}`` for ``order_ids``, in one query."""
+    lines = defaultdict(Counter)
+    for order_id, product_id, quantity in OrderItem.objects.filter(order_id__in=order_ids).values_list(
+        'order_id', 'product_id', 'quantity',
+    ):
+        lines[order_id][product_id] += quantity
+    return lines
+
+
+def _allocate_stock(order_ids, lines):
+    """
+    The orders of ``order_ids`` (in that order) whose stock can be taken.
+
+    Each order needs every line covered by the stock the earlier ones left,
+    less active holds of other orders, like ``take_stock`` checks a single
+    order. The products are locked while this is decided.
+    """
+    product_ids = set().union(*lines.values()) if lines else set()
+    stock = dict(
+        Product.objects.filter(pk__in=product_ids).select_for_update().order_by('pk').values_list('pk', 'stock')
+    )
+    holds = active_reservations().filter(product_id__in=product_ids).order_by()
+    held = Counter(dict(holds.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')))
+    own = defaultdict(Counter)
+    for order_id, product_id, quantity in holds.filter(order_id__in=order_ids).values_list(
+        'order_id', 'product_id', 'quantity',
+    ):
+        own[order_id][product_id] += quantity
+
+    allocated = []
+    for order_id in order_ids:
+        quantities = lines.get(order_id, {})
+        if all(
+            product_id in stock and stock[product_id] - (held[product_id] - own[order_id][product_id]) >= quantity
+            for product_id, quantity in quantities.items()
+        ):
+            for product_id, quantity in quantities.items():
+                stock[product_id] -= quantity
+                # Paying releases the order's own holds
+                held[product_id] -= own[order_id][product_id]
+            allocated.append(order_id)
+    return allocated
+
+
+def _co_purchases(lines, order_ids, sign):
+    record_co_purchases_many([lines[order_id].keys() for order_id in order_ids if order_id in lines], sign)
+
+
+def _total(lines, order_ids):
+    quantities = Counter()
+    for order_id in order_ids:
+        quantities.update(lines.get(order_id, {}))
+    return quantities
+
+
+def _catalog_changed(product_ids):
+    # update() skips the signals behind category covers and the page cache
+    Category.refresh_covers(set(Product.objects.filter(pk__in=product_ids).values_list('category_id', flat=True)))
+    bump_catalog_version()
+
+
+def settle_stock(order, take, taken=False):
+    """
+    Stock for ``order`` starting (``take``) or stopping to count as a sale.
+
+    Starting takes every line through ``take_stock`` (``PaymentError`` if
+    one is short); stopping gives back the lines only if their stock was
+    ``taken``. Returns the order's new ``stock_taken``. Used by
+    ``Order.save``, in its transaction.
+    """
+    quantities = order.get_product_quantities() if order.pk else {}
+    if take:
+        take_stock(quantities, order=order)
+    elif taken:
+        apply_sales({}, quantities, -1)
+    if quantities and (take or taken):
+        _catalog_changed(quantities)
+    return take and bool(quantities)
+
+
+def bulk_transition(queryset, target, user=None):
+    """
+    Apply ``target`` (``'paid'`` or a status) to the orders of ``queryset``.
+
+    Orders the transition doesn't apply to (e.g. shipping a cancelled
+    order) are left alone, as are orders marked paid without the stock to
+    cover them. Returns ``(updated, skipped, short)``: ``skipped`` counts
+    the former, ``short`` the latter.
+    """
+    if target not in TRANSITIONS:
+        raise ValueError(f'Unknown order transition {target!r}')
+    now = timezone.now()
+    eligible, changes = _changes(target, now)
+    changes.update(updated_at=now, updated_by=user)
+    selected = Order.objects.filter(pk__in=queryset.values('pk'))
+
+    products = set()
+    days = set()
+    updated = short = 0
+    with transaction.atomic():
+        order_ids = list(
+            selected.filter(eligible).select_for_update().order_by('pk').values_list('pk', flat=True)
+        )
+        for start in range(0, len(order_ids), CHUNK_SIZE):
+            chunk = order_ids[start:start + CHUNK_SIZE]
+            if target == 'cancelled':
+                # Paid orders were counted as sales; only those that took stock give it back
+                sales, taken = [], []
+                for pk, payment_status, stock_taken in Order.objects.filter(pk__in=chunk).values_list(
+                    'pk', 'payment_status', 'stock_taken',
+                ):
+                    if payment_status == 'completed':
+                        sales.append(pk)
+                    if stock_taken:
+                        taken.append(pk)
+                lines = _order_lines(set(sales) | set(taken))
+                Order.objects.filter(pk__in=chunk).update(**changes, stock_taken=False)
+                apply_sales(_total(lines, sales), _total(lines, taken), -1)
+                _co_purchases(lines, sales, -1)
+                products.update(*(lines[pk].keys() for pk in lines))
+                days.update(booked_days(sales))
+                release(chunk)
+                updated += len(chunk)
+            elif target == 'paid':
+                lines = _order_lines(chunk)
+                paid = _allocate_stock(chunk, lines)
+                with_lines = [pk for pk in paid if pk in lines]
+                Order.objects.filter(pk__in=paid).update(
+                    **changes, stock_taken=Case(When(pk__in=with_lines, then=Value(True)), default=Value(False)),
+                )
+                quantities = _total(lines, paid)
+                apply_sales(quantities, quantities, 1)
+                _co_purchases(lines, paid, 1)
+                products.update(quantities)
+                days.update(booked_days(paid))
+                release(paid)
+                updated += len(paid)
+                short += len(chunk) - len(paid)
+            else:
+                Order.objects.filter(pk__in=chunk).update(**changes)
+                updated += len(chunk)
+        # Recounting the touched days beats a CASE arm per product and day
+        refresh_rollups(days)
+
+        if products:
+            Category.refresh_covers(set(
+                Product.objects.filter(pk__in=products).values_list('category_id', flat=True)
+            ))
+    if products:
+        bump_catalog_version()
+    return updated, selected.count() - len(order_ids), short
+
+
+class CheckoutError(ValueError):
+    """The cart can't be turned into an order; the message is for the customer."""
+
+
+def cart_lines(cart, lock=False):
+    """
+    The session cart's lines with their products, loaded in one query.
+
+    Products come annotated with ``available_to_sell``; ``lock`` locks
+    their rows until the end of the transaction. Malformed entries and
+    products that no longer exist are skipped. Returns ``(lines, total)``;
+    each line has ``product``, ``quantity``, ``price`` and ``subtotal``.
+    """
+    entries = {}
+    for product_id, item in cart.items():
+        # Skip if item is not a dictionary (malformed data)
+        if not isinstance(item, dict):
+            continue
+        try:
+            entries[int(product_id)] = (item.get("quantity", 1), float(item.get("price", 0)))
+        except (TypeError, ValueError):
+            continue
+
+    products = with_available_to_sell(Product.objects.filter(pk__in=entries))
+    if lock:
+        # Checkouts sharing products queue up instead of both reserving the last units
+        products = products.select_for_update().order_by('pk')
+    products = {product.pk: product for product in products}
+    lines = []
+    total = 0
+    for product_id, (quantity, price) in entries.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        subtotal = price * quantity
+        lines.append({"product": product, "quantity": quantity, "price": price, "subtotal": subtotal})
+        total += subtotal
+    return lines, total
+
+
+def format_address(details):
+    """The combined address string kept on ``Order.address``."""
+    parts = [
+        f"{details.get('address_line1')}, {details.get('address_line2')}",
+        f"Landmark: {details['landmark']}" if details.get('landmark') else "",
+        f"{details.get('city')}, {details.get('state')} - {details.get('pincode')}",
+    ]
+    return "\n".join(filter(None, parts))
+
+
+def place_order(user, cart, details, save_address=False):
+    """
+    Create a pending order for ``cart`` and return it.
+
+    ``details`` holds the customer's ``full_name``, ``email``, ``phone`` and
+    address fields. Stock isn't taken until payment, but every line must be
+    available now and is held for the order (``orders.reservations``);
+    otherwise ``CheckoutError`` is raised and nothing is written.
+    """
+    with transaction.atomic():
+        lines, total = cart_lines(cart, lock=True)
+        if not lines:
+            raise CheckoutError("Your cart is empty!")
+        for line in lines:
+            product = line["product"]
+            if product.available_to_sell < line["quantity"]:
+                raise CheckoutError(
+                    f"⚠️ Stock Error: {product.name} only has {product.available_to_sell} items left. "
+                    "Please update your cart."
+                )
+
+        address = {field: details.get(field) for field in ADDRESS_FIELDS}
+        if user is not None and save_address:
+            UserProfile.objects.update_or_create(
+                user=user, defaults={'phone': details.get('phone'), **address},
+            )
+
+        order = Order.objects.create(
+            user=user,
+            full_name=details.get('full_name'),
+            email=details.get('email'),
+            phone=details.get('phone'),
+            **address,
+            address=format_address(details),
+            total_amount=total,
+            status='pending',
+            payment_status='pending',
+        )
+        # Items are priced here, so OrderItem.save() has nothing to add
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=line["product"],
+                quantity=line["quantity"],
+                price=line["price"],
+                subtotal=line["subtotal"],
+            )
+            for line in lines
+        ])
+        reserve(order, {line["product"].pk: line["quantity"] for line in lines})
+    return order
+
+
+class PaymentError(ValueError):
+    """The payment can't be completed; the message is for the customer."""
+
+
+def take_stock(quantities, order=None):
+    """
+    Take ``{product_id: units}`` off stock in one conditional UPDATE.
+
+    Units held for other orders don't count as there; ``order``'s own holds
+    do. Either every product has enough and all are decremented, or nothing
+    is and ``PaymentError`` names the products that fell short. Call it in
+    a transaction: rows are only changed by the database, so concurrent
+    payments can't oversell or lose an update.
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity}
+    if not quantities:
+        return
+    products, needed = _with_needed(quantities, order)
+    updated = products.filter(stock__gte=F('needed') + F('held')).update(
+        stock=F('stock') - needed,
+        is_available=Case(When(stock=needed, then=Value(False)), default=F('is_available')),
+        updated_at=timezone.now(),
+    )
+    if updated != len(quantities):
+        # The UPDATE may have matched some rows; the caller's rollback undoes them
+        raise PaymentError(f"Insufficient stock for {_short_names(products)}")
+
+
+def _with_needed(quantities, order):
+    needed = Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+    products = Product.objects.filter(pk__in=quantities).alias(
+        needed=needed, held=held_units(exclude_order=order),
+    )
+    return products, needed
+
+
+def _short_names(products):
+    short = products.filter(stock__lt=F('needed') + F('held')).values_list('name', flat=True)
+    return ', '.join(short) or 'an item that is no longer sold'
+
+
+def stock_shortfall(quantities, order=None):
+    """
+    What ``take_stock`` would complain about, without taking anything.
+
+    Returns ``''`` if every product has the units, else the names of the
+    ones that don't, for a form error.
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity}
+    if not quantities:
+        return ''
+    products, _needed = _with_needed(quantities, order)
+    if products.filter(stock__gte=F('needed') + F('held')).count() == len(quantities):
+        return ''
+    return _short_names(products)
+
+
+def pay_order(order_id):
+    """
+    Mark an order paid and take its stock, all or nothing.
+
+    Returns ``(order, paid_now)``; ``paid_now`` is False when the order had
+    already been paid (e.g. a double-submitted form). Raises
+    ``PaymentError`` without changing anything if a line is out of stock.
+    """
+    with transaction.atomic():
+        # Concurrent attempts to pay the same order queue up here
+        order = Order.objects.select_for_update().get(pk=order_id)
+        if order.payment_status == 'completed':
+            return order, False
+        order.payment_status = 'completed'
+        order.status = 'processing'
+        # Takes the stock (see settle_stock) and releases the holds
+        order.save()
+        queue_order_email(order, f"Order Confirmation #{order.pk}")
+    return order, True
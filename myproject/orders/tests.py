@@ -1,3 +1,786 @@
-from django.test import TestCase
+import csv
+import smtplib
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, connection
+from django.db.models import F, Q
+from django.forms.models import model_to_dict
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import UserProfile
+from store.models import Category, Product
+from store.bestsellers import refresh_recent_sales, trending_products
+from store.exports import stream_export
+from store.pagination import EstimatedCountPaginator
+from .admin import OrderAdminForm
+from .exports import ORDER_EXPORT
+from .models import (
+    CategoryDailySales, DailySales, IdempotencyKey, Order, OrderItem, OutboxEmail, ProductDailySales, StockReservation,
+)
+from .outbox import queue_order_email
+from .reservations import available_to_sell, reserve
+from .rollups import sales_series
+from .services import CheckoutError, PaymentError, bulk_transition, pay_order, place_order
+
+DETAILS = {
+    'full_name': 'Customer', 'email': 'customer@example.com', 'phone': '1',
+    'pincode': '110001', 'address_line1': '1 Road', 'address_line2': 'Area', 'landmark': '',
+    'city': 'Delhi', 'state': 'Delhi',
+}
+
+
+class AdminChangelistQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = Category.objects.create(name='Phones', slug='phones')
+        products = [
+            Product.objects.create(name=f'Phone {index}', slug=f'phone-{index}', price=Decimal('100'), category=category)
+            for index in range(3)
+        ]
+        customers = [User.objects.create_user(f'customer{index}') for index in range(5)]
+        orders = Order.objects.bulk_create([
+            Order(user=customers[index % 5], full_name=f'Customer {index}', phone='1', total_amount=Decimal('300'))
+            for index in range(120)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, price=Decimal('100'), quantity=1, subtotal=Decimal('100'))
+            for order in orders
+            for product in products
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertChangelistQueries(self, url_name, queries):
+        # Session and user, then a bounded count and the page itself
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_order_changelist(self):
+        response = self.assertChangelistQueries('admin:orders_order_changelist', 4)
+        self.assertContains(response, '300.00')
+
+    def test_order_item_changelist(self):
+        self.assertChangelistQueries('admin:orders_orderitem_changelist', 4)
+
+    def test_product_changelist(self):
+        # Plus the category filter's choices
+        self.assertChangelistQueries('admin:store_product_changelist', 5)
+
+
+class OrderExportTests(TestCase):
+    def test_customer_text_is_escaped_in_csv(self):
+        Order.objects.create(
+            full_name='=cmd|"/c calc"!A0', phone='+911234567890', city='@city', total_amount=Decimal('-5'),
+        )
+        header, row = csv.reader(StringIO(''.join(stream_export(Order.objects.all(), ORDER_EXPORT, 'csv'))))
+        values = dict(zip(header, row))
+        self.assertEqual(values['full_name'], '\'=cmd|"/c calc"!A0')
+        self.assertEqual(values['phone'], "'+911234567890")
+        self.assertEqual(values['city'], "'@city")
+        # Numbers are not text a spreadsheet could misread
+        self.assertEqual(values['total_amount'], '-5.00')
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Order.objects.bulk_create([Order(full_name='Customer', phone='1') for _ in range(30)])
+
+    def test_counts_exactly_up_to_the_cap(self):
+        paginator = EstimatedCountPaginator(Order.objects.order_by('pk'), 10)
+        self.assertEqual(paginator.count, 30)
+        self.assertEqual(paginator.num_pages, 3)
+
+    def test_falls_back_to_an_exact_count_without_estimates(self):
+        paginator = EstimatedCountPaginator(Order.objects.order_by('pk'), 10)
+        paginator.count_cap = 5
+        # SQLite can't estimate, so the last page must still be reachable
+        self.assertEqual(paginator.count, 30)
+        self.assertEqual(len(paginator.page(3)), 10)
+
+
+class OrderSaveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.product = Product.objects.create(
+            name='Phone', slug='phone', price=Decimal('100'), stock=10, category=category,
+        )
+        cls.order = Order.objects.create(full_name='Customer', phone='1', total_amount=Decimal('200'))
+        OrderItem.objects.create(order=cls.order, product=cls.product, price=Decimal('100'), quantity=2)
+
+    def test_status_change_is_one_query(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'shipped'
+        with self.assertNumQueries(1):
+            order.save()
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'shipped')
+        self.assertIsNotNone(order.shipped_at)
+
+    def test_only_changed_columns_are_written(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'delivered'
+        with self.assertNumQueries(1) as context:
+            order.save()
+        sql = context.captured_queries[0]['sql']
+        for column in ('"status"', '"delivered_at"', '"updated_at"'):
+            self.assertIn(column, sql)
+        self.assertNotIn('"full_name"', sql)
+
+    def test_unchanged_order_is_not_written(self):
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(0):
+            order.save()
+
+    def test_update_fields_adds_derived_fields(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'shipped'
+        order.full_name = 'Not saved'
+        with self.assertNumQueries(1):
+            order.save(update_fields=['status'])
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertIsNotNone(order.shipped_at)
+        self.assertEqual(order.full_name, 'Customer')
+
+    def test_deferred_status_is_read_once(self):
+        order = Order.objects.only('pk', 'full_name').get(pk=self.order.pk)
+        order.full_name = 'Renamed'
+        with self.assertNumQueries(2) as context:
+            order.save()
+        self.assertNotIn('"status"', context.captured_queries[1]['sql'])
+        self.assertEqual(Order.objects.get(pk=self.order.pk).full_name, 'Renamed')
+
+    def test_payment_counts_the_sale_once(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.payment_status = 'completed'
+        order.save()
+        self.assertIsNotNone(order.paid_at)
+        # The snapshot now says paid, so saving again doesn't count it twice
+        order.status = 'processing'
+        with self.assertNumQueries(1):
+            order.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.units_sold, 2)
+
+        order.status = 'cancelled'
+        order.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.units_sold, 0)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', password='password')
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Phone {index}', slug=f'phone-{index}', price=Decimal('10'), stock=5, category=category)
+            for index in range(100)
+        ])
+        UserProfile.objects.create(user=cls.customer)
+
+    def setUp(self):
+        self.client.force_login(self.customer)
+
+    def checkout(self, products, quantity=1):
+        session = self.client.session
+        session['cart'] = {str(product.pk): {'quantity': quantity, 'price': '10'} for product in products}
+        session.save()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('orders:checkout'), {**DETAILS, 'default_address': 'on'})
+        return response, len(context.captured_queries)
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        counts = []
+        for size in (1, 10, 100):
+            response, queries = self.checkout(self.products[:size])
+            order = Order.objects.latest('pk')
+            self.assertRedirects(response, reverse('orders:payment_page', args=[order.pk]), fetch_redirect_response=False)
+            self.assertEqual(order.items.count(), size)
+            self.assertEqual(order.total_amount, Decimal('10') * size)
+            counts.append(queries)
+        self.assertEqual(len(set(counts)), 1, counts)
+        self.assertEqual(UserProfile.objects.get(user=self.customer).city, 'Delhi')
+
+    def test_short_stock_writes_nothing(self):
+        response, _queries = self.checkout(self.products[:3], quantity=6)
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(UserProfile.objects.get(user=self.customer).city, '')
+
+
+def create_order(products, quantity=1):
+    order = Order.objects.create(full_name='Customer', phone='1', total_amount=Decimal('10') * len(products))
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, price=Decimal('10'), quantity=quantity, subtotal=Decimal('10') * quantity)
+        for product in products
+    ])
+    return order
+
+
+class PaymentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Phone {index}', slug=f'phone-{index}', price=Decimal('10'), stock=stock, category=category)
+            for index, stock in enumerate((5, 2, 1))
+        ])
+
+    def stock(self):
+        return list(Product.objects.order_by('pk').values_list('stock', 'is_available'))
+
+    def test_every_line_is_taken_together(self):
+        order = create_order(self.products[:2], quantity=2)
+        order, paid_now = pay_order(order.pk)
+        self.assertTrue(paid_now)
+        self.assertEqual(order.payment_status, 'completed')
+        self.assertEqual(self.stock(), [(3, True), (0, False), (1, True)])
+        self.assertEqual(pay_order(order.pk)[1], False)
+        self.assertEqual(self.stock()[0], (3, True))
+
+    def test_one_short_line_changes_nothing(self):
+        order = create_order(self.products, quantity=2)
+        with self.assertRaisesMessage(PaymentError, 'Phone 2'):
+            pay_order(order.pk)
+        self.assertEqual(self.stock(), [(5, True), (2, True), (1, True)])
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, 'pending')
+
+
+class BestsellerCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Phone {index}', slug=f'phone-{index}', price=Decimal('10'), stock=50, category=category)
+            for index in range(3)
+        ])
+
+    def counters(self):
+        return list(Product.objects.order_by('pk').values_list('units_sold', 'recent_units_sold'))
+
+    def test_payment_counts_and_cancellation_uncounts(self):
+        order = create_order(self.products[:2], quantity=3)
+        pay_order(order.pk)
+        self.assertEqual(self.counters(), [(3, 3), (3, 3), (0, 0)])
+        # Paying again is a no-op
+        pay_order(order.pk)
+        self.assertEqual(self.counters(), [(3, 3), (3, 3), (0, 0)])
+
+        bulk_transition(Order.objects.filter(pk=order.pk), 'cancelled')
+        self.assertEqual(self.counters(), [(0, 0), (0, 0), (0, 0)])
+
+    def test_cancelling_an_unpaid_order_counts_nothing(self):
+        paid = create_order(self.products[:1], quantity=2)
+        pay_order(paid.pk)
+        unpaid = create_order(self.products[:1], quantity=4)
+        bulk_transition(Order.objects.filter(pk=unpaid.pk), 'cancelled')
+        self.assertEqual(self.counters()[0], (2, 2))
+
+    def test_bulk_payment_counts_every_order(self):
+        orders = [create_order(self.products, quantity=quantity) for quantity in (1, 2, 2)]
+        bulk_transition(Order.objects.filter(pk__in=[order.pk for order in orders]), 'paid')
+        self.assertEqual(self.counters(), [(5, 5), (5, 5), (5, 5)])
+
+    def test_refresh_ages_sales_out_of_the_window(self):
+        old, recent = create_order(self.products[:1], quantity=4), create_order(self.products[:1], quantity=1)
+        for order in (old, recent):
+            pay_order(order.pk)
+        Order.objects.filter(pk=old.pk).update(paid_at=timezone.now() - timedelta(days=60))
+        Product.objects.update(units_sold=0)
+
+        refresh_recent_sales(days=30, lifetime=True)
+        self.assertEqual(self.counters()[0], (5, 1))
+        self.assertEqual(list(trending_products(1)), [self.products[0]])
+
+
+class OrderStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.product = Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), stock=2, category=category)
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock, self.product.is_available, self.product.units_sold
+
+    def order(self, quantity):
+        return Order.objects.get(pk=create_order([self.product], quantity).pk)
+
+    def transition(self, orders, target):
+        return bulk_transition(Order.objects.filter(pk__in=[order.pk for order in orders]), target)
+
+    def test_bulk_payment_skips_orders_the_stock_cannot_cover(self):
+        too_big, fits = self.order(5), self.order(2)
+        self.assertEqual(self.transition([too_big, fits], 'paid'), (1, 0, 1))
+        self.assertEqual(self.stock(), (0, False, 2))
+        too_big.refresh_from_db()
+        self.assertEqual((too_big.payment_status, too_big.paid_at, too_big.stock_taken), ('pending', None, False))
+
+        # Cancelling the short order gives nothing back; the paid one returns its units
+        self.assertEqual(self.transition([too_big], 'cancelled'), (1, 0, 0))
+        self.assertEqual(self.stock(), (0, False, 2))
+        self.transition([fits], 'cancelled')
+        self.assertEqual(self.stock(), (2, True, 0))
+
+    def test_orders_in_one_batch_share_the_stock(self):
+        first, second = self.order(2), self.order(1)
+        self.assertEqual(self.transition([first, second], 'paid'), (1, 0, 1))
+        self.assertEqual(Order.objects.get(pk=first.pk).payment_status, 'completed')
+
+    def test_other_orders_holds_are_not_sold(self):
+        held = self.order(1)
+        reserve(held, {self.product.pk: 1})
+        self.assertEqual(self.transition([self.order(2)], 'paid'), (0, 0, 1))
+        # An order's own hold is its to use, and paying releases it
+        self.assertEqual(self.transition([held], 'paid'), (1, 0, 0))
+        self.assertEqual(self.stock(), (1, True, 1))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_paid_at_checkout_gives_back_on_bulk_cancel(self):
+        order, paid_now = pay_order(self.order(2).pk)
+        self.assertTrue(paid_now and Order.objects.get(pk=order.pk).stock_taken)
+        self.assertEqual(self.stock(), (0, False, 2))
+        self.transition([order], 'cancelled')
+        self.assertEqual(self.stock(), (2, True, 0))
+
+    def test_save_takes_stock_all_or_nothing(self):
+        order = self.order(3)
+        order.payment_status = 'completed'
+        with self.assertRaisesMessage(PaymentError, 'Insufficient stock for Phone'):
+            order.save()
+        self.assertEqual(Order.objects.get(pk=order.pk).payment_status, 'pending')
+        self.assertEqual(self.stock(), (2, True, 0))
+
+        order = self.order(2)
+        order.payment_status = 'completed'
+        order.save()
+        self.assertTrue(Order.objects.get(pk=order.pk).stock_taken)
+        self.assertEqual(self.stock(), (0, False, 2))
+
+    def test_save_and_bulk_transition_give_back_what_the_other_took(self):
+        by_save = self.order(2)
+        by_save.payment_status = 'completed'
+        by_save.save()
+        self.transition([by_save], 'cancelled')
+        self.assertEqual(self.stock(), (2, True, 0))
+
+        by_bulk = self.order(2)
+        self.transition([by_bulk], 'paid')
+        by_bulk = Order.objects.get(pk=by_bulk.pk)
+        by_bulk.payment_status = 'failed'
+        by_bulk.save()
+        self.assertEqual(self.stock(), (2, True, 0))
+        # No longer a sale: cancelling it now gives back nothing more
+        by_bulk.status = 'cancelled'
+        by_bulk.save()
+        self.transition([by_bulk], 'cancelled')
+        self.assertEqual(self.stock(), (2, True, 0))
+
+    def test_sales_that_never_took_stock_give_none_back(self):
+        legacy = self.order(2)
+        legacy.payment_status = 'completed'
+        legacy.save()
+        Order.objects.filter(pk=legacy.pk).update(stock_taken=False)
+        Product.objects.filter(pk=self.product.pk).update(stock=2, is_available=True)
+        self.transition([legacy], 'cancelled')
+        self.assertEqual(self.stock(), (2, True, 0))
+    def test_admin_form_reports_short_stock(self):
+        order = self.order(3)
+        address = dict.fromkeys(['pincode', 'address_line1', 'address_line2', 'city', 'state'], 'x')
+        data = {**model_to_dict(order), **address, 'payment_status': 'completed'}
+        form = OrderAdminForm(data=data, instance=order)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.non_field_errors(), ['Insufficient stock for Phone.'])
+        data['payment_status'] = 'failed'
+        form = OrderAdminForm(data=data, instance=order)
+        self.assertTrue(form.is_valid(), form.errors)
+
+
+class BulkTransitionScaleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Phone {index}', slug=f'phone-{index}', price=Decimal('10'), stock=400, category=category)
+            for index in range(20)
+        ])
+        orders = Order.objects.bulk_create([
+            Order(full_name='Customer', phone='1', total_amount=Decimal('10')) for _ in range(10000)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=cls.products[index % 20], price=Decimal('10'), quantity=1, subtotal=Decimal('10'))
+            for index, order in enumerate(orders)
+        ], batch_size=2000)
+
+    def product_rows(self):
+        return set(Product.objects.values_list('stock', 'is_available', 'units_sold'))
+
+    def test_ten_thousand_orders(self):
+        with CaptureQueriesContext(connection) as context:
+            updated, skipped, short = bulk_transition(Order.objects.all(), 'paid')
+        # Statements per chunk of orders, not per order
+        self.assertLess(len(context.captured_queries), 100)
+        self.assertEqual((updated, skipped, short), (8000, 0, 2000))
+        self.assertEqual(self.product_rows(), {(0, False, 400)})
+        paid = Order.objects.filter(payment_status='completed')
+        self.assertEqual(paid.filter(paid_at__isnull=False, stock_taken=True, paid=True).count(), 8000)
+        self.assertEqual(Order.objects.filter(paid_at__isnull=True, stock_taken=False).count(), 2000)
+        self.assertEqual(DailySales.objects.get().orders, 8000)
+
+        paid_at = paid.values_list('paid_at', flat=True).first()
+        self.assertEqual(bulk_transition(paid, 'shipped')[0], 8000)
+        self.assertEqual(bulk_transition(Order.objects.all(), 'delivered')[0], 10000)
+        self.assertEqual(set(paid.values_list('paid_at', 'status')), {(paid_at, 'delivered')})
+        self.assertFalse(paid.filter(Q(shipped_at__isnull=True) | Q(delivered_at__lt=F('shipped_at'))).exists())
+
+        # Delivered orders can't be cancelled; reopen them to check the stock comes back
+        Order.objects.update(status='processing')
+        self.assertEqual(bulk_transition(Order.objects.all(), 'cancelled')[0], 10000)
+        self.assertEqual(self.product_rows(), {(400, True, 0)})
+        self.assertFalse(Order.objects.filter(stock_taken=True).exists())
+        self.assertFalse(DailySales.objects.exists())
+
+
+class RollupConsistencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        phones = Category.objects.create(name='Phones', slug='phones')
+        cases = Category.objects.create(name='Cases', slug='cases')
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name=f'Product {index}', slug=f'product-{index}', price=Decimal('10'), stock=1000,
+                category=phones if index % 2 else cases,
+            )
+            for index in range(4)
+        ])
+
+    def order(self, products, quantity=1):
+        return Order.objects.get(pk=create_order(products, quantity).pk)
+
+    def paid_days_ago(self, products, days, quantity=1):
+        order = self.order(products, quantity)
+        order.paid_at = timezone.now() - timedelta(days=days)
+        order.payment_status = 'completed'
+        order.save()
+        return order
+
+    def tables(self):
+        return {
+            'daily': set(DailySales.objects.values_list('date', 'orders', 'units', 'revenue')),
+            'category': set(CategoryDailySales.objects.values_list('date', 'category_id', 'orders', 'units', 'revenue')),
+            'product': set(ProductDailySales.objects.values_list('date', 'product_id', 'orders', 'units', 'revenue')),
+        }
+
+    def test_incremental_rollups_match_a_backfill(self):
+        products = self.products
+        self.paid_days_ago(products[:3], 3, quantity=2)
+        cancelled = self.paid_days_ago(products[1:], 3)
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        bulk_cancelled = self.paid_days_ago(products[:2], 1, quantity=3)
+        failed = self.paid_days_ago(products[2:], 1)
+        failed.payment_status = 'failed'
+        failed.save()
+        pay_order(self.order(products, quantity=2).pk)
+        bulk = [self.order(products[:1]), self.order(products[1:3], quantity=4)]
+        bulk_transition(Order.objects.filter(pk__in=[order.pk for order in bulk]), 'paid')
+        bulk_transition(Order.objects.filter(pk__in=[bulk_cancelled.pk, self.order(products).pk]), 'cancelled')
+
+        incremental = self.tables()
+        self.assertEqual(len(incremental['daily']), 2)
+        self.assertEqual(sum(orders for _day, orders, _units, _revenue in incremental['daily']), 4)
+
+        call_command('backfill_sales_rollups', '--since', str(timezone.localdate() - timedelta(days=5)), stdout=StringIO())
+        self.assertEqual(self.tables(), incremental)
+
+        series = sales_series(timezone.localdate() - timedelta(days=3), timezone.localdate())
+        self.assertEqual([day['orders'] for day in series], [1, 0, 0, 3])
+        self.assertEqual(series[-1]['units'], 4 * 2 + 1 + 2 * 4)
+
+
+class ConcurrentPaymentTests(TransactionTestCase):
+    STOCK = 3
+    BUYERS = 8
+
+    def test_no_oversell_under_contention(self):
+        category = Category.objects.create(name='Phones', slug='phones')
+        product = Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), stock=self.STOCK, category=category)
+        orders = [create_order([product]) for _ in range(self.BUYERS)]
+        start = threading.Barrier(self.BUYERS)
+        paid, refused = [], []
+
+        def buy(order):
+            start.wait()
+            try:
+                for _attempt in range(500):
+                    try:
+                        pay_order(order.pk)
+                    except PaymentError:
+                        refused.append(order.pk)
+                    except OperationalError:
+                        # SQLite turns concurrent writers away instead of queueing them
+                        time.sleep(0.005)
+                        continue
+                    else:
+                        paid.append(order.pk)
+                    return
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=buy, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(len(paid), self.STOCK)
+        self.assertEqual(len(refused), self.BUYERS - self.STOCK)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.filter(payment_status='completed').count(), self.STOCK)
+
+
+class ReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.phone = Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), stock=5, category=category)
+        cls.case = Product.objects.create(name='Case', slug='case', price=Decimal('10'), stock=5, category=category)
+
+    def place(self, quantity, product=None):
+        product = product or self.phone
+        return place_order(None, {str(product.pk): {'quantity': quantity, 'price': '10'}}, DETAILS)
+
+    def test_checkout_holds_stock_until_paid(self):
+        order = self.place(3)
+        self.assertEqual(available_to_sell([self.phone.pk, self.case.pk]), {self.phone.pk: 2, self.case.pk: 5})
+        with self.assertRaisesMessage(CheckoutError, 'only has 2 items left'):
+            self.place(3)
+
+        pay_order(order.pk)
+        self.assertFalse(order.reservations.exists())
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.stock, 2)
+        self.assertEqual(available_to_sell([self.phone.pk]), {self.phone.pk: 2})
+
+    def test_payment_respects_other_orders_holds(self):
+        order = create_order([self.phone], quantity=3)
+        self.place(4)
+        with self.assertRaises(PaymentError):
+            pay_order(order.pk)
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.stock, 5)
+
+    def test_expired_holds_stop_counting_and_are_swept(self):
+        order = self.place(5)
+        StockReservation.objects.filter(order=order).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(available_to_sell([self.phone.pk]), {self.phone.pk: 5})
+        reserve(self.place(2, self.case), {self.case.pk: 1})
+
+        call_command('release_expired_reservations', batch_size=1, stdout=StringIO())
+        self.assertFalse(order.reservations.exists())
+        self.assertEqual(StockReservation.objects.count(), 2)
+
+    def test_available_to_sell_is_one_query(self):
+        self.place(1)
+        self.place(2, self.case)
+        with self.assertNumQueries(1):
+            self.assertEqual(available_to_sell([self.phone.pk, self.case.pk]), {self.phone.pk: 4, self.case.pk: 3})
+
+    def test_cancelling_a_pending_order_releases_its_holds(self):
+        customer = User.objects.create_user('customer', password='password')
+        order = self.place(5)
+        Order.objects.filter(pk=order.pk).update(user=customer)
+        self.client.force_login(customer)
+        self.client.get(reverse('orders:cancel_order', args=[order.pk]))
+        self.assertEqual(available_to_sell([self.phone.pk]), {self.phone.pk: 5})
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.stock, 5)
+
+
+class FailingBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+
+class OutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.product = Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), stock=50, category=category)
+
+    def paid_order(self):
+        order = create_order([self.product])
+        Order.objects.filter(pk=order.pk).update(email='customer@example.com')
+        return pay_order(order.pk)[0]
+
+    def send(self, batch_size=100):
+        call_command('send_outbox_emails', batch_size=batch_size, stdout=StringIO())
+
+    def test_payment_queues_the_confirmation_without_sending(self):
+        order = self.paid_order()
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.order, email.to, email.status), (order, 'customer@example.com', 'pending'))
+        self.assertEqual(mail.outbox, [])
+
+    def test_worker_sends_every_batch_over_one_connection(self):
+        orders = [self.paid_order() for _ in range(5)]
+        with mock.patch('orders.outbox.get_connection', wraps=get_connection) as connections:
+            self.send(batch_size=2)
+        self.assertEqual(connections.call_count, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].subject, f'Order Confirmation #{orders[0].pk}')
+        self.assertIn('Phone (x1)', mail.outbox[0].alternatives[0][0])
+        self.assertFalse(OutboxEmail.objects.exclude(status='sent').exists())
+
+        self.send()
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(EMAIL_BACKEND='orders.tests.FailingBackend', OUTBOX_MAX_ATTEMPTS=2)
+    def test_failures_back_off_then_give_up(self):
+        order = create_order([self.product])
+        order.email = 'customer@example.com'
+        queue_order_email(order, 'Hello')
+        self.send()
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIn('SMTPServerDisconnected', email.last_error)
+
+        # Not due yet
+        self.send()
+        self.assertEqual(OutboxEmail.objects.get().attempts, 1)
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.send()
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), ('failed', 2))
+
+
+def touched_tables(queries):
+    return {table for table in ('orders_order', 'orders_orderitem', 'store_product') if any(
+        f'"{table}"' in query['sql'] for query in queries
+    )}
+
+
+class IdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user('customer', password='password')
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.product = Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), stock=5, category=category)
+
+    def setUp(self):
+        self.login(self.customer)
+
+    def login(self, user):
+        self.client.force_login(user)
+        session = self.client.session
+        session['cart'] = {str(self.product.pk): {'quantity': 2, 'price': '10'}}
+        session.save()
+
+    def post(self, url, key, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, {**(data or {}), 'idempotency_key': key})
+        return response, touched_tables(context.captured_queries)
+
+    def test_repeated_checkout_returns_the_first_order(self):
+        first, _tables = self.post(reverse('orders:checkout'), 'checkout-1', DETAILS)
+        repeat, tables = self.post(reverse('orders:checkout'), 'checkout-1', DETAILS)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(repeat.url, first.url)
+        self.assertEqual(tables, set())
+
+        self.post(reverse('orders:checkout'), 'checkout-2', DETAILS)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_repeated_payment_returns_the_first_result(self):
+        order = create_order([self.product], quantity=2)
+        url = reverse('orders:process_payment', args=[order.pk])
+        first, _tables = self.post(url, 'payment-1')
+        repeat, tables = self.post(url, 'payment-1')
+        self.assertRedirects(repeat, reverse('orders:order_success', args=[order.pk]), fetch_redirect_response=False)
+        self.assertEqual(repeat.url, first.url)
+        self.assertEqual(tables, set())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_a_failed_submission_can_be_retried(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+        response, _tables = self.post(reverse('orders:checkout'), 'checkout-1', DETAILS)
+        self.assertRedirects(response, reverse('cart:cart_detail'), fetch_redirect_response=False)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        Product.objects.filter(pk=self.product.pk).update(stock=5)
+        self.post(reverse('orders:checkout'), 'checkout-1', DETAILS)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_another_users_key_is_refused(self):
+        self.post(reverse('orders:checkout'), 'checkout-1', DETAILS)
+        self.login(User.objects.create_user('someone'))
+        response, _tables = self.post(reverse('orders:checkout'), 'checkout-1', DETAILS)
+        self.assertEqual(response.status_code, 403)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    SUBMISSIONS = 6
+
+    def test_parallel_identical_posts_create_one_order(self):
+        customer = User.objects.create_user('customer', password='password')
+        category = Category.objects.create(name='Phones', slug='phones')
+        product = Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), stock=50, category=category)
+        clients = []
+        for _ in range(self.SUBMISSIONS):
+            client = Client()
+            client.force_login(customer)
+            session = client.session
+            session['cart'] = {str(product.pk): {'quantity': 1, 'price': '10'}}
+            session.save()
+            clients.append(client)
+        start = threading.Barrier(self.SUBMISSIONS)
+        redirects = []
+
+        def submit(client):
+            start.wait()
+            try:
+                for _attempt in range(500):
+                    try:
+                        response = client.post(reverse('orders:checkout'), {**DETAILS, 'idempotency_key': 'double-click'})
+                    except OperationalError:
+                        # SQLite turns concurrent writers away instead of queueing them
+                        time.sleep(0.005)
+                        continue
+                    redirects.append(response.url)
+                    return
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=submit, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        order = Order.objects.get()
+        self.assertEqual(redirects, [reverse('orders:payment_page', args=[order.pk])] * self.SUBMISSIONS)
+        self.assertEqual(order.items.count(), 1)
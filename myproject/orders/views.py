@@ -1,13 +1,13 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
-from django.conf import settings
-from store.models import Product
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.urls import reverse
 from accounts.models import UserProfile
-from .models import Order, OrderItem
+from .models import Order
+from .idempotency import new_key, run_once
+from .services import ADDRESS_FIELDS, CheckoutError, cart_lines, pay_order, place_order
 
 
 @login_required(login_url='accounts:login')
@@ -19,115 +19,32 @@ def checkout(request):
         messages.warning(request, "Your cart is empty!")
         return redirect("cart:cart_detail")
 
-    cart_items = []
-    total = 0
-
-    for product_id, item in cart.items():
-        # Skip if item is not a dictionary (malformed data)
-        if not isinstance(item, dict):
-            continue
-            
-        try:
-            product = get_object_or_404(Product, id=product_id)
-
-            quantity = item.get("quantity", 1)
-            price = float(item.get("price", 0))
-            subtotal = price * quantity
-
-            cart_items.append({
-                "product": product,
-                "quantity": quantity,
-                "price": price,
-                "subtotal": subtotal,
-            })
-
-            total += subtotal
-        except (ValueError, Product.DoesNotExist):
-            # Skip invalid items
-            continue
-
     if request.method == "POST":
-        # Final Stock Check
-        for item in cart_items:
-            product = item['product']
-            quantity = item['quantity']
-            if product.stock < quantity:
-                messages.error(request, f"⚠️ Stock Error: {product.name} only has {product.stock} items left. Please update your cart.")
-                return redirect("cart:cart_detail")
-
-        full_name = request.POST.get("full_name")
-        email = request.POST.get("email") # Capture email
-        phone = request.POST.get("phone")
-        
-        # Capture detailed address fields
-        pincode = request.POST.get("pincode")
-        address_line1 = request.POST.get("address_line1")
-        address_line2 = request.POST.get("address_line2")
-        landmark = request.POST.get("landmark")
-        city = request.POST.get("city")
-        state = request.POST.get("state")
-        
-        # Construct full address string for backward compatibility
-        full_address_parts = [
-            f"{address_line1}, {address_line2}",
-            f"Landmark: {landmark}" if landmark else "",
-            f"{city}, {state} - {pincode}"
-        ]
-        formatted_address = "\n".join(filter(None, full_address_parts))
-
-        # Save Default Address if requested
-        if request.user.is_authenticated and request.POST.get('default_address'):
-            UserProfile.objects.update_or_create(
-                user=request.user,
-                defaults={
-                    'phone': phone,
-                    'pincode': pincode,
-                    'address_line1': address_line1,
-                    'address_line2': address_line2,
-                    'landmark': landmark,
-                    'city': city,
-                    'state': state
-                }
+        details = {
+            field: request.POST.get(field)
+            for field in ('full_name', 'email', 'phone', *ADDRESS_FIELDS)
+        }
+
+        def create_order():
+            order = place_order(
+                request.user if request.user.is_authenticated else None,
+                cart,
+                details,
+                save_address=bool(request.POST.get('default_address')),
             )
+            # Store order ID in session for payment page
+            request.session['pending_order_id'] = order.id
+            # Redirect to payment page instead of clearing cart
+            return reverse("orders:payment_page", args=[order.id])
 
-        # Create order with pending status
-        order = Order.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            full_name=full_name,
-            email=email,
-            phone=phone,
-            
-            # Save breakdown
-            pincode=pincode,
-            address_line1=address_line1,
-            address_line2=address_line2,
-            landmark=landmark,
-            city=city,
-            state=state,
-            
-            # Save combined string
-            address=formatted_address,
-            
-            total_amount=total,
-            status='pending',
-            payment_status='pending'
-        )
-
-        # Create order items (but don't reduce stock yet - wait for payment)
-        for item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=item["product"],
-                quantity=item["quantity"],
-                price=item["price"],
-                subtotal=item["subtotal"],
-            )
-
-        # Store order ID in session for payment page
-        request.session['pending_order_id'] = order.id
+        try:
+            # A double-submitted form gets the first submission's order
+            return redirect(run_once(request, 'checkout', create_order))
+        except CheckoutError as e:
+            messages.error(request, str(e))
+            return redirect("cart:cart_detail")
 
-        # Redirect to payment page instead of clearing cart
-        return redirect("orders:payment_page", order_id=order.id)
+    cart_items, total = cart_lines(cart)
 
     # Get User Profile for Pre-filling
     user_profile = None
@@ -140,7 +57,8 @@ def checkout(request):
     return render(request, "orders/checkout.html", {
         "cart_items": cart_items,
         "total": total,
-        "user_profile": user_profile
+        "user_profile": user_profile,
+        "idempotency_key": new_key(),
     })
 
 
@@ -168,10 +86,7 @@ def cancel_order(request, order_id):
     order = get_object_or_404(Order, id=order_id, user=request.user)
     
     if order.status == 'pending':
-        # Restore stock for cancelled order
-        for item in order.items.all():
-            item.product.increase_stock(item.quantity)
-        
+        # Stock is only taken at payment; saving releases what checkout held
         order.status = 'cancelled'
         order.save()
         messages.success(request, f"Order #{order.id} has been cancelled successfully.")
@@ -200,41 +115,39 @@ def process_payment(request, order_id):
     # Only allow POST requests
     if request.method != 'POST':
         return redirect('orders:payment_page', order_id=order_id)
-    
-    order = get_object_or_404(Order, id=order_id)
-    
-    # Prevent duplicate payment processing
-    if order.payment_status == 'completed':
-        messages.info(request, 'This order has already been paid.')
-        return redirect('orders:order_success', order_id=order.id)
-    
+
+    def pay():
+        try:
+            # Stock and payment status change together, under a lock on the order
+            order, paid_now = pay_order(order_id)
+        except Order.DoesNotExist:
+            raise Http404("No Order matches the given query.")
+
+        # Prevent duplicate payment processing
+        if not paid_now:
+            messages.info(request, 'This order has already been paid.')
+        else:
+            # Safely clear cart
+            request.session.pop('cart', None)
+            request.session.modified = True
+            messages.success(request, 'Payment completed successfully!')
+        return reverse('orders:order_success', args=[order.id])
+
     try:
-        # Update order status
-        order.payment_status = 'completed'
-        order.status = 'processing'
-        order.save()
-        
-        # Now reduce stock after payment confirmation
-        for item in order.items.all():
-            item.product.reduce_stock(item.quantity)
-        
-        # Safely clear cart
-        request.session.pop('cart', None)
-        request.session.modified = True
-        
-        messages.success(request, 'Payment completed successfully!')
-        return redirect('orders:order_success', order_id=order.id)
-        
+        # A repeated submission is answered without touching the order
+        return redirect(run_once(request, 'payment', pay))
+    except (Http404, PermissionDenied):
+        raise
     except ValueError as e:
         # Stock reduction failed
         messages.error(request, f'Payment processing error: {str(e)}')
-        return redirect('orders:payment_page', order_id=order.id)
+        return redirect('orders:payment_page', order_id=order_id)
     except Exception as e:
         # Any other error
         messages.error(request, 'An error occurred while processing your payment. Please try again.')
-        return redirect('orders:payment_page', order_id=order.id)
+        return redirect('orders:payment_page', order_id=order_id)
 
 
 def thanks_visiting(request, order_id):
     """Render the thank you/project demonstration page"""
-    return render(request, "orders/thanks_visiting.html", {'order_id': order_id})
+    return render(request, "orders/thanks_visiting.html", {'order_id': order_id, 'idempotency_key': new_key()})
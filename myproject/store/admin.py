@@ -1,5 +1,9 @@
 from django.contrib import admin
+from django.utils import timezone
+from .cache import bump_catalog_version
+from .exports import PRODUCT_EXPORT, export_actions
 from .models import Category, Product, Review
+from .pagination import EstimatedCountPaginator
 
 
 @admin.register(Category)
@@ -15,8 +19,11 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ['category', 'is_available', 'created_at']
     search_fields = ['name', 'description']
     list_editable = ['price', 'stock', 'is_available']
+    list_select_related = ['category']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     prepopulated_fields = {'slug': ('name',)}
-    readonly_fields = ['admin_thumbnail', 'created_at']
+    readonly_fields = ['admin_thumbnail', 'created_at', 'updated_at']
     
     fieldsets = (
         ('Product Information', {
@@ -29,27 +36,36 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('image', 'admin_thumbnail')
         }),
         ('Metadata', {
-            'fields': ('created_at',)
+            'fields': ('created_at', 'updated_at')
         }),
     )
     
-    actions = ['make_available', 'make_unavailable', 'mark_out_of_stock']
+    actions = ['make_available', 'make_unavailable', 'mark_out_of_stock', *export_actions(PRODUCT_EXPORT)]
     
     def make_available(self, request, queryset):
-        updated = queryset.update(is_available=True)
+        updated = queryset.update(is_available=True, updated_at=timezone.now())
+        self._refresh_covers(queryset)
         self.message_user(request, f'{updated} product(s) marked as available.')
     make_available.short_description = 'Mark selected as available'
     
     def make_unavailable(self, request, queryset):
-        updated = queryset.update(is_available=False)
+        updated = queryset.update(is_available=False, updated_at=timezone.now())
+        self._refresh_covers(queryset)
         self.message_user(request, f'{updated} product(s) marked as unavailable.')
     make_unavailable.short_description = 'Mark selected as unavailable'
     
     def mark_out_of_stock(self, request, queryset):
-        updated = queryset.update(stock=0, is_available=False)
+        updated = queryset.update(stock=0, is_available=False, updated_at=timezone.now())
+        self._refresh_covers(queryset)
         self.message_user(request, f'{updated} product(s) marked as out of stock.')
     mark_out_of_stock.short_description = 'Mark as out of stock'
 
+    def _refresh_covers(self, queryset):
+        # queryset.update() skips the post_save signals that maintain covers
+        # and the catalog cache version
+        Category.refresh_covers(set(queryset.values_list('category_id', flat=True)))
+        bump_catalog_version()
+
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
@@ -0,0 +1,258 @@
+"""
+Read-only JSON catalog API.
+
+    GET /api/products/?fields=id,name,price&category=<slug>&search=&price=&in_stock=yes&sort=&per_page=&cursor=
+    GET /api/products/batch/?ids=1,2,3&slugs=a,b&fields=...
+    GET /api/products/<slug>/?fields=...
+    GET /api/categories/
+    GET /api/suggest/?q=<typed text>
+
+Every endpoint runs one query whatever the page size or field selection
+(asserted in store.tests; the category list adds one more when its cached
+counts are cold): ``fields`` narrows the selected columns and only joins
+the category when it is asked for. Suggestions come from the in-memory
+index of store.suggest and usually run no query at all. Responses are
+publicly cacheable for a short while and answer If-None-Match /
+If-Modified-Since from the catalog version, like the HTML pages.
+"""
+from collections import namedtuple
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.db.models import Q
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_safe
+
+from orders.reservations import with_available_to_sell
+
+from .cache import catalog_validators, get_catalog_version, set_validators
+from .facets import SORT_ORDERINGS, get_catalog_facets, get_price_filter, get_sort_ordering
+from .images import image_url
+from .models import Category, Product
+from .pagination import InvalidCursor, KeysetPaginator
+from .search import search_products
+from .suggest import suggest as suggest_names
+
+
+# Seconds clients and shared caches may reuse a response without revalidating
+API_MAX_AGE = 60
+BATCH_LIMIT = 100
+SUGGEST_LIMIT = 8
+SUGGEST_MAX_QUERY = 100
+
+Field = namedtuple('Field', ['columns', 'value'])
+
+
+def _category(product, request):
+    category = product.category
+    return {'id': category.pk, 'slug': category.slug, 'name': category.name}
+
+
+def _rating(product, request):
+    return {'average': product.get_average_rating(), 'count': product.rating_count}
+
+
+def _rating_histogram(product, request):
+    return {str(stars): count for stars, count, _percent in product.get_rating_histogram()}
+
+
+def _url(product, request):
+    return request.build_absolute_uri(reverse('product_detail', args=[product.slug]))
+
+
+PRODUCT_FIELDS = {
+    'id': Field((), lambda product, request: product.pk),
+    'slug': Field(('slug',), lambda product, request: product.slug),
+    'name': Field(('name',), lambda product, request: product.name),
+    'description': Field(('description',), lambda product, request: product.description),
+    'price': Field(('price',), lambda product, request: str(product.price)),
+    # What checkout would let a customer buy: stock less active holds
+    'stock': Field(('available_to_sell',), lambda product, request: product.available_to_sell),
+    'in_stock': Field(('available_to_sell',), lambda product, request: product.available_to_sell > 0),
+    'image': Field(('image',), lambda product, request: image_url(product.image, 640) or None),
+    'thumbnail': Field(('image',), lambda product, request: image_url(product.image, 240) or None),
+    'category': Field(('category__slug', 'category__name'), _category),
+    'rating': Field(('rating_sum', 'rating_count'), _rating),
+    'rating_histogram': Field(
+        ('rating_count',) + tuple(f'rating_{stars}_count' for stars in range(1, 6)),
+        _rating_histogram,
+    ),
+    'url': Field(('slug',), _url),
+    'created_at': Field(('created_at',), lambda product, request: product.created_at.isoformat()),
+    'updated_at': Field(('updated_at',), lambda product, request: product.updated_at.isoformat()),
+}
+
+DEFAULT_FIELDS = ['id', 'slug', 'name', 'price', 'in_stock', 'image', 'category', 'rating', 'url']
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def catalog_endpoint(view_func):
+    """
+    Turn a view returning a dict into a cacheable JSON endpoint.
+
+    Raising ``ApiError`` produces ``{"error": ...}`` with its status code.
+    """
+    @require_safe
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        etag, last_modified = catalog_validators(request, get_catalog_version())
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return set_validators(not_modified, etag, last_modified, public=True, max_age=API_MAX_AGE)
+        try:
+            data = view_func(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'error': str(error)}, status=error.status)
+        response = JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+        return set_validators(response, etag, last_modified, public=True, max_age=API_MAX_AGE)
+    return wrapper
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _get_fields(request):
+    fields = _split(request.GET.get('fields', '')) or DEFAULT_FIELDS
+    unknown = [name for name in fields if name not in PRODUCT_FIELDS]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(PRODUCT_FIELDS)}.")
+    return fields
+
+
+def _select(queryset, fields, extra=()):
+    """Restrict ``queryset`` to the columns ``fields`` (and ``extra``) need."""
+    columns = {column for name in fields for column in PRODUCT_FIELDS[name].columns}
+    columns.update(extra)
+    if 'available_to_sell' in columns:
+        columns.discard('available_to_sell')
+        if 'available_to_sell' not in queryset.query.annotations:
+            queryset = with_available_to_sell(queryset)
+    if any(column.startswith('category__') for column in columns):
+        queryset = queryset.select_related('category')
+    return queryset.only('id', *columns)
+
+
+def _serialize(product, fields, request):
+    return {name: PRODUCT_FIELDS[name].value(product, request) for name in fields}
+
+
+@catalog_endpoint
+def product_list(request):
+    fields = _get_fields(request)
+    products = Product.objects.filter(is_available=True)
+
+    search_query = request.GET.get('search', '')
+    if search_query:
+        products = search_products(products, search_query)
+    category_slug = request.GET.get('category', '')
+    if category_slug:
+        products = products.filter(category__slug=category_slug)
+    price_range = request.GET.get('price', '')
+    if price_range:
+        price_filter = get_price_filter(price_range)
+        if price_filter is None:
+            raise ApiError(f'Unknown price range: {price_range}.')
+        products = products.filter(price_filter)
+    if request.GET.get('in_stock') == 'yes':
+        products = with_available_to_sell(products).filter(available_to_sell__gt=0)
+
+    sort_by = request.GET.get('sort', 'relevance' if search_query else 'newest')
+    if sort_by not in SORT_ORDERINGS:
+        raise ApiError(f"Unknown sort: {sort_by}. Available: {', '.join(SORT_ORDERINGS)}.")
+    ordering = get_sort_ordering(sort_by, searching=bool(search_query))
+
+    # The cursor is built from the sort columns, so they are always loaded
+    sort_columns = [field.lstrip('-') for field in ordering if field.lstrip('-') != 'search_rank']
+    paginator = KeysetPaginator(_select(products, fields, sort_columns), ordering, per_page=request.GET.get('per_page'))
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        raise ApiError('Invalid cursor.')
+
+    return {
+        'results': [_serialize(product, fields, request) for product in page],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    }
+
+
+@catalog_endpoint
+def product_batch(request):
+    """Many products by ``ids`` and/or ``slugs``, in the order requested."""
+    fields = _get_fields(request)
+    ids = _split(request.GET.get('ids', ''))
+    slugs = _split(request.GET.get('slugs', ''))
+    if not ids and not slugs:
+        raise ApiError('Pass ids and/or slugs as comma-separated lists.')
+    if len(ids) + len(slugs) > BATCH_LIMIT:
+        raise ApiError(f'At most {BATCH_LIMIT} products per batch.')
+    try:
+        ids = [int(pk) for pk in ids]
+    except ValueError:
+        raise ApiError('ids must be integers.')
+
+    products = _select(
+        Product.objects.filter(Q(pk__in=ids) | Q(slug__in=slugs), is_available=True),
+        fields,
+        extra=['slug'],
+    )
+    by_id = {}
+    by_slug = {}
+    for product in products:
+        by_id[product.pk] = by_slug[product.slug] = product
+
+    requested = [(pk, by_id.get(pk)) for pk in ids] + [(slug, by_slug.get(slug)) for slug in slugs]
+    return {
+        'results': [_serialize(product, fields, request) for _key, product in requested if product],
+        'missing': [key for key, product in requested if product is None],
+    }
+
+
+@catalog_endpoint
+def product_detail(request, slug):
+    fields = _get_fields(request)
+    product = _select(Product.objects.filter(slug=slug, is_available=True), fields).first()
+    if product is None:
+        raise ApiError('Product not found.', status=404)
+    return _serialize(product, fields, request)
+
+
+@catalog_endpoint
+def category_list(request):
+    # Product counts come from the listing's catalog facets, cached per version
+    categories = list(Category.objects.all())
+    facets = get_catalog_facets(Product.objects.filter(is_available=True), categories)
+    return {
+        'results': [
+            {
+                'id': category.pk,
+                'slug': category.slug,
+                'name': category.name,
+                'product_count': facets['categories'][category.pk],
+            }
+            for category in categories
+        ],
+    }
+
+
+@catalog_endpoint
+def suggest(request):
+    """Typeahead for the search box: matching categories, then products."""
+    query = request.GET.get('q', '').strip()[:SUGGEST_MAX_QUERY]
+    products_url = reverse('products_list')
+    suggestions = []
+    for suggestion in suggest_names(query, SUGGEST_LIMIT):
+        if suggestion['type'] == 'category':
+            url = f"{products_url}?{urlencode({'category': suggestion['slug']})}"
+        else:
+            url = reverse('product_detail', args=[suggestion['slug']])
+        suggestions.append({'type': suggestion['type'], 'text': suggestion['text'], 'url': url})
+    return {'query': query, 'suggestions': suggestions}
@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
+
+
+def suspend_search_index(sender, using, **kwargs):
+    from .search import suspend_search_index
+    suspend_search_index(using)
+
+
+def install_search_index(sender, using, **kwargs):
+    from .search import install_search_index
+    install_search_index(using)
 
 
 class StoreConfig(AppConfig):
     name = 'store'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        pre_migrate.connect(suspend_search_index, sender=self)
+        post_migrate.connect(install_search_index, sender=self)
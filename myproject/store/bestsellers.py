@@ -0,0 +1,77 @@
+"""
+Materialized best-seller counters.
+
+Paying for an order adds its quantities to ``Product.units_sold`` and
+``Product.recent_units_sold``; cancelling a paid order takes them off again.
+``refresh_recent_sales`` re-ages the rolling window from order history and is
+meant to run periodically (``manage.py refresh_bestsellers``).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Product
+
+
+def get_window_days():
+    return getattr(settings, 'BESTSELLER_WINDOW_DAYS', 30)
+
+
+def trending_products(limit=6):
+    """Recent best sellers, then all-time, then newest (an indexed top-N read)."""
+    return Product.objects.filter(is_available=True).order_by(
+        '-recent_units_sold', '-units_sold', '-created_at'
+    )[:limit]
+
+
+def sales_updates(delta):
+    """``update()`` kwargs moving both sales counters by ``delta`` units, never below zero."""
+    return {
+        'units_sold': Greatest(F('units_sold') + delta, Value(0)),
+        'recent_units_sold': Greatest(F('recent_units_sold') + delta, Value(0)),
+    }
+
+
+def record_sales(quantities, sign=1):
+    """
+    Add (``sign=1``) or remove (``sign=-1``) sold units in a single UPDATE.
+
+    ``quantities`` maps product id to units.
+    """
+    quantities = {pk: qty for pk, qty in quantities.items() if qty}
+    if not quantities:
+        return 0
+    delta = Case(
+        *[When(pk=pk, then=Value(qty * sign)) for pk, qty in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return Product.objects.filter(pk__in=quantities).update(**sales_updates(delta))
+
+
+def _sold_units(since=None):
+    from orders.models import OrderItem
+
+    items = OrderItem.objects.filter(
+        product=OuterRef('pk'),
+        order__payment_status='completed',
+    ).exclude(order__status='cancelled')
+    if since is not None:
+        items = items.filter(order__paid_at__gte=since)
+    totals = items.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(totals), Value(0), output_field=IntegerField())
+
+
+def refresh_recent_sales(days=None, products=None, lifetime=False):
+    """Recompute the rolling window (and optionally lifetime) counters."""
+    if days is None:
+        days = get_window_days()
+    if products is None:
+        products = Product.objects.all()
+    updates = {'recent_units_sold': _sold_units(timezone.now() - timedelta(days=days))}
+    if lifetime:
+        updates['units_sold'] = _sold_units()
+    return products.order_by().update(**updates)
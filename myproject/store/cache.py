@@ -0,0 +1,171 @@
+"""
+Versioned caching for catalog pages and product-card fragments.
+
+Every cache key embeds the catalog version, a millisecond timestamp that is
+bumped whenever a Product, Category or Review changes (see store.signals).
+Bumping never deletes anything: stale entries simply stop being addressed
+and age out, so invalidation costs one write.
+
+The version lives in the database (a single ``CatalogVersion`` row), not in
+the cache, because the default cache is per process without ``REDIS_URL``:
+every worker reads the same version, and a bump becomes visible to the
+others when its transaction commits. Each process rechecks the row at most
+every ``CATALOG_VERSION_CHECK_INTERVAL`` seconds, so workers converge within
+that interval while most requests skip the query.
+
+The version doubles as the validator for conditional GETs: anonymous pages
+carry an ETag and Last-Modified derived from it, and a request that still
+holds the current ones gets a 304 before the view (or the cache) is touched.
+Because the version is shared, every worker hands out the same validators
+for a page, so revalidating against a different worker still gets a 304.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils.http import http_date
+
+from .models import CatalogVersion
+
+
+HITS_KEY = 'catalog:stats:hits'
+MISSES_KEY = 'catalog:stats:misses'
+
+
+def get_page_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def get_version_check_interval():
+    return getattr(settings, 'CATALOG_VERSION_CHECK_INTERVAL', 1)
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+# This process's copy of the version and when it was read
+_local = {'version': None, 'checked_at': None}
+
+
+def _remember(version):
+    _local['version'] = version
+    _local['checked_at'] = time.monotonic()
+    return version
+
+
+def _stored_version():
+    return CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first()
+
+
+def get_catalog_version():
+    checked_at = _local['checked_at']
+    if checked_at is not None and time.monotonic() - checked_at < get_version_check_interval():
+        return _local['version']
+    version = _stored_version()
+    if version is None:
+        version = CatalogVersion.objects.get_or_create(pk=1, defaults={'version': _now_ms()})[0].version
+    return _remember(version)
+
+
+def bump_catalog_version():
+    """Start a new catalog version; returns it."""
+    floor = max(_now_ms(), (_local['version'] or 0) + 1)
+    if not CatalogVersion.objects.filter(pk=1).update(version=Greatest(Value(floor), F('version') + 1)):
+        CatalogVersion.objects.get_or_create(pk=1, defaults={'version': floor})
+    return _remember(_stored_version())
+
+
+def _count(key):
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_cache_stats():
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits * 100 / total, 1) if total else 0,
+    }
+
+
+def _is_cacheable(request):
+    """Only anonymous GETs with no flash messages waiting get shared pages."""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    return len(get_messages(request)) == 0
+
+
+def page_cache_key(request, version=None):
+    if version is None:
+        version = get_catalog_version()
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'catalog:page:{version}:{path}'
+
+
+def catalog_validators(request, version):
+    """``(etag, last_modified)`` of the page at ``request``'s URL for ``version``."""
+    digest = hashlib.md5(f'{version}:{request.get_full_path()}'.encode()).hexdigest()
+    # Weak: pages are equivalent per version, not byte-identical across workers
+    return f'W/"{digest}"', version // 1000
+
+
+def set_validators(response, etag, last_modified, **cache_control):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # By default browsers keep the page but revalidate it on every visit
+    patch_cache_control(response, **(cache_control or {'max_age': 0}))
+    return response
+
+
+def cache_catalog_page(view_func):
+    """
+    Serve whole rendered pages to anonymous visitors from the cache.
+
+    Logged-in users always get a fresh render (the page is personalised),
+    but product cards inside it still come from the fragment cache.
+    Anonymous requests whose If-None-Match / If-Modified-Since match the
+    current catalog version are answered with a 304 straight away.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not _is_cacheable(request):
+            return view_func(request, *args, **kwargs)
+
+        version = get_catalog_version()
+        etag, last_modified = catalog_validators(request, version)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            _count(HITS_KEY)
+            return set_validators(not_modified, etag, last_modified)
+
+        key = page_cache_key(request, version)
+        response = cache.get(key)
+        if response is not None:
+            _count(HITS_KEY)
+            response['X-Cache'] = 'HIT'
+            return set_validators(response, etag, last_modified)
+
+        _count(MISSES_KEY)
+        response = view_func(request, *args, **kwargs)
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+            if not response.streaming and not response.cookies:
+                cache.set(key, response, get_page_timeout())
+        response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
@@ -0,0 +1,9 @@
+from .cache import get_catalog_version, get_page_timeout
+
+
+def catalog(request):
+    """Expose the catalog version for fragment cache keys (read lazily)."""
+    return {
+        'catalog_version': get_catalog_version,
+        'catalog_cache_timeout': get_page_timeout(),
+    }
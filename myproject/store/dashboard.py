@@ -0,0 +1,137 @@
+"""
+Cached metrics snapshot for the staff sales dashboard.
+
+Every figure on the dashboard comes from two conditional-aggregation
+queries, one over orders and one over products, plus the short low-stock
+list. The result is cached as a snapshot stamped with ``computed_at`` and
+is reused for ``DASHBOARD_METRICS_TTL`` seconds.
+
+Once a snapshot is due, the first request to take the recompute lock
+(``cache.add``) rebuilds it while everyone else keeps reading the old one,
+so concurrent staff page loads never stampede the database. Only when
+there is no snapshot at all do the others wait for it, up to
+``LOCK_TIMEOUT``.
+"""
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from orders.models import Order
+from .models import Product
+
+
+SNAPSHOT_KEY = 'dashboard:metrics'
+LOCK_KEY = 'dashboard:metrics:lock'
+# Longest a recompute may hold the lock before another request may try
+LOCK_TIMEOUT = 30
+POLL_INTERVAL = 0.1
+# Stale snapshots are kept this many TTLs so there is one to serve meanwhile
+STALE_FACTOR = 10
+
+REVENUE_STATUSES = ['completed', 'cod_pending']
+LOW_STOCK_THRESHOLD = 5
+LOW_STOCK_LIMIT = 10
+
+
+def get_metrics_ttl():
+    return getattr(settings, 'DASHBOARD_METRICS_TTL', 60)
+
+
+def _order_metrics(today_start, month_start):
+    paid = Q(payment_status__in=REVENUE_STATUSES)
+    this_month = Q(created_at__gte=month_start)
+    today = Q(created_at__gte=today_start)
+    statuses = [status for status, _label in Order.STATUS_CHOICES]
+    totals = Order.objects.aggregate(
+        total_revenue=Sum('total_amount', filter=paid),
+        month_revenue=Sum('total_amount', filter=paid & this_month),
+        today_revenue=Sum('total_amount', filter=paid & today),
+        total_orders=Count('pk'),
+        month_orders=Count('pk', filter=this_month),
+        today_orders=Count('pk', filter=today),
+        **{f'status_{status}': Count('pk', filter=Q(status=status)) for status in statuses},
+    )
+    for key in ('total_revenue', 'month_revenue', 'today_revenue'):
+        totals[key] = totals[key] or Decimal('0.00')
+    breakdown = [{'status': status, 'count': totals.pop(f'status_{status}')} for status in statuses]
+    totals['status_breakdown'] = [stat for stat in breakdown if stat['count']]
+    totals['pending_orders'] = next(stat['count'] for stat in breakdown if stat['status'] == 'pending')
+    return totals
+
+
+def _product_metrics():
+    return Product.objects.aggregate(
+        total_products=Count('pk'),
+        available_products=Count('pk', filter=Q(is_available=True)),
+        total_categories=Count('category', distinct=True),
+        out_of_stock_count=Count('pk', filter=Q(stock=0)),
+        low_stock_count=Count('pk', filter=Q(stock__gt=0, stock__lte=LOW_STOCK_THRESHOLD)),
+    )
+
+
+def low_stock_queryset():
+    return Product.objects.filter(
+        stock__gt=0, stock__lte=LOW_STOCK_THRESHOLD,
+    ).order_by('stock', 'pk').values('pk', 'name', 'stock', 'category__name')[:LOW_STOCK_LIMIT]
+
+
+def _low_stock_products():
+    products = low_stock_queryset()
+    return [
+        {'pk': row['pk'], 'name': row['name'], 'stock': row['stock'], 'category': {'name': row['category__name']}}
+        for row in products
+    ]
+
+
+def compute_dashboard_metrics():
+    """Compute a fresh snapshot: two aggregate queries and the low-stock list."""
+    now = timezone.localtime()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    month_start = today_start.replace(day=1)
+    return {
+        **_order_metrics(today_start, month_start),
+        **_product_metrics(),
+        'low_stock_products': _low_stock_products(),
+        'computed_at': now,
+    }
+
+
+def _is_fresh(snapshot):
+    age = (timezone.now() - snapshot['computed_at']).total_seconds()
+    return age < get_metrics_ttl()
+
+
+def _recompute():
+    try:
+        snapshot = compute_dashboard_metrics()
+        cache.set(SNAPSHOT_KEY, snapshot, get_metrics_ttl() * STALE_FACTOR)
+    finally:
+        cache.delete(LOCK_KEY)
+    return snapshot
+
+
+def get_dashboard_metrics(refresh=False):
+    """The current snapshot, recomputed by at most one request at a time."""
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is not None and not refresh and _is_fresh(snapshot):
+        return snapshot
+    if cache.add(LOCK_KEY, 1, LOCK_TIMEOUT):
+        return _recompute()
+    if snapshot is not None:
+        # Someone else is recomputing; the previous snapshot will do
+        return snapshot
+
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is not None:
+            return snapshot
+        if cache.add(LOCK_KEY, 1, LOCK_TIMEOUT):
+            return _recompute()
+    # The recompute never finished; don't leave this page without figures
+    return compute_dashboard_metrics()
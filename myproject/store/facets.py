@@ -0,0 +1,86 @@
+"""
+Sidebar facet counts and filter/sort options for the product listing.
+
+All counts (per category, per price bucket, in stock) come from a single
+conditional-aggregation query over the current search. The unfiltered
+catalog's facets are cached under the catalog version.
+"""
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .cache import get_catalog_version, get_page_timeout
+
+
+PRICE_RANGES = [
+    ('under-5000', 'Under ₹5,000', Q(price__lt=5000)),
+    ('5000-10000', '₹5,000 - ₹10,000', Q(price__gte=5000, price__lt=10000)),
+    ('above-10000', 'Above ₹10,000', Q(price__gte=10000)),
+]
+
+
+# Sort options; id breaks ties so every product has a fixed cursor position
+SORT_ORDERINGS = {
+    'relevance': ['-search_rank', '-id'],
+    'price-low': ['price', 'id'],
+    'price-high': ['-price', '-id'],
+    'name': ['name', 'id'],
+    'newest': ['-created_at', '-id'],
+}
+
+
+def get_price_filter(price_range):
+    for value, _label, condition in PRICE_RANGES:
+        if value == price_range:
+            return condition
+    return None
+
+
+def filter_products(queryset, category=None, price_filter=None, in_stock=False):
+    """Apply the listing's category, price range and in-stock filters."""
+    if category is not None:
+        queryset = queryset.filter(category=category)
+    if price_filter is not None:
+        queryset = queryset.filter(price_filter)
+    if in_stock:
+        queryset = queryset.filter(stock__gt=0)
+    return queryset
+
+
+def get_sort_ordering(sort_by, searching=False):
+    """Ordering for a sort option; anything unknown (or relevance outside a search) is newest first."""
+    if sort_by == 'relevance' and not searching:
+        sort_by = 'newest'
+    return SORT_ORDERINGS.get(sort_by, SORT_ORDERINGS['newest'])
+
+
+def compute_facets(queryset, categories):
+    """Count ``queryset`` per category, price range and stock in one query."""
+    aggregates = {
+        'total': Count('pk'),
+        'in_stock': Count('pk', filter=Q(stock__gt=0)),
+    }
+    for category in categories:
+        aggregates[f'category_{category.pk}'] = Count('pk', filter=Q(category_id=category.pk))
+    for index, (_value, _label, condition) in enumerate(PRICE_RANGES):
+        aggregates[f'price_{index}'] = Count('pk', filter=condition)
+
+    counts = queryset.order_by().aggregate(**aggregates)
+    return {
+        'total': counts['total'],
+        'in_stock': counts['in_stock'],
+        'categories': {category.pk: counts[f'category_{category.pk}'] for category in categories},
+        'price': {
+            value: counts[f'price_{index}']
+            for index, (value, _label, _condition) in enumerate(PRICE_RANGES)
+        },
+    }
+
+
+def get_catalog_facets(queryset, categories):
+    """Facets of the unfiltered catalog, cached until the catalog changes."""
+    key = f'catalog:facets:{get_catalog_version()}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset, categories)
+        cache.set(key, facets, get_page_timeout())
+    return facets
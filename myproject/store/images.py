@@ -0,0 +1,172 @@
+"""
+Sized, format-optimised product image URLs.
+
+Templates ask for an image at one of the named sizes in ``IMAGE_SIZES`` and
+get the smallest variant as ``src`` plus a ``srcset`` of the larger ones, so
+product grids download thumbnails rather than original uploads. Variants come
+from the backend named by ``settings.PRODUCT_IMAGE_BACKEND``:
+
+* ``CloudinaryImageBackend`` builds transformation URLs; Cloudinary resizes on
+  first request and serves WebP/AVIF to browsers that accept them.
+* ``LocalImageBackend`` resizes originals found under ``MEDIA_ROOT`` with
+  Pillow and writes WebP variants next to them, for running without Cloudinary.
+
+Both also ``upload`` an original from a local path or URL and return the
+value to store in the CloudinaryField (used by the product import).
+
+URLs are memoised per (image, width): building one is string work for
+Cloudinary but a filesystem check for the local backend.
+"""
+import glob
+import os
+import shutil
+import time
+import urllib.request
+import uuid
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+DEFAULT_BACKEND = 'store.images.CloudinaryImageBackend'
+VARIANTS_DIR = 'variants'
+
+ImageSize = namedtuple('ImageSize', ['widths', 'sizes'])
+
+# Candidate widths (px) and the layout width hint for each place an image is shown
+IMAGE_SIZES = {
+    'thumb': ImageSize((120, 240), '120px'),
+    'card': ImageSize((320, 480, 640), '(max-width: 600px) 50vw, 320px'),
+    'cover': ImageSize((400, 800), '(max-width: 768px) 100vw, 400px'),
+    'detail': ImageSize((600, 900, 1200), '(max-width: 900px) 100vw, 600px'),
+}
+
+
+class CloudinaryImageBackend:
+    def url(self, public_id, version, width):
+        from cloudinary import CloudinaryImage
+
+        return CloudinaryImage(public_id, version=version).build_url(
+            width=width,
+            crop='limit',
+            quality='auto',
+            fetch_format='auto',
+            secure=True,
+        )
+
+    def upload(self, source, public_id):
+        import cloudinary.uploader
+
+        result = cloudinary.uploader.upload(
+            source, public_id=public_id, overwrite=True, resource_type='image',
+        )
+        return f"image/upload/v{result['version']}/{result['public_id']}.{result['format']}"
+
+
+class LocalImageBackend:
+    """
+    Stand-in for Cloudinary: originals live at ``MEDIA_ROOT/<public_id>.<ext>``
+    and variants are written to ``MEDIA_ROOT/variants`` the first time they
+    are asked for.
+    """
+    quality = 80
+
+    def __init__(self):
+        if not settings.MEDIA_ROOT:
+            raise ImproperlyConfigured('LocalImageBackend requires MEDIA_ROOT to be set.')
+        self.root = Path(settings.MEDIA_ROOT)
+
+    def url(self, public_id, version, width):
+        name = f'{public_id}_v{version}_{width}w.webp' if version else f'{public_id}_{width}w.webp'
+        target = self.root / VARIANTS_DIR / name
+        if not target.exists():
+            self._resize(self._find_original(public_id), target, width)
+        return settings.MEDIA_URL + target.relative_to(self.root).as_posix()
+
+    def _find_original(self, public_id):
+        matches = sorted(
+            path for path in self.root.glob(glob.escape(public_id) + '.*')
+            if path.is_file()
+        )
+        if not matches:
+            raise FileNotFoundError(f'No original image for {public_id!r} in {self.root}')
+        return matches[0]
+
+    def _resize(self, source, target, width):
+        from PIL import Image, ImageOps
+
+        with Image.open(source) as original:
+            image = ImageOps.exif_transpose(original)
+            # Like crop='limit': shrink to the width, never enlarge
+            image.thumbnail((width, width * 4))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename so a concurrent request never serves half a file
+            partial = _partial_path(target)
+            image.save(partial, 'WEBP', quality=self.quality)
+        os.replace(partial, target)
+
+    def upload(self, source, public_id):
+        from PIL import Image
+
+        extension = Path(urlparse(source).path).suffix.lower() or '.jpg'
+        target = self.root / f'{public_id}{extension}'
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial = _partial_path(target)
+        try:
+            if urlparse(source).scheme in ('http', 'https'):
+                urllib.request.urlretrieve(source, partial)
+            else:
+                shutil.copyfile(source, partial)
+            # Reject non-images the way Cloudinary would
+            with Image.open(partial) as image:
+                image.verify()
+        except Exception:
+            partial.unlink(missing_ok=True)
+            raise
+        # Drop an original stored under another extension (not in-flight partials)
+        for previous in self.root.glob(glob.escape(public_id) + '.*'):
+            if previous.suffix != '.tmp':
+                previous.unlink()
+        os.replace(partial, target)
+        # A new version gives the replaced image fresh variant URLs
+        return f'image/upload/v{int(time.time())}/{public_id}{extension}'
+
+
+def _partial_path(target):
+    return target.with_name(f'{target.name}.{uuid.uuid4().hex}.tmp')
+
+
+@lru_cache(maxsize=None)
+def get_image_backend():
+    return import_string(getattr(settings, 'PRODUCT_IMAGE_BACKEND', DEFAULT_BACKEND))()
+
+
+@lru_cache(maxsize=8192)
+def _variant_url(public_id, version, width):
+    return get_image_backend().url(public_id, version, width)
+
+
+def image_url(image, width):
+    """URL of ``image`` (a CloudinaryField value) scaled down to ``width`` px."""
+    if not image:
+        return ''
+    try:
+        return _variant_url(image.public_id, image.version, width)
+    except OSError:
+        # Local original missing or unreadable; not memoised, so it is
+        # retried once the file turns up.
+        return image.url
+
+
+def image_srcset(image, size):
+    """``(src, srcset, sizes)`` for ``image`` shown at the named ``size``."""
+    widths, sizes = IMAGE_SIZES[size]
+    srcset = ', '.join(f'{image_url(image, width)} {width}w' for width in widths)
+    return image_url(image, widths[0]), srcset, sizes
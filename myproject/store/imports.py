@@ -0,0 +1,320 @@
+"""
+Streaming product import (see the ``import_products`` command).
+
+Rows are read one at a time from CSV or JSON Lines, so a file of any size
+is imported in constant memory. Each batch is validated, its categories and
+slugs are resolved against in-memory maps, and it is upserted on ``slug``
+with one ``bulk_create(update_conflicts=True)``. The byte offset after every
+committed batch is written to a checkpoint file so a failed run can resume
+where it stopped.
+
+Images are not uploaded inline: their sources are spooled to a file and
+uploaded afterwards by a thread pool, a batch of products at a time.
+"""
+import csv
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal, InvalidOperation
+
+from django.core.validators import validate_slug
+from django.core.exceptions import ValidationError
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .images import get_image_backend
+from .models import Category, Product
+
+
+FORMATS = ('csv', 'jsonl')
+UPDATE_FIELDS = ['name', 'description', 'price', 'stock', 'category', 'is_available', 'updated_at']
+MAX_PRICE = Decimal('99999999.99')
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'n'}
+
+SourceRow = namedtuple('SourceRow', ['line', 'offset', 'data', 'error'])
+
+
+class RowError(ValueError):
+    pass
+
+
+def guess_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return 'jsonl' if extension in ('jsonl', 'ndjson') else 'csv'
+
+
+def read_rows(path, fmt, offset=0, line=0):
+    """
+    Yield a ``SourceRow`` per record of ``path``, starting at byte ``offset``.
+
+    ``offset`` of each row is the byte position just after it, which is where
+    a resumed read should start; ``line`` continues the numbering of a
+    previous run. Undecodable records come back with ``error`` set.
+    """
+    with open(path, 'rb') as handle:
+        if fmt == 'csv':
+            yield from _read_csv(handle, offset, line)
+        else:
+            yield from _read_jsonl(handle, offset, line)
+
+
+def _read_csv(handle, offset, line):
+    header = handle.readline()
+    fieldnames = [name.strip().lower() for name in next(csv.reader([header.decode('utf-8-sig')]), [])]
+    if offset < handle.tell():
+        offset, line = handle.tell(), 1
+    handle.seek(offset)
+    position = offset
+
+    def lines():
+        nonlocal position
+        for raw in handle:
+            position += len(raw)
+            yield raw.decode('utf-8', errors='replace')
+
+    reader = csv.DictReader(lines(), fieldnames=fieldnames)
+    for data in reader:
+        error = None
+        if None in data:
+            error = RowError('more values than header columns')
+        yield SourceRow(line + reader.line_num, position, data, error)
+
+
+def _read_jsonl(handle, offset, line):
+    handle.seek(offset)
+    position = offset
+    for raw in handle:
+        position += len(raw)
+        line += 1
+        if not raw.strip():
+            continue
+        try:
+            data = json.loads(raw)
+        except ValueError as error:
+            yield SourceRow(line, position, None, RowError(f'invalid JSON: {error}'))
+            continue
+        if not isinstance(data, dict):
+            yield SourceRow(line, position, None, RowError('expected a JSON object'))
+            continue
+        yield SourceRow(line, position, {str(key).lower(): value for key, value in data.items()}, None)
+
+
+class CategoryResolver:
+    """
+    Category ids by slug or case-insensitive name, loaded once.
+
+    Unknown categories are created on first use (or only recorded, in a
+    dry run, under a placeholder id).
+    """
+
+    def __init__(self, create=True):
+        self.create = create
+        self.created = []
+        self._ids = {}
+        for pk, name, slug in Category.objects.values_list('pk', 'name', 'slug'):
+            self._ids[slug] = self._ids[name.lower()] = pk
+
+    def resolve(self, value):
+        value = str(value or '').strip()
+        if not value:
+            raise RowError('category is required')
+        slug = slugify(value)
+        pk = self._ids.get(value.lower()) or self._ids.get(slug)
+        if pk is None:
+            if not slug:
+                raise RowError(f'cannot make a slug from category {value!r}')
+            if self.create:
+                pk = Category.objects.get_or_create(slug=slug, defaults={'name': value})[0].pk
+            else:
+                pk = -len(self._ids) - 1
+            self.created.append(value)
+            self._ids[value.lower()] = self._ids[slug] = pk
+        return pk
+
+
+def _text(data, key, max_length=None, required=False):
+    value = data.get(key)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f'{key} is required')
+    if max_length and len(value) > max_length:
+        raise RowError(f'{key} is longer than {max_length} characters')
+    return value
+
+
+def clean_row(data, categories):
+    """Validate one source record; returns the Product field values plus ``image``."""
+    name = _text(data, 'name', max_length=200, required=True)
+    slug = _text(data, 'slug', max_length=220) or slugify(name)[:220]
+    try:
+        validate_slug(slug)
+    except ValidationError:
+        raise RowError(f'invalid slug {slug!r}')
+
+    try:
+        price = Decimal(_text(data, 'price', required=True))
+    except InvalidOperation:
+        price = None
+    if price is None or not price.is_finite():
+        raise RowError(f"invalid price {data.get('price')!r}")
+    # Range first: quantizing something like 1e30 to cents exceeds the
+    # decimal context's precision and raises InvalidOperation
+    if not 0 <= price <= MAX_PRICE:
+        raise RowError(f'price {price} out of range')
+    try:
+        price = price.quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError(f"invalid price {data.get('price')!r}")
+
+    stock = _text(data, 'stock') or '0'
+    try:
+        stock = int(stock)
+    except ValueError:
+        raise RowError(f'invalid stock {stock!r}')
+    if stock < 0:
+        raise RowError('stock cannot be negative')
+
+    is_available = _text(data, 'is_available').lower() or 'true'
+    if is_available not in TRUE_VALUES | FALSE_VALUES:
+        raise RowError(f'invalid is_available {is_available!r}')
+
+    return {
+        'name': name,
+        'slug': slug,
+        'description': _text(data, 'description'),
+        'price': price,
+        'stock': stock,
+        'category_id': categories.resolve(data.get('category')),
+        'is_available': is_available in TRUE_VALUES,
+        'image': _text(data, 'image'),
+    }
+
+
+def existing_slugs(slugs):
+    return set(Product.objects.filter(slug__in=slugs).values_list('slug', flat=True))
+
+
+def upsert_products(rows):
+    """
+    Insert or update ``rows`` (cleaned, unique slugs) in one statement.
+
+    Returns ``(created_ids, updated_count)``. Ratings, sales counters and the
+    image of existing products are left untouched.
+    """
+    slugs = [row['slug'] for row in rows]
+    existing = existing_slugs(slugs)
+    Product.objects.bulk_create(
+        [
+            Product(**{key: value for key, value in row.items() if key != 'image'})
+            for row in rows
+        ],
+        update_conflicts=True,
+        unique_fields=['slug'],
+        update_fields=UPDATE_FIELDS,
+    )
+    new_slugs = [slug for slug in slugs if slug not in existing]
+    created_ids = list(Product.objects.filter(slug__in=new_slugs).values_list('pk', flat=True))
+    return created_ids, len(existing)
+
+
+class Checkpoint:
+    """
+    Progress of one import, stored as JSON next to the source file.
+
+    The source's size and mtime are recorded too, so a checkpoint is never
+    applied to a file that has changed since.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        stat = os.stat(source)
+        self.fingerprint = [stat.st_size, stat.st_mtime_ns]
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path) as handle:
+            state = json.load(handle)
+        if state.pop('fingerprint', None) != self.fingerprint:
+            raise ValueError(f'{self.path} was written for a different version of the source file')
+        return state
+
+    def save(self, **state):
+        partial = f'{self.path}.tmp'
+        with open(partial, 'w') as handle:
+            json.dump({'fingerprint': self.fingerprint, **state}, handle)
+        os.replace(partial, self.path)
+
+    def clear(self):
+        if self.exists():
+            os.remove(self.path)
+
+
+def spool_images(spool, rows):
+    """Append ``(slug, source)`` for rows that name an image."""
+    for row in rows:
+        if row['image']:
+            spool.write(json.dumps([row['slug'], row['image']]) + '\n')
+    spool.flush()
+
+
+def _read_spool(path):
+    with open(path) as spool:
+        for raw in spool:
+            if raw.strip():
+                yield json.loads(raw)
+
+
+def upload_images(spool_path, workers=8, batch_size=200, replace=False):
+    """
+    Upload the spooled images, ``workers`` at a time.
+
+    Works through the spool ``batch_size`` products at a time: skips products
+    that already have an image (unless ``replace``), uploads the rest in
+    parallel, then stores the new values with one UPDATE. Yields
+    ``(uploaded, failures)`` per batch, ``failures`` being ``(slug, error)``.
+    """
+    backend = get_image_backend()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        batch = {}
+        for slug, source in _read_spool(spool_path):
+            batch[slug] = source
+            if len(batch) >= batch_size:
+                yield _upload_batch(pool, backend, batch, replace)
+                batch = {}
+        if batch:
+            yield _upload_batch(pool, backend, batch, replace)
+
+
+def _upload_batch(pool, backend, batch, replace):
+    if not replace:
+        pending = set(
+            Product.objects.filter(slug__in=batch)
+            .filter(Q(image__isnull=True) | Q(image=''))
+            .values_list('slug', flat=True)
+        )
+        batch = {slug: source for slug, source in batch.items() if slug in pending}
+
+    futures = {
+        pool.submit(backend.upload, source, f'products/{slug}'): slug
+        for slug, source in batch.items()
+    }
+    uploaded = {}
+    failures = []
+    for future in as_completed(futures):
+        slug = futures[future]
+        try:
+            uploaded[slug] = future.result()
+        except Exception as error:
+            failures.append((slug, error))
+
+    if uploaded:
+        Product.objects.filter(slug__in=uploaded).update(
+            image=Case(*[When(slug=slug, then=Value(value)) for slug, value in uploaded.items()]),
+            updated_at=timezone.now(),
+        )
+    return len(uploaded), failures
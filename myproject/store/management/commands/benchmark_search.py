@@ -0,0 +1,114 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Q
+
+from store.facets import SORT_ORDERINGS
+from store.models import Category, Product
+from store.search import _has_search_index, search_products
+
+
+BRANDS = ['Acme', 'Nova', 'Orbit', 'Zenith', 'Vertex', 'Lumen', 'Pulse', 'Aero', 'Terra', 'Quantum']
+NOUNS = ['phone', 'laptop', 'headphones', 'watch', 'camera', 'speaker', 'tablet', 'charger', 'keyboard', 'monitor']
+WORDS = [
+    'wireless', 'waterproof', 'premium', 'compact', 'leather', 'steel', 'carbon', 'ultra', 'classic', 'smart',
+    'silent', 'portable', 'gaming', 'travel', 'studio', 'outdoor', 'slim', 'rugged', 'solar', 'retro',
+]
+QUERIES = ['phone', 'wireless head', 'zenith', 'rugged outdoor camera', 'qu', 'no such product']
+PAGE_SIZE = 24
+
+
+class Command(BaseCommand):
+    help = (
+        'Time full-text product searches against the old icontains filter. Use '
+        '--seed to run against a large synthetic catalog (e.g. 500000 products) '
+        'that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Insert this many synthetic products first (rolled back)')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query')
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='Search to time (repeatable; default: a fixed mix)')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        with transaction.atomic(using=using):
+            if options['seed']:
+                self._seed(using, options['seed'])
+            if not _has_search_index(using):
+                raise CommandError('This database has no search index; run migrate or rebuild_search_index.')
+            products = Product.objects.using(using).filter(is_available=True)
+            self.stdout.write(f'{products.count()} available products, {options["repeat"]} runs per query')
+            # The listing fetches a page and counts every match (facets, total)
+            self.stdout.write('Milliseconds, median / max: first page by relevance (newest for icontains), count')
+            self.stdout.write(
+                f'{"query":<24} {"matches":>8} {"index page":>16} {"index count":>16} '
+                f'{"icontains page":>16} {"icontains count":>16}'
+            )
+            for query in options['queries'] or QUERIES:
+                indexed = search_products(products, query)
+                scanned = _icontains(products, query)
+                timings = [
+                    self._time(lambda: list(indexed.order_by(*SORT_ORDERINGS['relevance'])[:PAGE_SIZE]), options),
+                    self._time(indexed.count, options),
+                    self._time(lambda: list(scanned.order_by(*SORT_ORDERINGS['newest'])[:PAGE_SIZE]), options),
+                    self._time(scanned.count, options),
+                ]
+                self.stdout.write(
+                    f'{query:<24} {indexed.count():>8} ' + ' '.join(f'{_summary(times):>16}' for times in timings)
+                )
+            transaction.set_rollback(True, using=using)
+
+    def _time(self, run, options):
+        """Milliseconds each of ``repeat`` calls of ``run`` took."""
+        times = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            run()
+            times.append((time.perf_counter() - start) * 1000)
+        return times
+
+    def _seed(self, using, count):
+        rng = random.Random(0)
+        categories = [
+            Category.objects.using(using).create(name=f'Search bench {noun}', slug=f'search-bench-{noun}-{time.time_ns()}')
+            for noun in NOUNS
+        ]
+        batch = []
+        for i in range(count):
+            noun = rng.randrange(len(NOUNS))
+            batch.append(Product(
+                name=f'{rng.choice(BRANDS)} {" ".join(rng.sample(WORDS, 2))} {NOUNS[noun]} {i}',
+                slug=f'search-bench-{i}-{time.time_ns()}',
+                description=' '.join(rng.sample(WORDS, 6)),
+                price=Decimal(rng.randint(100, 20000)),
+                stock=rng.choice([0, 3, 8, 25, 100]),
+                is_available=rng.random() > 0.1,
+                category=categories[noun],
+            ))
+            if len(batch) == 5000:
+                Product.objects.using(using).bulk_create(batch)
+                batch = []
+        Product.objects.using(using).bulk_create(batch)
+        with connections[using].cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f'Seeded {count} products.')
+
+
+def _icontains(queryset, query):
+    """The listing's search before the index: every term anywhere in name or description."""
+    condition = Q()
+    for term in query.split():
+        condition &= Q(name__icontains=term) | Q(description__icontains=term)
+    return queryset.filter(condition)
+
+
+def _summary(times):
+    return f'{statistics.median(times):.2f} / {max(times):.2f}'
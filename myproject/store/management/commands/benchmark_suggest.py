@@ -0,0 +1,73 @@
+import random
+import statistics
+import time
+import tracemalloc
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from store.suggest import SuggestIndex, words
+
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ra', 'to', 'vi', 'zu', 'pe', 'sa', 'dor', 'lin', 'tek', 'mon', 'gal']
+KINDS = [
+    'phone', 'laptop', 'headphones', 'watch', 'camera', 'speaker', 'tablet', 'charger', 'keyboard', 'monitor',
+    'case', 'cable', 'mouse', 'router', 'drone', 'lamp', 'jacket', 'sneakers', 'backpack', 'bottle',
+]
+TRAITS = [
+    'wireless', 'waterproof', 'premium', 'compact', 'leather', 'steel', 'carbon', 'ultra', 'classic', 'smart',
+    'silent', 'portable', 'gaming', 'travel', 'studio', 'outdoor', 'slim', 'rugged', 'solar', 'retro',
+]
+QUERIES = ['p', 'wa', 'pho', 'wirel', 'headphones', 'kalo', 'smart wat', 'rugged outdoor dr', 'x9', 'zzz']
+
+
+class Command(BaseCommand):
+    help = (
+        'Build a typeahead index over synthetic product names in memory (no '
+        'database) and report its build time, memory and lookup latency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=1_000_000, help='Product names to index')
+        parser.add_argument('--repeat', type=int, default=200, help='Lookups per query')
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='Prefix to time (repeatable; default: a fixed mix)')
+
+    def handle(self, *args, **options):
+        count = options['names']
+        tracemalloc.start()
+        start = time.perf_counter()
+        index = SuggestIndex(_rows(count))
+        built = time.perf_counter() - start
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f'{len(index)} names, {len(index.vocabulary)} distinct words: built in {built:.1f}s, '
+            f'{size / 2**20:.1f} MiB held ({size / max(len(index), 1):.0f} bytes per name), '
+            f'{peak / 2**20:.1f} MiB peak while building'
+        )
+
+        self.stdout.write(f'Microseconds per lookup of the best 8, over {options["repeat"]} runs')
+        self.stdout.write(f'{"query":<20} {"found":>6} {"median":>10} {"p99":>10} {"max":>10}')
+        for query in options['queries'] or QUERIES:
+            tokens = words(query)
+            times = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                found = [index.entry(entry) for entry in islice(index.candidates(tokens), 8)]
+                times.append((time.perf_counter() - start) * 1_000_000)
+            times.sort()
+            p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+            self.stdout.write(
+                f'{query:<20} {len(found):>6} {statistics.median(times):>10.1f} {p99:>10.1f} {times[-1]:>10.1f}'
+            )
+
+
+def _rows(count):
+    """``(product_id, name, slug, score)`` best first, like ``store.suggest._product_rows``."""
+    rng = random.Random(0)
+    brands = [''.join(rng.sample(SYLLABLES, 2)).title() for _ in range(500)]
+    for pk in range(1, count + 1):
+        model = f'{rng.choice("abcdefghjkmnprstvwxyz")}{rng.randrange(10000)}'
+        name = f'{rng.choice(brands)} {rng.choice(TRAITS)} {rng.choice(KINDS)} {model}'
+        yield pk, name, f'product-{pk}', count - pk
@@ -0,0 +1,189 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store.cache import bump_catalog_version
+from store.imports import (
+    FORMATS, CategoryResolver, Checkpoint, RowError, clean_row, existing_slugs,
+    guess_format, read_rows, spool_images, upload_images, upsert_products,
+)
+from store.models import Category
+
+
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = 'Create or update products from a CSV or JSON Lines file, matched on slug'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or .jsonl file')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate every row and report what would change, without writing')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue an interrupted import from its checkpoint')
+        parser.add_argument('--checkpoint', default=None,
+                            help='Checkpoint file (default: <path>.checkpoint)')
+        parser.add_argument('--skip-images', action='store_true',
+                            help='Do not upload images')
+        parser.add_argument('--replace-images', action='store_true',
+                            help='Re-upload images of products that already have one')
+        parser.add_argument('--image-workers', type=int, default=8,
+                            help='Parallel image uploads')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        try:
+            checkpoint = Checkpoint(options['checkpoint'] or f'{path}.checkpoint', path)
+        except OSError as error:
+            raise CommandError(error)
+        spool_path = f'{checkpoint.path}.images'
+
+        if options['dry_run']:
+            return self.validate(path, fmt, options['batch_size'])
+
+        state = {'offset': 0, 'line': 0, 'created': 0, 'updated': 0, 'invalid': 0, 'rows_done': False}
+        if checkpoint.exists():
+            if not options['resume']:
+                raise CommandError(
+                    f'{checkpoint.path} exists from an earlier run: pass --resume to continue it, '
+                    f'or delete it to start over.'
+                )
+            try:
+                state.update(checkpoint.load())
+            except ValueError as error:
+                raise CommandError(error)
+            self.stdout.write(f"Resuming after line {state['line']}.")
+        elif options['resume']:
+            raise CommandError(f'No checkpoint at {checkpoint.path} to resume from.')
+        else:
+            # Fresh run: drop images spooled by an abandoned one
+            open(spool_path, 'w').close()
+
+        if not state['rows_done']:
+            self.import_rows(path, fmt, options['batch_size'], checkpoint, spool_path, state)
+            state['rows_done'] = True
+            checkpoint.save(**state)
+            self.catalog_changed()
+
+        failed = 0
+        if not options['skip_images']:
+            failed = self.upload_images(spool_path, options['image_workers'], options['replace_images'])
+            self.catalog_changed()
+
+        if failed:
+            self.stderr.write(self.style.WARNING(
+                f'{failed} image(s) failed to upload; rerun with --resume to retry them.'
+            ))
+        else:
+            checkpoint.clear()
+            os.remove(spool_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {state['created']} new and {state['updated']} updated product(s); "
+            f"skipped {state['invalid']} invalid row(s)."
+        ))
+        if state['created']:
+            # Until then new products show the newest of their category as related
+            self.stdout.write('Run refresh_related_products to precompute their related lists.')
+
+    def import_rows(self, path, fmt, batch_size, checkpoint, spool_path, state):
+        categories = CategoryResolver()
+        started = time.monotonic()
+        rows_seen = 0
+        with open(spool_path, 'a') as spool:
+            for batch, last in self.batches(read_rows(path, fmt, state['offset'], state['line']),
+                                             batch_size, categories, state):
+                if batch:
+                    with transaction.atomic():
+                        created_ids, updated = upsert_products(batch)
+                    state['created'] += len(created_ids)
+                    state['updated'] += updated
+                # Only committed rows are spooled and checkpointed; a crash in
+                # between just replays the batch, which upserts idempotently.
+                spool_images(spool, batch)
+                state['offset'], state['line'] = last.offset, last.line
+                checkpoint.save(**state)
+                rows_seen += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"Line {state['line']}: {state['created']} created, {state['updated']} updated, "
+                    f"{rows_seen / elapsed if elapsed else 0:.0f} rows/s"
+                )
+
+    def batches(self, source_rows, batch_size, categories, state):
+        """
+        Group cleaned rows into batches of unique slugs; yields ``(rows, last_source_row)``.
+
+        Invalid rows are reported and counted, not raised. A slug repeated in
+        the same batch keeps its last row, as a later upsert would.
+        """
+        batch = {}
+        last = None
+        for source_row in source_rows:
+            last = source_row
+            try:
+                if source_row.error:
+                    raise source_row.error
+                row = clean_row(source_row.data, categories)
+            except RowError as error:
+                self.report_error(source_row.line, error, state)
+            else:
+                batch.pop(row['slug'], None)
+                batch[row['slug']] = row
+            if len(batch) >= batch_size:
+                yield list(batch.values()), last
+                batch = {}
+        if last is not None:
+            yield list(batch.values()), last
+
+    def report_error(self, line, error, state):
+        state['invalid'] += 1
+        if state['invalid'] <= MAX_REPORTED_ERRORS:
+            self.stderr.write(f'Line {line}: {error}')
+        elif state['invalid'] == MAX_REPORTED_ERRORS + 1:
+            self.stderr.write('Further errors are counted but not shown.')
+
+    def validate(self, path, fmt, batch_size):
+        state = {'invalid': 0}
+        categories = CategoryResolver(create=False)
+        started = time.monotonic()
+        rows = creates = updates = 0
+        for batch, _last in self.batches(read_rows(path, fmt), batch_size, categories, state):
+            existing = existing_slugs([row['slug'] for row in batch])
+            rows += len(batch)
+            updates += len(existing)
+            creates += len(batch) - len(existing)
+        elapsed = time.monotonic() - started
+
+        if categories.created:
+            self.stdout.write(f"Would create categories: {', '.join(categories.created)}")
+        summary = (
+            f'Dry run: {rows} valid row(s) ({creates} new, {updates} updates), '
+            f"{state['invalid']} invalid, {rows / elapsed if elapsed else 0:.0f} rows/s"
+        )
+        if state['invalid']:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def upload_images(self, spool_path, workers, replace):
+        started = time.monotonic()
+        uploaded = failed = 0
+        for count, failures in upload_images(spool_path, workers=workers, replace=replace):
+            uploaded += count
+            failed += len(failures)
+            for slug, error in failures[:MAX_REPORTED_ERRORS]:
+                self.stderr.write(f'Image for {slug}: {error}')
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Images: {uploaded} uploaded, {failed} failed, {uploaded / elapsed:.1f}/s')
+        return failed
+
+    def catalog_changed(self):
+        # bulk_create and update() skip the signals behind covers and the page cache
+        Category.refresh_covers(Category.objects.values_list('pk', flat=True))
+        bump_catalog_version()
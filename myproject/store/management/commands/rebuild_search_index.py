@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from store.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = 'Create (if needed) and fully rebuild the product full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if install_search_index(options['database'], rebuild=True):
+            self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                'This database has no full-text support; search falls back to icontains.'
+            ))
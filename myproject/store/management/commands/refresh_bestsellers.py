@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.bestsellers import get_window_days, refresh_recent_sales
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Re-age the rolling best-seller window (run periodically, e.g. hourly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Window length (default: settings.BESTSELLER_WINDOW_DAYS or 30)')
+        parser.add_argument('--lifetime', action='store_true',
+                            help='Also recount lifetime units_sold from order history')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        days = options['days'] or get_window_days()
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            ids = list(
+                Product.objects.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                total += refresh_recent_sales(
+                    days, Product.objects.filter(pk__in=ids), lifetime=options['lifetime'],
+                )
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed {days}-day sales counters for {total} product(s).'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+from store.related import rebuild_related_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed related-products lists from categories and co-purchases'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        products = entries = 0
+        while True:
+            ids = list(
+                Product.objects.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            entries += rebuild_related_products(ids)
+            products += len(ids)
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {entries} related-product entries for {products} product(s).'
+        ))
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.10 on 2026-10-17 11:40
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def backfill_sales_counters(apps, schema_editor):
+    """Seed the counters from paid, non-cancelled order history."""
+    Product = apps.get_model('store', 'Product')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+
+    def sold_units(since=None):
+        items = OrderItem.objects.filter(
+            product=OuterRef('pk'), order__payment_status='completed',
+        ).exclude(order__status='cancelled')
+        if since is not None:
+            items = items.filter(order__paid_at__gte=since)
+        totals = items.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+        return Coalesce(Subquery(totals), Value(0), output_field=IntegerField())
+
+    Product.objects.update(
+        units_sold=sold_units(),
+        recent_units_sold=sold_units(timezone.now() - timedelta(days=30)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_product_rating_aggregates'),
+        ('orders', '0010_sync_payment_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='recent_units_sold',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['-recent_units_sold', '-units_sold', '-created_at'], name='product_bestseller_idx'),
+        ),
+        migrations.RunPython(backfill_sales_counters, migrations.RunPython.noop),
+    ]
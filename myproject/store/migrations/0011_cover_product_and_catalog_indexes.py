@@ -0,0 +1,56 @@
+# Generated by Django 5.2.10 on 2026-10-17 13:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_covers(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    Product = apps.get_model('store', 'Product')
+    covers = Product.objects.filter(
+        category=models.OuterRef('pk'), is_available=True,
+    ).exclude(image__isnull=True).exclude(image='').order_by('-created_at', '-id')
+    Category.objects.update(cover_product=models.Subquery(covers.values('pk')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    # Databases that ran the two separately are left as they are
+    replaces = [('store', '0011_category_cover_product'), ('store', '0012_catalog_indexes')]
+
+    dependencies = [
+        ('store', '0010_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='cover_product',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='store.product'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+        ),
+        migrations.RunPython(populate_covers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['-created_at', '-id'], name='product_avail_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['price', 'id'], name='product_avail_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['name', 'id'], name='product_avail_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['category', 'price', 'id'], name='product_avail_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['stock'], name='product_stock_idx'),
+        ),
+    ]
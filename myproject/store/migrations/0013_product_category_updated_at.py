@@ -0,0 +1,31 @@
+# Generated by Django 5.2.10 on 2026-10-17 11:50
+
+from django.db import migrations, models
+
+
+def backfill_product_updated_at(apps, schema_editor):
+    # Existing rows were stamped with the migration time; their creation
+    # time is the best estimate of the last edit we have.
+    Product = apps.get_model('store', 'Product')
+    Product.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_cover_product_and_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_product_updated_at, migrations.RunPython.noop),
+    ]
@@ -3,10 +3,18 @@ from django.contrib.auth.models import User
 from django.utils.html import format_html
 from cloudinary.models import CloudinaryField
 
+from .images import image_url
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=120, unique=True)
+    # Newest available product with an image, kept current by store.signals
+    cover_product = models.ForeignKey(
+        'Product', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+', editable=False,
+    )
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['name']
@@ -15,6 +23,19 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def refresh_covers(cls, category_ids):
+        """Re-pick the cover product of the given categories in one UPDATE"""
+        category_ids = [pk for pk in category_ids if pk is not None]
+        if not category_ids:
+            return 0
+        covers = Product.objects.filter(
+            category=models.OuterRef('pk'), is_available=True,
+        ).exclude(image__isnull=True).exclude(image='').order_by('-created_at', '-id')
+        return cls.objects.filter(pk__in=category_ids).update(
+            cover_product=models.Subquery(covers.values('pk')[:1])
+        )
+
     def get_product_count(self):
         return self.products.count()
     get_product_count.short_description = 'Products'
@@ -30,14 +51,84 @@ class Product(models.Model):
     image = CloudinaryField('image', blank=True, null=True)
     is_available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
 
+    # Review aggregates, maintained incrementally by store.signals
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Sales counters: lifetime units, and units in the rolling best-seller
+    # window (kept up to date on payment, re-aged by refresh_bestsellers)
+    units_sold = models.PositiveIntegerField(default=0, editable=False)
+    recent_units_sold = models.PositiveIntegerField(default=0, editable=False)
+
     class Meta:
         ordering = ['-created_at']
+        # One index per catalog access path (see store.queryplans); the
+        # storefront only lists available products, so most are partial.
+        indexes = [
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+            models.Index(
+                fields=['-recent_units_sold', '-units_sold', '-created_at'],
+                condition=models.Q(is_available=True),
+                name='product_bestseller_idx',
+            ),
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(is_available=True),
+                name='product_avail_newest_idx',
+            ),
+            models.Index(
+                fields=['price', 'id'],
+                condition=models.Q(is_available=True),
+                name='product_avail_price_idx',
+            ),
+            models.Index(
+                fields=['name', 'id'],
+                condition=models.Q(is_available=True),
+                name='product_avail_name_idx',
+            ),
+            models.Index(
+                fields=['category', 'price', 'id'],
+                condition=models.Q(is_available=True),
+                name='product_avail_cat_price_idx',
+            ),
+            models.Index(fields=['stock'], name='product_stock_idx'),
+        ]
+
+    # Moved only by F() UPDATEs (store.ratings, store.bestsellers), so a
+    # full save() of an instance loaded earlier must not write them back
+    COUNTER_FIELDS = (
+        'rating_sum', 'rating_count', 'rating_1_count', 'rating_2_count', 'rating_3_count',
+        'rating_4_count', 'rating_5_count', 'units_sold', 'recent_units_sold',
+    )
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Save, leaving the stored counters alone unless ``update_fields`` names them."""
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored category so a move can refresh both covers
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
     def get_stock_status(self):
         if self.stock == 0:
             return format_html('<span style="color: red; font-weight: bold;">Out of Stock</span>')
@@ -49,7 +140,7 @@ class Product(models.Model):
 
     def admin_thumbnail(self):
         if self.image:
-            return format_html('<img src="{}" style="max-height: 100px; max-width: 100px; border-radius: 8px;" />', self.image.url)
+            return format_html('<img src="{}" style="max-height: 100px; max-width: 100px; border-radius: 8px;" />', image_url(self.image, 200))
         return format_html('<span style="color: gray;">No Image</span>')
     admin_thumbnail.short_description = 'Preview'
 
@@ -59,34 +150,23 @@ class Product(models.Model):
         return 0 < self.stock < 10
 
     def get_average_rating(self):
-        """Calculate average rating from reviews"""
-        reviews = self.reviews.all()
-        if reviews:
-            total = sum(review.rating for review in reviews)
-            return round(total / len(reviews), 1)
+        """Average rating from the stored review aggregates"""
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 1)
         return 0
 
     def get_review_count(self):
         """Get total number of reviews"""
-        return self.reviews.count()
-
-    def reduce_stock(self, quantity):
-        """Reduce stock after successful payment"""
-        if self.stock >= quantity:
-            self.stock -= quantity
-            if self.stock == 0:
-                self.is_available = False
-            self.save()
-        else:
-            raise ValueError(f"Insufficient stock for {self.name}")
-
-    def increase_stock(self, quantity):
-        """Increase stock (e.g., when order is cancelled)"""
-        self.stock += quantity
-        if self.stock > 0:
-            self.is_available = True
-        self.save()
+        return self.rating_count
 
+    def get_rating_histogram(self):
+        """(stars, count, percent) for 5 down to 1 stars"""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}_count')
+            percent = round(count * 100 / self.rating_count) if self.rating_count else 0
+            histogram.append((stars, count, percent))
+        return histogram
 
 
 class Review(models.Model):
@@ -108,5 +188,39 @@ class Review(models.Model):
         ordering = ['-created_at']
         unique_together = ('product', 'user')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored rating so edits can adjust the product aggregates
+        instance._loaded_rating = instance.__dict__.get('rating')
+        instance._loaded_product_id = instance.__dict__.get('product_id')
+        return instance
+
     def __str__(self):
         return f'{self.user.username} - {self.product.name} ({self.rating} stars)'
+
+
+class RelatedProduct(models.Model):
+    """Precomputed "you may also like" entry, maintained by store.related"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    co_purchases = models.PositiveIntegerField(default=0)
+    same_category = models.BooleanField(default=False)
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'related')
+        indexes = [
+            models.Index(fields=['product', '-score'], name='related_product_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.related_id} ({self.score})'
+
+
+class CatalogVersion(models.Model):
+    """Single row holding the catalog version every worker keys its caches on, see store.cache"""
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.version)
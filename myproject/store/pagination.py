@@ -0,0 +1,217 @@
+"""
+Keyset (cursor) pagination and cheap result counts for large querysets.
+
+Unlike OFFSET paging, a keyset page filters on the sort key of the last row
+seen, so page 500 costs the same index range scan as page 1.
+"""
+import base64
+import binascii
+import datetime
+import decimal
+import json
+from collections import namedtuple
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 96
+
+ApproximateCount = namedtuple('ApproximateCount', ['value', 'exact'])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginate ``queryset`` on ``ordering``, a list of field names such as
+    ``['-price', '-id']``. The last field must be unique so every row has a
+    distinct position; ``id`` is the usual tiebreaker.
+    """
+
+    def __init__(self, queryset, ordering, per_page=DEFAULT_PAGE_SIZE):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = clamp_page_size(per_page)
+
+    def page_queryset(self, cursor=None):
+        """``(queryset, backwards)``: the query ``page(cursor)`` runs, one row over a page."""
+        backwards = False
+        queryset = self.queryset
+        ordering = self.ordering
+        if cursor:
+            direction, values = decode_cursor(cursor, len(self.ordering))
+            values = self._coerce(values, cursor)
+            backwards = direction == 'previous'
+            queryset = queryset.filter(self._after(values, reverse=backwards))
+        if backwards:
+            ordering = [_reverse(field) for field in ordering]
+        return queryset.order_by(*ordering)[:self.per_page + 1], backwards
+
+    def page(self, cursor=None):
+        queryset, backwards = self.page_queryset(cursor)
+        rows = list(queryset)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or backwards:
+                next_cursor = encode_cursor('next', self._values(rows[-1]))
+            if cursor and (has_more or not backwards):
+                previous_cursor = encode_cursor('previous', self._values(rows[0]))
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def _values(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def _output_field(self, name):
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        if name == 'pk':
+            return self.queryset.model._meta.pk
+        try:
+            return self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def _coerce(self, values, cursor):
+        """Cursor values as the sort fields' Python types; anything else is an invalid cursor."""
+        coerced = []
+        for field, value in zip(self.ordering, values):
+            if value is None or isinstance(value, (list, dict)):
+                raise InvalidCursor(cursor)
+            output_field = self._output_field(field.lstrip('-'))
+            if output_field is not None:
+                try:
+                    value = output_field.to_python(value)
+                    # Range and digit limits, so the value is also safe to bind
+                    output_field.run_validators(value)
+                except (ValidationError, TypeError, ValueError, decimal.InvalidOperation):
+                    raise InvalidCursor(cursor)
+            coerced.append(value)
+        return coerced
+
+    def _after(self, values, reverse=False):
+        """Rows strictly after ``values`` in sort order (before, if ``reverse``)."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return condition
+
+
+def _reverse(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def clamp_page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(value, MAX_PAGE_SIZE))
+
+
+def _json_default(value):
+    # Keep full microsecond precision (DjangoJSONEncoder truncates to ms),
+    # otherwise rows sharing a millisecond would be skipped or repeated.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, values], default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if direction not in ('next', 'previous') or not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+def approximate_count(queryset, cap=1000):
+    """
+    Count ``queryset`` without scanning every matching row.
+
+    Results up to ``cap`` are counted exactly through a bounded subquery.
+    Beyond that Postgres answers from the planner's row estimate and other
+    backends report ``cap`` as a lower bound.
+    """
+    count = queryset.order_by()[:cap + 1].count()
+    if count <= cap:
+        return ApproximateCount(count, True)
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return ApproximateCount(max(int(plan[0]['Plan']['Plan Rows']), cap), False)
+    return ApproximateCount(cap, False)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists over large tables.
+
+    The count comes from ``approximate_count``: exact up to ``count_cap``
+    rows, the planner's estimate beyond that on Postgres. Backends that
+    cannot estimate fall back to ``COUNT(*)`` so every page stays reachable.
+    Pair it with ``show_full_result_count = False``, or the changelist
+    counts the whole table anyway.
+    """
+    count_cap = 10000
+
+    @cached_property
+    def count(self):
+        estimate = approximate_count(self.object_list, self.count_cap)
+        if estimate.exact or connections[self.object_list.db].vendor == 'postgresql':
+            return estimate.value
+        return super().count
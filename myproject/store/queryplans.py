@@ -0,0 +1,72 @@
+"""
+EXPLAIN-based regression checks for the catalog listing queries.
+
+``query_shapes()`` builds its querysets with the same helpers ``home``,
+``products_list`` and ``admin_dashboard`` use (``trending_products``,
+``filter_products``, ``get_sort_ordering``, ``KeysetPaginator`` and
+``low_stock_queryset``), so a change to a view's query is checked as it
+ships. ``check_query_plans`` fails any shape whose plan reads
+``store_product`` with a full table scan.
+
+The dashboard's product aggregates count the whole table by design and are
+not checked.
+"""
+import re
+
+from django.db import connections
+
+from .bestsellers import trending_products
+from .dashboard import low_stock_queryset
+from .facets import PRICE_RANGES, SORT_ORDERINGS, filter_products, get_price_filter, get_sort_ordering
+from .models import Product
+from .pagination import DEFAULT_PAGE_SIZE, KeysetPaginator
+
+
+# A full scan of the product table, as each backend reports it
+SEQUENTIAL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN store_product\b(?! USING)'),
+    'postgresql': re.compile(r'Seq Scan on store_product\b'),
+}
+
+
+def _listing(sort='newest', cursor=None, **filters):
+    """The page query ``products_list`` runs for ``sort`` and the given filters."""
+    products = filter_products(Product.objects.filter(is_available=True), **filters)
+    paginator = KeysetPaginator(products, get_sort_ordering(sort), per_page=DEFAULT_PAGE_SIZE)
+    return paginator.page_queryset(cursor)[0]
+
+
+def query_shapes(category_id=None):
+    """(name, queryset) pairs for every listing query the storefront issues."""
+    shapes = [
+        ('home bestsellers', trending_products()),
+        ('dashboard low stock', low_stock_queryset()),
+    ]
+    # Relevance only applies to searches, which go through the search index
+    sorts = [sort for sort in SORT_ORDERINGS if sort != 'relevance']
+    for sort in sorts:
+        shapes.append((f'list {sort}', _listing(sort)))
+        shapes.append((f'list in-stock {sort}', _listing(sort, in_stock=True)))
+    for value, _label, _condition in PRICE_RANGES:
+        shapes.append((f'list price {value}', _listing('price-low', price_filter=get_price_filter(value))))
+    if category_id is not None:
+        for sort in ['newest', 'price-low', 'price-high']:
+            shapes.append((f'list category {sort}', _listing(sort, category=category_id)))
+    first_page = KeysetPaginator(
+        Product.objects.filter(is_available=True), get_sort_ordering('newest'), per_page=DEFAULT_PAGE_SIZE,
+    ).page()
+    if first_page.next_cursor:
+        shapes.append(('list newest next page', _listing('newest', cursor=first_page.next_cursor)))
+    return shapes
+
+
+def check_query_plans(using='default', category_id=None):
+    """Return ``(name, plan, ok)`` for every shape."""
+    vendor = connections[using].vendor
+    pattern = SEQUENTIAL_SCAN.get(vendor)
+    results = []
+    for name, queryset in query_shapes(category_id):
+        plan = queryset.using(using).explain()
+        ok = pattern is None or not pattern.search(plan)
+        results.append((name, plan, ok))
+    return results
@@ -0,0 +1,54 @@
+"""
+Denormalized review aggregates stored on Product.
+
+``rating_sum``, ``rating_count`` and ``rating_<n>_count`` are adjusted with
+single F() UPDATEs as reviews change, so reading a product's rating never
+touches the Review table.
+"""
+from collections import defaultdict
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Product, Review
+
+
+def apply_rating_changes(changes):
+    """
+    Apply ``(product_id, rating, sign)`` changes, one UPDATE per product.
+
+    ``sign`` is +1 for an added rating and -1 for a removed one; an edit is
+    a removal of the old rating plus an addition of the new one.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for product_id, rating, sign in changes:
+        deltas[product_id]['rating_sum'] += rating * sign
+        deltas[product_id]['rating_count'] += sign
+        deltas[product_id][f'rating_{rating}_count'] += sign
+
+    for product_id, fields in deltas.items():
+        updates = {field: F(field) + delta for field, delta in fields.items() if delta}
+        if updates:
+            Product.objects.filter(pk=product_id).update(**updates)
+
+
+def rebuild_rating_aggregates(products=None):
+    """Recompute the aggregates from scratch for ``products`` (default: all)."""
+    if products is None:
+        products = Product.objects.all()
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+
+    def aggregate(expression):
+        return Coalesce(
+            Subquery(reviews.annotate(value=expression).values('value')),
+            Value(0),
+            output_field=IntegerField(),
+        )
+
+    updates = {
+        'rating_sum': aggregate(Sum('rating')),
+        'rating_count': aggregate(Count('id')),
+    }
+    for stars, _label in Review.RATING_CHOICES:
+        updates[f'rating_{stars}_count'] = aggregate(Count('id', filter=Q(rating=stars)))
+    return products.order_by().update(**updates)
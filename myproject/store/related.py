@@ -0,0 +1,238 @@
+"""
+Precomputed related products.
+
+Each product keeps up to ``RELATED_LIST_SIZE`` RelatedProduct rows scored
+from co-purchases (``CO_PURCHASE_WEIGHT`` points per shared paid order) plus
+one point for sharing a category. Paying for an order bumps the scores of
+every pair in it, then trims the lists it touched back to their top
+``RELATED_LIST_SIZE``; ``manage.py refresh_related_products`` rebuilds the
+lists from every paid order. A product that is created or moves category
+gets its own list rebuilt, joins the lists of its new category that have
+room and has its entries elsewhere re-scored (``join_category_lists``).
+Full lists are left to the next rebuild: with no co-purchases yet it
+could at best tie their weakest entries.
+Product pages show a random rotation of the stored list instead of
+``ORDER BY RANDOM()`` over the whole category.
+"""
+import random
+from collections import Counter, defaultdict
+from itertools import permutations
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Greatest
+
+from .models import Product, RelatedProduct
+
+
+RELATED_LIST_SIZE = 12
+CO_PURCHASE_WEIGHT = 10
+DELETE_BATCH_SIZE = 1000
+
+
+def get_related_products(product, limit=4):
+    """Pick ``limit`` available related products at a random list offset."""
+    entries = list(
+        RelatedProduct.objects.filter(product=product, related__is_available=True)
+        .select_related('related')
+        .order_by('-score', 'related_id')[:RELATED_LIST_SIZE]
+    )
+    if not entries:
+        return list(
+            Product.objects.filter(category_id=product.category_id, is_available=True)
+            .exclude(pk=product.pk)[:limit]
+        )
+    start = random.randrange(len(entries))
+    rotated = entries[start:] + entries[:start]
+    return [entry.related for entry in rotated[:limit]]
+
+
+def record_co_purchases(product_ids, sign=1):
+    """Add or remove one co-purchase for every ordered pair in ``product_ids``."""
+    product_ids = set(product_ids)
+    if len(product_ids) < 2:
+        return
+    if sign > 0:
+        categories = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'category_id'))
+        RelatedProduct.objects.bulk_create(
+            [
+                RelatedProduct(
+                    product_id=a, related_id=b,
+                    same_category=categories.get(a) == categories.get(b),
+                    score=int(categories.get(a) == categories.get(b)),
+                )
+                for a, b in permutations(product_ids, 2)
+            ],
+            ignore_conflicts=True,
+        )
+    RelatedProduct.objects.filter(
+        product_id__in=product_ids, related_id__in=product_ids,
+    ).update(
+        co_purchases=Greatest(F('co_purchases') + sign, Value(0)),
+        score=Greatest(F('score') + sign * CO_PURCHASE_WEIGHT, Value(0)),
+    )
+    if sign > 0:
+        trim_related_lists(product_ids)
+
+
+def record_co_purchases_many(product_id_sets, sign=1):
+    """
+    ``record_co_purchases`` for many orders at once.
+
+    Pairs are tallied in memory, then updated with one UPDATE per distinct
+    tally rather than per order.
+    """
+    pairs = Counter()
+    for product_ids in product_id_sets:
+        pairs.update(permutations(set(product_ids), 2))
+    if not pairs:
+        return
+    product_ids = {a for a, _b in pairs}
+    if sign > 0:
+        categories = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'category_id'))
+        RelatedProduct.objects.bulk_create(
+            [
+                RelatedProduct(
+                    product_id=a, related_id=b,
+                    same_category=categories.get(a) == categories.get(b),
+                    score=int(categories.get(a) == categories.get(b)),
+                )
+                for a, b in pairs
+            ],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+    by_tally = defaultdict(list)
+    # Filtering on both columns makes SQLite probe every combination
+    for pk, a, b in RelatedProduct.objects.filter(product_id__in=product_ids).values_list(
+        'pk', 'product_id', 'related_id',
+    ):
+        if (a, b) in pairs:
+            by_tally[pairs[a, b]].append(pk)
+    for tally, pks in by_tally.items():
+        RelatedProduct.objects.filter(pk__in=pks).update(
+            co_purchases=Greatest(F('co_purchases') + sign * tally, Value(0)),
+            score=Greatest(F('score') + sign * tally * CO_PURCHASE_WEIGHT, Value(0)),
+        )
+    if sign > 0:
+        trim_related_lists(product_ids)
+
+
+def trim_related_lists(product_ids):
+    """
+    Drop the entries of ``product_ids`` below their top ``RELATED_LIST_SIZE``.
+
+    Ranked the way product pages read them (score, then ``related_id``), so
+    the table stays ``RELATED_LIST_SIZE`` rows per product however many
+    distinct pairs orders bring in. Returns how many rows went.
+    """
+    kept = Counter()
+    surplus = []
+    for pk, product_id in (
+        RelatedProduct.objects.filter(product_id__in=product_ids)
+        .order_by('product_id', '-score', 'related_id')
+        .values_list('pk', 'product_id')
+    ):
+        kept[product_id] += 1
+        if kept[product_id] > RELATED_LIST_SIZE:
+            surplus.append(pk)
+    for start in range(0, len(surplus), DELETE_BATCH_SIZE):
+        RelatedProduct.objects.filter(pk__in=surplus[start:start + DELETE_BATCH_SIZE]).delete()
+    return len(surplus)
+
+
+def join_category_lists(product_id, category_id):
+    """
+    Bring other products' lists in step with ``product_id`` now being in ``category_id``.
+
+    Entries pointing at it gain or lose the same-category point (pure
+    same-category ones are dropped once it leaves), and it is added to the
+    lists of its category with fewer than ``RELATED_LIST_SIZE`` entries.
+    """
+    entries = RelatedProduct.objects.filter(related_id=product_id)
+    entries.filter(same_category=True).exclude(product__category_id=category_id).update(
+        same_category=False, score=Greatest(F('score') - 1, Value(0)),
+    )
+    entries.filter(same_category=False, co_purchases=0).delete()
+    entries.filter(same_category=False, product__category_id=category_id).update(
+        same_category=True, score=F('score') + 1,
+    )
+    with_room = (
+        Product.objects.filter(category_id=category_id).exclude(pk=product_id)
+        .annotate(entries=Count('related_entries')).filter(entries__lt=RELATED_LIST_SIZE)
+        .values_list('pk', flat=True)
+    )
+    RelatedProduct.objects.bulk_create(
+        [
+            RelatedProduct(product_id=pk, related_id=product_id, same_category=True, score=1)
+            for pk in with_room
+        ],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+
+
+def rebuild_related_products(product_ids):
+    """Recompute the stored lists of ``product_ids`` from scratch."""
+    from orders.models import OrderItem
+
+    product_ids = list(product_ids)
+    categories = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'category_id'))
+
+    co_purchases = defaultdict(dict)
+    pairs = (
+        OrderItem.objects.filter(product_id__in=product_ids, order__payment_status='completed')
+        .exclude(order__status='cancelled')
+        .annotate(other=F('order__items__product'))
+        .filter(~Q(other=F('product')))
+        .values_list('product', 'other')
+        .annotate(orders=Count('order', distinct=True))
+    )
+    for product_id, other_id, orders in pairs:
+        co_purchases[product_id][other_id] = orders
+
+    other_ids = {other for others in co_purchases.values() for other in others}
+    categories.update(
+        Product.objects.filter(pk__in=other_ids - categories.keys()).values_list('pk', 'category_id')
+    )
+
+    category_candidates = {}
+    for category_id in set(categories[pk] for pk in product_ids if pk in categories):
+        category_candidates[category_id] = list(
+            Product.objects.filter(category_id=category_id, is_available=True)
+            .order_by('-units_sold', '-created_at')
+            .values_list('pk', flat=True)[:RELATED_LIST_SIZE + 1]
+        )
+        for other_id in category_candidates[category_id]:
+            categories.setdefault(other_id, category_id)
+
+    entries = []
+    for product_id in product_ids:
+        if product_id not in categories:
+            continue
+        category_id = categories[product_id]
+        candidates = {}
+        for other_id in category_candidates.get(category_id, []):
+            candidates[other_id] = 0
+        for other_id, orders in co_purchases[product_id].items():
+            candidates[other_id] = orders
+        candidates.pop(product_id, None)
+
+        scored = []
+        for other_id, orders in candidates.items():
+            same_category = categories.get(other_id) == category_id
+            score = orders * CO_PURCHASE_WEIGHT + int(same_category)
+            scored.append((score, other_id, orders, same_category))
+        scored.sort(key=lambda row: (-row[0], row[1]))
+        entries.extend(
+            RelatedProduct(
+                product_id=product_id, related_id=other_id,
+                co_purchases=orders, same_category=same_category, score=score,
+            )
+            for score, other_id, orders, same_category in scored[:RELATED_LIST_SIZE]
+        )
+
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id__in=product_ids).delete()
+        RelatedProduct.objects.bulk_create(entries)
+    return len(entries)
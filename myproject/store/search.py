@@ -0,0 +1,222 @@
+"""
+Full-text product search.
+
+SQLite keeps an FTS5 table (``store_product_fts``) in sync through triggers,
+Postgres keeps a weighted ``tsvector`` column on ``store_product`` behind a GIN
+index. Any other backend falls back to ``icontains`` filtering.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+
+FTS_TABLE = 'store_product_fts'
+
+# Relative weight of the name, description and category columns
+SQLITE_RANK = f'-bm25({FTS_TABLE}, 10.0, 1.0, 5.0)'
+
+# Trigger bodies avoid INSERT OR REPLACE: an outer upsert (bulk_create with
+# update_conflicts) overrides a trigger's conflict clause, turning it into ABORT.
+SQLITE_SETUP = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS store_product_fts_insert AFTER INSERT ON store_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description,
+                (SELECT name FROM store_category WHERE id = new.category_id));
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS store_product_fts_update
+        AFTER UPDATE OF name, description, category_id ON store_product BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description,
+                (SELECT name FROM store_category WHERE id = new.category_id));
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS store_product_fts_delete AFTER DELETE ON store_product BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS store_category_fts_update AFTER UPDATE OF name ON store_category BEGIN
+        UPDATE {FTS_TABLE} SET category = new.name
+        WHERE rowid IN (SELECT id FROM store_product WHERE category_id = new.id);
+    END""",
+]
+
+SQLITE_TEARDOWN = [
+    "DROP TRIGGER IF EXISTS store_product_fts_insert",
+    "DROP TRIGGER IF EXISTS store_product_fts_update",
+    "DROP TRIGGER IF EXISTS store_product_fts_delete",
+    "DROP TRIGGER IF EXISTS store_category_fts_update",
+]
+
+SQLITE_REBUILD = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"""INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        SELECT p.id, p.name, p.description, c.name
+        FROM store_product p JOIN store_category c ON c.id = p.category_id""",
+]
+
+POSTGRES_SETUP = [
+    "ALTER TABLE store_product ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    """CREATE OR REPLACE FUNCTION store_product_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(
+                (SELECT name FROM store_category WHERE id = NEW.category_id), '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS store_product_search_vector ON store_product",
+    """CREATE TRIGGER store_product_search_vector
+        BEFORE INSERT OR UPDATE OF name, description, category_id ON store_product
+        FOR EACH ROW EXECUTE FUNCTION store_product_search_vector()""",
+    """CREATE OR REPLACE FUNCTION store_category_search_vector() RETURNS trigger AS $$
+    BEGIN
+        UPDATE store_product SET name = name WHERE category_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS store_category_search_vector ON store_category",
+    """CREATE TRIGGER store_category_search_vector
+        AFTER UPDATE OF name ON store_category
+        FOR EACH ROW EXECUTE FUNCTION store_category_search_vector()""",
+    """CREATE INDEX IF NOT EXISTS store_product_search_vector_gin
+        ON store_product USING GIN (search_vector)""",
+]
+
+POSTGRES_REBUILD = [
+    "UPDATE store_product SET name = name",
+]
+
+# Aliases whose database has a usable search index, filled lazily
+_index_ready = {}
+
+
+def search_terms(query):
+    """Split a raw search box value into lowercase word tokens."""
+    return re.findall(r'\w+', query.lower())[:10]
+
+
+def install_search_index(using='default', rebuild=False):
+    """
+    Create the search index, its triggers and backfill it (idempotent).
+
+    Runs after every ``migrate``, as the SQLite triggers are dropped for the
+    duration of the migration (see ``suspend_search_index``).
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+            created = cursor.fetchone() is None
+            try:
+                for statement in SQLITE_SETUP:
+                    cursor.execute(statement)
+            except Exception:
+                # SQLite compiled without FTS5: keep the icontains fallback
+                _index_ready[using] = False
+                return False
+            if not created and not rebuild:
+                cursor.execute(f"SELECT (SELECT COUNT(*) FROM {FTS_TABLE}) != (SELECT COUNT(*) FROM store_product)")
+                rebuild = bool(cursor.fetchone()[0])
+            if created or rebuild:
+                for statement in SQLITE_REBUILD:
+                    cursor.execute(statement)
+        elif connection.vendor == 'postgresql':
+            for statement in POSTGRES_SETUP:
+                cursor.execute(statement)
+            if rebuild:
+                for statement in POSTGRES_REBUILD:
+                    cursor.execute(statement)
+            else:
+                cursor.execute("UPDATE store_product SET name = name WHERE search_vector IS NULL")
+        else:
+            _index_ready[using] = False
+            return False
+    _index_ready[using] = True
+    return True
+
+
+def suspend_search_index(using='default'):
+    """
+    Drop the SQLite triggers ahead of ``migrate``.
+
+    SQLite alters a table by copying it to a new one and renaming it back;
+    the rename fails while a trigger still refers to the dropped original.
+    ``install_search_index`` recreates them (and re-syncs) afterwards.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in SQLITE_TEARDOWN:
+            cursor.execute(statement)
+
+
+def _has_search_index(using):
+    if using not in _index_ready:
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+                _index_ready[using] = cursor.fetchone() is not None
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT 1 FROM information_schema.columns "
+                    "WHERE table_name = 'store_product' AND column_name = 'search_vector'"
+                )
+                _index_ready[using] = cursor.fetchone() is not None
+            else:
+                _index_ready[using] = False
+    return _index_ready[using]
+
+
+def search_products(queryset, query):
+    """
+    Restrict a Product queryset to rows matching ``query``.
+
+    Every term is matched as a prefix and all terms must match. The result is
+    annotated with ``search_rank`` (higher is more relevant) so callers can
+    order by it alongside any other filters already applied.
+    """
+    terms = search_terms(query)
+    if not terms:
+        # Nothing searchable (e.g. only punctuation): no results, but still
+        # sortable by relevance like any other search
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    using = queryset.db
+    vendor = connections[using].vendor
+    if vendor == 'sqlite' and _has_search_index(using):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = store_product.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+        ).annotate(search_rank=RawSQL(SQLITE_RANK, [], output_field=FloatField()))
+
+    if vendor == 'postgresql' and _has_search_index(using):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        return queryset.extra(
+            where=["store_product.search_vector @@ to_tsquery('english', %s)"],
+            params=[tsquery],
+        ).annotate(search_rank=RawSQL(
+            "ts_rank(store_product.search_vector, to_tsquery('english', %s))",
+            [tsquery],
+            output_field=FloatField(),
+        ))
+
+    condition = Q()
+    for term in terms:
+        condition &= (
+            Q(name__icontains=term) |
+            Q(description__icontains=term) |
+            Q(category__name__icontains=term)
+        )
+    return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
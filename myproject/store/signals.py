@@ -0,0 +1,72 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version
+from .models import Category, Product, Review
+from .ratings import apply_rating_changes, rebuild_rating_aggregates
+from .related import join_category_lists, rebuild_related_products
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_rating = getattr(instance, '_loaded_rating', None)
+    old_product_id = getattr(instance, '_loaded_product_id', None)
+    if created:
+        apply_rating_changes([(instance.product_id, instance.rating, 1)])
+    elif old_rating is None:
+        # Saved through an instance that was never loaded: old value unknown
+        rebuild_rating_aggregates(Product.objects.filter(pk=instance.product_id))
+    elif (old_product_id, old_rating) != (instance.product_id, instance.rating):
+        apply_rating_changes([
+            (old_product_id, old_rating, -1),
+            (instance.product_id, instance.rating, 1),
+        ])
+    instance._loaded_rating = instance.rating
+    instance._loaded_product_id = instance.product_id
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    rating = getattr(instance, '_loaded_rating', None) or instance.rating
+    product_id = getattr(instance, '_loaded_product_id', None) or instance.product_id
+    apply_rating_changes([(product_id, rating, -1)])
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_category_id = getattr(instance, '_loaded_category_id', None)
+    if created or old_category_id != instance.category_id:
+        # A related list of its own, and a place in its category's lists
+        rebuild_related_products([instance.pk])
+        join_category_lists(instance.pk, instance.category_id)
+    Category.refresh_covers({instance.category_id, old_category_id})
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    Category.refresh_covers([instance.category_id])
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # A full save writes back the cover the instance was loaded with,
+    # which a product change may have replaced since
+    Category.refresh_covers([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def catalog_changed(sender, **kwargs):
+    # Registered last so it runs after the aggregate/cover updates above
+    bump_catalog_version()
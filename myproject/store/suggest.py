@@ -0,0 +1,297 @@
+"""
+In-memory prefix index behind the search box's typeahead (``/api/suggest/``).
+
+Each worker builds a ``SuggestIndex`` over the names of available products
+the first time it is asked for a suggestion. Names are split into casefolded
+words; the sorted vocabulary is bisected for the words a typed prefix can
+complete, and every word points at a posting list of the products using it.
+Products are numbered by popularity, so the lowest numbers across those
+lists are the best suggestions; for one- to three-letter prefixes, which
+complete too many words to merge, the best products are precomputed.
+With several words typed, candidates come from the rarest one and are
+checked for the others.
+
+Everything product-sized lives in ``array``s and UTF-8 blobs rather than
+per-product Python objects, about 120 bytes per name, and at most
+``SUGGEST_MAX_PRODUCTS`` of the best-selling products are indexed.
+
+When the catalog version moves, only products changed since the last load
+are fetched; they shadow their indexed entries from a small overlay until
+it grows past ``OVERLAY_LIMIT`` (or a product has disappeared), at which
+point the index is rebuilt.
+"""
+import heapq
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import get_catalog_version
+from .models import Category, Product
+
+
+DEFAULT_MAX_PRODUCTS = 200_000
+SHORT_PREFIX = 3
+TOP_PER_PREFIX = 50
+MAX_CANDIDATES = 2000
+MAX_MERGED_WORDS = 256
+# Posting lists up to this long are sorted outright rather than merged
+MAX_SORTED_POSTINGS = 20_000
+OVERLAY_LIMIT = 2000
+# Rows saved while a refresh is running still get picked up by the next one
+REFRESH_OVERLAP = timedelta(seconds=60)
+# How long a capped index, which can't notice deletions, is kept at most
+CAPPED_REBUILD_AFTER = timedelta(hours=1)
+
+_WORD = re.compile(r'\w+')
+
+
+def get_max_products():
+    return getattr(settings, 'SUGGEST_MAX_PRODUCTS', DEFAULT_MAX_PRODUCTS)
+
+
+def words(text):
+    return _WORD.findall(text.casefold())
+
+
+def _matches(tokens, name_words):
+    return all(any(word.startswith(token) for word in name_words) for token in tokens)
+
+
+class SuggestIndex:
+    """
+    Prefix index over ``(product_id, name, slug, score)`` rows, given best first.
+    """
+
+    def __init__(self, rows):
+        self.product_ids = array('I')
+        self.scores = array('Q')
+        self.offsets = array('I', [0])
+        # ' word word ...' per entry, for checking the other words of a query
+        self.word_offsets = array('I', [0])
+        blob = bytearray()
+        word_blob = bytearray()
+        postings = {}
+        for entry, (pk, name, slug, score) in enumerate(rows):
+            self.product_ids.append(pk)
+            self.scores.append(score)
+            blob += f'{name}\x1f{slug}'.encode()
+            self.offsets.append(len(blob))
+            name_words = set(words(name))
+            word_blob += ''.join(f' {word}' for word in name_words).encode()
+            self.word_offsets.append(len(word_blob))
+            for word in name_words:
+                posting = postings.get(word)
+                if posting is None:
+                    posting = postings[word] = array('I')
+                posting.append(entry)
+        self.blob = blob
+        self.word_blob = word_blob
+        self.sorted_ids = array('I', sorted(self.product_ids))
+
+        # One posting array for the whole vocabulary, sliced by word
+        self.vocabulary = sorted(postings)
+        self.postings = array('I')
+        self.posting_starts = array('I')
+        for word in self.vocabulary:
+            self.posting_starts.append(len(self.postings))
+            self.postings.extend(postings.pop(word))
+        self.posting_starts.append(len(self.postings))
+
+        self.top = self._build_top()
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def _posting(self, position):
+        return self.postings[self.posting_starts[position]:self.posting_starts[position + 1]]
+
+    def _word_range(self, prefix):
+        start = bisect_left(self.vocabulary, prefix)
+        end = bisect_left(self.vocabulary, prefix + '\U0010ffff', start)
+        return start, end
+
+    def _best(self, start, end, limit):
+        """The ``limit`` lowest (best) entries using any of the words ``start:end``."""
+        low, high = self.posting_starts[start], self.posting_starts[end]
+        if high - low <= MAX_SORTED_POSTINGS:
+            return array('I', sorted(set(self.postings[low:high]))[:limit])
+        best = []
+        for entry in heapq.merge(*(self._posting(position) for position in range(start, end))):
+            if not best or best[-1] != entry:
+                best.append(entry)
+                if len(best) >= limit:
+                    break
+        return array('I', best)
+
+    def _build_top(self):
+        # The vocabulary is sorted, so the words sharing a prefix are adjacent
+        top = {}
+        for length in range(1, SHORT_PREFIX + 1):
+            start = 0
+            while start < len(self.vocabulary):
+                prefix = self.vocabulary[start][:length]
+                if len(prefix) < length:
+                    start += 1
+                    continue
+                end = self._word_range(prefix)[1]
+                top[prefix] = self._best(start, end, TOP_PER_PREFIX)
+                start = end
+        return top
+
+    def contains(self, product_id):
+        position = bisect_left(self.sorted_ids, product_id)
+        return position < len(self.sorted_ids) and self.sorted_ids[position] == product_id
+
+    def entry(self, entry):
+        name, slug = self.blob[self.offsets[entry]:self.offsets[entry + 1]].decode().rsplit('\x1f', 1)
+        return self.product_ids[entry], name, slug, self.scores[entry]
+
+    def candidates(self, tokens):
+        """Yield the entries matching every token as a word prefix, best first."""
+        # Select on the token that completes the fewest product words
+        ranges = [self._word_range(token) for token in tokens]
+        selected = min(range(len(tokens)), key=lambda i: self._posting_count(*ranges[i]))
+        start, end = ranges[selected]
+        selector = tokens[selected]
+        if len(selector) <= SHORT_PREFIX and end - start > MAX_MERGED_WORDS:
+            entries = self.top.get(selector, ())
+        else:
+            entries = self._best(start, end, MAX_CANDIDATES)
+        # ' token' inside ' word word ...' means some word starts with it
+        others = [f' {token}'.encode() for i, token in enumerate(tokens) if i != selected]
+        word_blob, word_offsets = self.word_blob, self.word_offsets
+        for entry in entries:
+            entry_words = word_blob[word_offsets[entry]:word_offsets[entry + 1]]
+            for token in others:
+                if token not in entry_words:
+                    break
+            else:
+                yield entry
+
+    def _posting_count(self, start, end):
+        return self.posting_starts[end] - self.posting_starts[start]
+
+
+def _product_rows(queryset):
+    return queryset.order_by('-units_sold', 'name').values_list('pk', 'name', 'slug', 'units_sold')
+
+
+class Suggester:
+    """
+    The per-worker index, (re)loaded on demand from the catalog version.
+
+    Only the first load makes requests wait; later refreshes happen on one
+    thread while the others keep answering from the previous state.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.index = None
+        self.capped = False
+        self.overlay = {}
+        self.categories = []
+        self.loaded_at = None
+        self.built_at = None
+
+    def _load(self, version):
+        loaded_at = timezone.now()
+        products = Product.objects.filter(is_available=True)
+        max_products = get_max_products()
+        self.index = SuggestIndex(_product_rows(products)[:max_products].iterator(chunk_size=5000))
+        self.capped = len(self.index) >= max_products
+        self.overlay = {}
+        self.categories = self._categories()
+        self.loaded_at = self.built_at = loaded_at
+        self.version = version
+
+    def _categories(self):
+        return [(words(name), name, slug) for name, slug in Category.objects.values_list('name', 'slug')]
+
+    def _refresh(self, version):
+        """Fetch products changed since the last load; False if a rebuild is due."""
+        loaded_at = timezone.now()
+        if self.capped and loaded_at - self.built_at > CAPPED_REBUILD_AFTER:
+            return False
+        changed = Product.objects.filter(updated_at__gte=self.loaded_at - REFRESH_OVERLAP).order_by()
+        overlay = dict(self.overlay)
+        for pk, name, slug, score, available in changed.values_list(
+            'pk', 'name', 'slug', 'units_sold', 'is_available'
+        ).iterator():
+            overlay[pk] = (pk, name, slug, score, words(name)) if available else None
+        if len(overlay) > OVERLAY_LIMIT:
+            return False
+        if not self.capped:
+            # Deleted products never show up as changed; a count tells they went.
+            # (A capped index can't, so it is rebuilt every CAPPED_REBUILD_AFTER.)
+            expected = len(self.index) + sum(
+                (entry is not None) - self.index.contains(pk) for pk, entry in overlay.items()
+            )
+            if Product.objects.filter(is_available=True).count() != expected:
+                return False
+        self.overlay = overlay
+        self.categories = self._categories()
+        self.loaded_at = loaded_at
+        self.version = version
+        return True
+
+    def current(self):
+        version = get_catalog_version()
+        if version == self.version:
+            return self
+        blocking = self.index is None
+        if self.lock.acquire(blocking=blocking):
+            try:
+                if self.version != version and not (self.index is not None and self._refresh(version)):
+                    self._load(version)
+            finally:
+                self.lock.release()
+        return self
+
+    def suggest(self, query, limit=8, category_limit=3):
+        """Categories, then products, whose words start with the query's words."""
+        tokens = words(query)
+        if not tokens:
+            return []
+        index, overlay, categories = self.index, self.overlay, self.categories
+
+        suggestions = [
+            {'type': 'category', 'text': name, 'slug': slug}
+            for name_words, name, slug in categories
+            if _matches(tokens, name_words)
+        ][:category_limit]
+
+        # Indexed candidates come best first, so the first ``limit`` that
+        # survive the overlay are enough to compete with its own matches
+        products = [
+            (-score, name, slug)
+            for pk, name, slug, score, name_words in filter(None, overlay.values())
+            if _matches(tokens, name_words)
+        ]
+        found = 0
+        for entry in index.candidates(tokens):
+            pk, name, slug, score = index.entry(entry)
+            if pk in overlay:
+                continue
+            products.append((-score, name, slug))
+            found += 1
+            if found >= limit:
+                break
+        products.sort()
+        suggestions += [
+            {'type': 'product', 'text': name, 'slug': slug}
+            for _score, name, slug in products[:limit]
+        ]
+        return suggestions
+
+
+_suggester = Suggester()
+
+
+def suggest(query, limit=8):
+    return _suggester.current().suggest(query, limit)
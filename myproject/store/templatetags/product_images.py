@@ -0,0 +1,32 @@
+from django import template
+from django.utils.html import format_html
+
+from store.images import image_srcset, image_url as _image_url
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(image, size, alt='', css_class='', loading='lazy'):
+    """
+    ``<img>`` with a sized ``src`` and ``srcset`` for a product image.
+
+        {% responsive_image product.image "card" alt=product.name css_class="product-img" %}
+
+    ``size`` is a key of ``store.images.IMAGE_SIZES``. Renders nothing when
+    the product has no image. Pass ``loading="eager"`` for above-the-fold images.
+    """
+    if not image:
+        return ''
+    src, srcset, sizes = image_srcset(image, size)
+    return format_html(
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="{}" decoding="async">',
+        src, srcset, sizes, alt, css_class, loading,
+    )
+
+
+@register.filter
+def image_url(image, width):
+    """``{{ product.image|image_url:240 }}``: a single variant URL."""
+    return _image_url(image, int(width))
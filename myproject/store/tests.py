@@ -1,3 +1,911 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import slugify
+from PIL import Image
+
+from orders.models import Order
+from orders.reservations import reserve
+
+from . import cache as cache_module, dashboard, images
+from .cache import bump_catalog_version, get_catalog_version
+from .dashboard import get_dashboard_metrics
+from .facets import compute_facets, filter_products, get_catalog_facets, get_price_filter
+from .images import IMAGE_SIZES, get_image_backend, image_srcset, image_url
+from .models import CatalogVersion, Category, Product, RelatedProduct, Review
+from .pagination import InvalidCursor, KeysetPaginator, encode_cursor
+from .queryplans import query_shapes
+from .related import RELATED_LIST_SIZE, record_co_purchases, record_co_purchases_many
+from .search import search_products
+
+
+# Query counts below assume the catalog version is read from this process's copy
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=60)
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.laptops = Category.objects.create(name='Laptops', slug='laptops')
+        cls.products = [
+            Product.objects.create(
+                name=f'Product {index}',
+                slug=f'product-{index}',
+                price=Decimal(1000 * (index + 1)),
+                stock=index % 3,
+                category=cls.phones if index % 2 else cls.laptops,
+            )
+            for index in range(30)
+        ]
+        Product.objects.create(
+            name='Hidden', slug='hidden', price=Decimal('10'), category=cls.phones, is_available=False,
+        )
+
+    def setUp(self):
+        cache.clear()
+        get_catalog_version()
+
+    def get_json(self, name, queries, *args, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse(name, args=args), params)
+        return response, response.json()
+
+    def test_product_list_pages_with_cursor(self):
+        seen = []
+        params = {'per_page': 7, 'fields': 'id,category,rating'}
+        while True:
+            response, data = self.get_json('api_product_list', 1, **params)
+            self.assertEqual(response.status_code, 200)
+            seen += [item['id'] for item in data['results']]
+            if not data['next_cursor']:
+                break
+            params['cursor'] = data['next_cursor']
+        self.assertEqual(seen, [product.pk for product in reversed(self.products)])
+
+    def test_product_list_query_count_is_fixed_for_every_shape(self):
+        for params in [
+            {},
+            {'fields': 'id'},
+            {'fields': ','.join(['id', 'category', 'rating_histogram', 'description'])},
+            {'category': 'phones', 'sort': 'price-high', 'in_stock': 'yes', 'per_page': 96},
+            {'search': 'product', 'price': 'above-10000'},
+        ]:
+            with self.subTest(params=params):
+                response, _data = self.get_json('api_product_list', 1, **params)
+                self.assertEqual(response.status_code, 200)
+
+    def test_stock_is_what_checkout_would_sell(self):
+        held = self.products[2]
+        reserve(Order.objects.create(full_name='Customer', phone='1', total_amount=Decimal('10')), {held.pk: 2})
+        _response, data = self.get_json('api_product_detail', 1, held.slug, fields='stock,in_stock')
+        self.assertEqual(data, {'stock': 0, 'in_stock': False})
+
+        _response, data = self.get_json('api_product_list', 1, in_stock='yes', fields='id,stock', per_page=96)
+        self.assertNotIn(held.pk, [item['id'] for item in data['results']])
+        self.assertEqual({item['stock'] for item in data['results']}, {1, 2})
+
+    def test_malformed_cursor_is_rejected(self):
+        for cursor in ['not-a-cursor', encode_cursor('next', ['yesterday', 1]), encode_cursor('next', [1])]:
+            with self.subTest(cursor=cursor):
+                response, data = self.get_json('api_product_list', 0, cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(data['error'], 'Invalid cursor.')
+
+    def test_punctuation_only_search_returns_no_results(self):
+        for sort in ['relevance', 'price-low']:
+            with self.subTest(sort=sort):
+                response, data = self.get_json('api_product_list', 0, search='!!', sort=sort)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(data['results'], [])
+                self.assertIsNone(data['next_cursor'])
+
+    def test_sparse_fields(self):
+        _response, data = self.get_json('api_product_list', 1, fields='id,price', per_page=1)
+        self.assertEqual(data['results'], [{'id': self.products[-1].pk, 'price': '30000.00'}])
+
+    def test_unknown_field_and_sort_are_rejected(self):
+        response, data = self.get_json('api_product_list', 0, fields='id,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', data['error'])
+        response, _data = self.get_json('api_product_list', 0, sort='random')
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_keeps_requested_order_and_reports_missing(self):
+        first, second = self.products[3], self.products[10]
+        _response, data = self.get_json(
+            'api_product_batch', 1,
+            ids=f'{second.pk},999999', slugs=f'{first.slug},hidden', fields='id,slug,category',
+        )
+        self.assertEqual([item['id'] for item in data['results']], [second.pk, first.pk])
+        self.assertEqual(data['missing'], [999999, 'hidden'])
+        self.assertEqual(data['results'][0]['category']['slug'], 'laptops')
+
+    def test_product_detail(self):
+        product = self.products[5]
+        _response, data = self.get_json('api_product_detail', 1, product.slug, fields='name,rating_histogram')
+        self.assertEqual(data, {'name': product.name, 'rating_histogram': {str(s): 0 for s in range(5, 0, -1)}})
+        response, _data = self.get_json('api_product_detail', 1, 'hidden')
+        self.assertEqual(response.status_code, 404)
+
+    def test_category_list(self):
+        # Categories plus the facet counts, which are then cached
+        _response, data = self.get_json('api_category_list', 2)
+        self.assertEqual(
+            [(item['slug'], item['product_count']) for item in data['results']],
+            [('laptops', 15), ('phones', 15)],
+        )
+        self.get_json('api_category_list', 1)
+
+    def test_conditional_get_returns_not_modified(self):
+        url = reverse('api_product_list')
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        with self.assertNumQueries(0):
+            repeat = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+
+        self.products[0].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_suggest_answers_from_memory(self):
+        self.client.get(reverse('api_suggest'), {'q': 'pro'})
+        # A different query on the same catalog version is served by the index
+        _response, data = self.get_json('api_suggest', 0, q='Pho')
+        self.assertEqual(data['suggestions'], [{'type': 'category', 'text': 'Phones', 'url': '/products/?category=phones'}])
+        _response, data = self.get_json('api_suggest', 0, q='product 1')
+        self.assertEqual(
+            [item['text'] for item in data['suggestions']],
+            ['Product 1', 'Product 10', 'Product 11', 'Product 12', 'Product 13', 'Product 14', 'Product 15', 'Product 16'],
+        )
+
+        # The edit is picked up incrementally: changed rows, a count, categories
+        self.products[1].name = 'Hidden'
+        self.products[1].save()
+        _response, data = self.get_json('api_suggest', 3, q='product 1')
+        self.assertNotIn('Product 1', [item['text'] for item in data['suggestions']])
+        _response, data = self.get_json('api_suggest', 0, q='hid')
+        self.assertEqual([item['text'] for item in data['suggestions']], ['Hidden'])
+
+    def test_suggest_benchmark_reports_memory_and_latency(self):
+        out = StringIO()
+        call_command('benchmark_suggest', names=2000, repeat=2, query=['pho', 'zzz'], stdout=out)
+        self.assertRegex(out.getvalue(), r'^2000 names, \d+ distinct words: built in .* bytes per name')
+        self.assertRegex(out.getvalue(), r'\npho +8 ')
+        self.assertRegex(out.getvalue(), r'\nzzz +0 ')
+
+
+class ProductListPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.product = Product.objects.create(
+            name='Red Phone', slug='red-phone', price=Decimal('100'), stock=3, category=cls.phones,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_search_without_terms_finds_nothing(self):
+        for sort in ['', 'relevance', 'price-low']:
+            with self.subTest(sort=sort):
+                response = self.client.get(reverse('products_list'), {'search': '!!', 'sort': sort})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotContains(response, 'Red Phone')
+
+    def test_search_products_annotates_rank_without_terms(self):
+        results = search_products(Product.objects.all(), '-- !!').order_by('-search_rank', '-id')
+        self.assertEqual(list(results), [])
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.cases = Category.objects.create(name='Cases', slug='cases')
+        cls.phone = Product.objects.create(
+            name='Galaxy Phone', slug='galaxy-phone', description='An Android smartphone',
+            price=Decimal('12000'), stock=3, category=cls.phones,
+        )
+        cls.case = Product.objects.create(
+            name='Leather Case', slug='leather-case', description='Fits the Galaxy Phone',
+            price=Decimal('900'), stock=0, category=cls.cases,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query, queryset=None):
+        results = search_products(queryset if queryset is not None else Product.objects.all(), query)
+        return list(results.order_by('-search_rank', '-id'))
+
+    def test_terms_match_names_descriptions_and_categories_as_prefixes(self):
+        self.assertEqual(self.search('smartph'), [self.phone])
+        self.assertEqual(self.search('CASES'), [self.case])
+        self.assertCountEqual(self.search('gal'), [self.phone, self.case])
+        # Every term has to match
+        self.assertEqual(self.search('galaxy leather'), [self.case])
+        self.assertEqual(self.search('galaxy tablet'), [])
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('galaxy'), [self.phone, self.case])
+        ranks = search_products(Product.objects.all(), 'galaxy').values_list('pk', 'search_rank')
+        ranks = dict(ranks)
+        self.assertGreater(ranks[self.phone.pk], ranks[self.case.pk])
+
+    def test_index_follows_product_and_category_changes(self):
+        self.phone.name = 'Pixel Phone'
+        self.phone.description = 'Camera first'
+        self.phone.save()
+        self.assertEqual(self.search('pixel camera'), [self.phone])
+        self.assertEqual(self.search('android'), [])
+
+        self.phone.category = self.cases
+        self.phone.save()
+        self.assertCountEqual(self.search('cases'), [self.phone, self.case])
+
+        self.cases.name = 'Covers'
+        self.cases.save()
+        self.assertCountEqual(self.search('covers'), [self.phone, self.case])
+        self.assertEqual(self.search('cases'), [])
+
+        self.case.delete()
+        self.assertEqual(self.search('leather'), [])
+
+    def test_search_combines_with_listing_filters(self):
+        def search(**filters):
+            return self.search('galaxy', filter_products(Product.objects.all(), **filters))
+
+        self.assertEqual(search(category=self.cases), [self.case])
+        self.assertEqual(search(price_filter=get_price_filter('above-10000')), [self.phone])
+        self.assertEqual(search(in_stock=True), [self.phone])
+        self.assertEqual(search(category=self.phones, price_filter=get_price_filter('under-5000')), [])
+
+        for params, expected in [
+            ({'category': 'cases', 'price': 'under-5000'}, [self.case]),
+            ({'in_stock': 'yes'}, [self.phone]),
+        ]:
+            with self.subTest(**params):
+                response = self.client.get(reverse('products_list'), {'search': 'galaxy', **params})
+                self.assertEqual(list(response.context['products']), expected)
+
+    def test_benchmark_rolls_back_its_catalog(self):
+        out = StringIO()
+        call_command('benchmark_search', seed=200, repeat=1, query=['galaxy', 'rugged camera'], stdout=out)
+        self.assertIn('Seeded 200 products.', out.getvalue())
+        self.assertRegex(out.getvalue(), r'\ngalaxy +2 ')
+        self.assertEqual(Product.objects.count(), 2)
+
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=60)
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.cases = Category.objects.create(name='Cases', slug='cases')
+        for name, price, stock, category in [
+            ('Galaxy Phone', 12000, 3, cls.phones),
+            ('Galaxy Lite', 7000, 0, cls.phones),
+            ('Galaxy Case', 900, 5, cls.cases),
+            ('Pixel Case', 800, 2, cls.cases),
+        ]:
+            Product.objects.create(name=name, slug=slugify(name), price=Decimal(price), stock=stock, category=category)
+        cls.categories = [cls.cases, cls.phones]
+
+    def setUp(self):
+        cache.clear()
+        get_catalog_version()
+
+    def test_search_facets_come_from_one_query(self):
+        products = search_products(Product.objects.filter(is_available=True), 'galaxy')
+        with self.assertNumQueries(1):
+            facets = compute_facets(products, self.categories)
+        self.assertEqual(facets, {
+            'total': 3,
+            'in_stock': 2,
+            'categories': {self.phones.pk: 2, self.cases.pk: 1},
+            'price': {'under-5000': 1, '5000-10000': 1, 'above-10000': 1},
+        })
+
+    def test_catalog_facets_are_cached_until_the_catalog_changes(self):
+        products = Product.objects.filter(is_available=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_catalog_facets(products, self.categories)['total'], 4)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_catalog_facets(products, self.categories)['categories'][self.cases.pk], 2)
+
+        Product.objects.filter(name='Pixel Case').update(stock=0)
+        self.assertEqual(get_catalog_facets(products, self.categories)['in_stock'], 3)
+        Product.objects.get(name='Pixel Case').save()
+        facets = get_catalog_facets(products, self.categories)
+        self.assertEqual(facets['in_stock'], 2)
+
+    def test_listing_shows_facets_of_the_search_not_the_filters(self):
+        response = self.client.get(reverse('products_list'), {'search': 'case', 'category': 'cases', 'in_stock': 'yes'})
+        self.assertEqual(response.context['facets']['categories'], {self.phones.pk: 0, self.cases.pk: 2})
+        self.assertEqual(
+            response.context['price_facets'],
+            [('under-5000', 'Under ₹5,000', 2), ('5000-10000', '₹5,000 - ₹10,000', 0), ('above-10000', 'Above ₹10,000', 0)],
+        )
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Phones', slug='phones')
+        cls.products = [
+            Product.objects.create(
+                name=f'Product {index}', slug=f'product-{index}', price=Decimal(100 * (index % 3)), category=category,
+            )
+            for index in range(5)
+        ]
+
+    def paginator(self, ordering):
+        return KeysetPaginator(Product.objects.all(), ordering, per_page=2)
+
+    def test_cursor_round_trip_for_each_field_type(self):
+        for ordering in [['price', 'id'], ['-created_at', '-id'], ['name', 'pk']]:
+            with self.subTest(ordering=ordering):
+                paginator = self.paginator(ordering)
+                seen, cursor = [], None
+                while True:
+                    page = paginator.page(cursor)
+                    seen += [product.pk for product in page]
+                    if not page.has_next:
+                        break
+                    cursor = page.next_cursor
+                expected = Product.objects.order_by(*ordering).values_list('pk', flat=True)
+                self.assertEqual(seen, list(expected))
+                previous = paginator.page(paginator.page(cursor).previous_cursor)
+                self.assertEqual(len(previous), 2)
+
+    def test_wrongly_typed_values_are_invalid_cursors(self):
+        for ordering, values in [
+            (['price', 'id'], ['cheap', 1]),
+            (['price', 'id'], ['1e30', 1]),
+            (['price', 'id'], ['100', 'one']),
+            (['price', 'id'], [100, 2 ** 70]),
+            (['-created_at', '-id'], ['yesterday', 1]),
+            (['-created_at', '-id'], [5, 1]),
+            (['name', 'id'], [None, 1]),
+            (['name', 'id'], [{'a': 1}, [1]]),
+        ]:
+            with self.subTest(ordering=ordering, values=values):
+                with self.assertRaises(InvalidCursor):
+                    self.paginator(ordering).page(encode_cursor('next', values))
+
+    def test_undecodable_cursors_are_invalid(self):
+        for cursor in ['%%%', 'bm90IGpzb24', encode_cursor('sideways', [1, 1]), encode_cursor('next', [1])]:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    self.paginator(['price', 'id']).page(cursor)
+
+    def test_annotated_sort_values_are_coerced(self):
+        paginator = KeysetPaginator(search_products(Product.objects.all(), 'product'), ['-search_rank', '-id'], per_page=2)
+        page = paginator.page(encode_cursor('next', ['0.5', self.products[-1].pk]))
+        self.assertIsInstance(page.object_list, list)
+        with self.assertRaises(InvalidCursor):
+            paginator.page(encode_cursor('next', ['high', 1]))
+
+
+class ImportProductsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.existing = Product.objects.create(
+            name='Old Phone', slug='old-phone', price=Decimal('500'), stock=1, category=cls.phones, units_sold=7,
+        )
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def run_import(self, name, content, *args):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as handle:
+            handle.write(content)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_products', path, '--skip-images', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        stdout, stderr = self.run_import('products.csv', '\n'.join([
+            'name,slug,price,stock,category',
+            'Huge,huge,1e30,1,Phones',
+            'Tiny,tiny,1e-30,1,Phones',
+            'Negative,negative,-1,1,Phones',
+            'Words,words,cheap,1,Phones',
+            'Short,short,10,lots,Phones',
+            ',nameless,10,1,Phones',
+            'Good,good,19.999,2,Tablets',
+        ]))
+        self.assertIn('Line 2: price 1E+30 out of range', stderr)
+        self.assertIn("Line 5: invalid price 'cheap'", stderr)
+        self.assertIn("Line 6: invalid stock 'lots'", stderr)
+        self.assertIn('Line 7: name is required', stderr)
+        self.assertIn('Imported 2 new and 0 updated product(s); skipped 5 invalid row(s).', stdout)
+        self.assertEqual(Product.objects.get(slug='tiny').price, Decimal('0.00'))
+        good = Product.objects.get(slug='good')
+        self.assertEqual((good.price, good.category.name), (Decimal('20.00'), 'Tablets'))
+
+    def test_existing_slugs_are_updated_in_place(self):
+        stdout, _stderr = self.run_import('products.jsonl', '\n'.join([
+            '{"name": "New Phone", "slug": "old-phone", "price": "450", "stock": 9, "category": "phones"}',
+            '{"name": "Second", "price": 99, "category": "Phones", "is_available": "no"}',
+            'not json',
+        ]))
+        self.assertIn('Imported 1 new and 1 updated product(s); skipped 1 invalid row(s).', stdout)
+        self.existing.refresh_from_db()
+        self.assertEqual(
+            (self.existing.name, self.existing.price, self.existing.stock, self.existing.units_sold),
+            ('New Phone', Decimal('450.00'), 9, 7),
+        )
+        self.assertFalse(Product.objects.get(slug='second').is_available)
+
+    def test_dry_run_writes_nothing(self):
+        with self.assertRaisesMessage(CommandError, '1 valid row(s) (0 new, 1 updates), 1 invalid'):
+            self.run_import('products.csv', 'name,slug,price,category\nA,old-phone,1,Phones\nB,b,1e30,Phones\n', '--dry-run')
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.name, 'Old Phone')
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='=HYPERLINK("http://x")', slug='formula')
+        cls.product = Product.objects.create(
+            name='@SUM(A1:A9)', slug='formula-product', description='-2+3', price=Decimal('10'), category=category,
+        )
+
+    def export(self, fmt):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f'products.{fmt}')
+            call_command('export_data', 'products', '--format', fmt, '--output', path, stderr=StringIO())
+            with open(path, newline='', encoding='utf-8') as handle:
+                return handle.read()
+
+    def test_csv_cells_never_start_a_formula(self):
+        rows = list(csv.DictReader(StringIO(self.export('csv'))))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(
+            (rows[0]['name'], rows[0]['description'], rows[0]['category'], rows[0]['price']),
+            ("'@SUM(A1:A9)", "'-2+3", '\'=HYPERLINK("http://x")', '10.00'),
+        )
+
+    def test_jsonl_keeps_values_verbatim(self):
+        row = json.loads(self.export('jsonl'))
+        self.assertEqual((row['name'], row['description']), ('@SUM(A1:A9)', '-2+3'))
+
+
+class RelatedProductTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        phones = Category.objects.create(name='Phones', slug='phones')
+        cases = Category.objects.create(name='Cases', slug='cases')
+        cls.products = [
+            Product.objects.create(
+                name=f'Product {index}', slug=f'product-{index}', price=Decimal('10'),
+                category=phones if index < 10 else cases,
+            )
+            for index in range(20)
+        ]
+        cls.ids = [product.pk for product in cls.products]
+
+    def entries(self, product):
+        return list(
+            RelatedProduct.objects.filter(product=product)
+            .order_by('-score', 'related_id').values_list('related_id', 'co_purchases', 'score')
+        )
+
+    def test_large_order_keeps_top_entries_per_product(self):
+        first = self.ids[0]
+        record_co_purchases(self.ids[:2])
+        record_co_purchases(self.ids)
+
+        self.assertEqual(RelatedProduct.objects.count(), 20 * RELATED_LIST_SIZE)
+        entries = self.entries(first)
+        # Bought together twice, then same-category co-purchases, then the rest by id
+        self.assertEqual(entries[0], (self.ids[1], 2, 21))
+        self.assertEqual([related for related, _orders, _score in entries[1:9]], self.ids[2:10])
+        self.assertEqual([related for related, _orders, _score in entries[9:]], self.ids[10:13])
+
+    def test_batched_recording_is_bounded_and_cancellable(self):
+        record_co_purchases_many([self.ids, self.ids[10:12], self.ids[10:12]])
+        self.assertEqual(RelatedProduct.objects.filter(product_id=self.ids[0]).count(), RELATED_LIST_SIZE)
+        self.assertEqual(self.entries(self.ids[10])[0], (self.ids[11], 3, 31))
+
+        record_co_purchases_many([self.ids[10:12]], sign=-1)
+        self.assertEqual(self.entries(self.ids[10])[0], (self.ids[11], 2, 21))
+        self.assertEqual(RelatedProduct.objects.count(), 20 * RELATED_LIST_SIZE)
+
+    def test_new_and_moved_products_join_their_category_lists(self):
+        phones, cases = self.products[0].category, self.products[10].category
+        self.assertEqual(len(self.entries(self.ids[0])), 9)
+        new = Product.objects.create(name='New phone', slug='new-phone', price=Decimal('10'), category=phones)
+        self.assertIn((new.pk, 0, 1), self.entries(self.ids[0]))
+        self.assertEqual(len(self.entries(new)), 10)
+
+        record_co_purchases([new.pk, self.ids[1]])
+        new.category = cases
+        new.save()
+        # Bought together: kept without the category point; otherwise dropped
+        self.assertNotIn(new.pk, [related for related, _orders, _score in self.entries(self.ids[0])])
+        self.assertIn((new.pk, 1, 10), self.entries(self.ids[1]))
+        self.assertIn((new.pk, 0, 1), self.entries(self.ids[10]))
+        self.assertIn((self.ids[10], 0, 1), self.entries(new))
+
+
+class CategoryCoverTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.cases = Category.objects.create(name='Cases', slug='cases')
+        cls.old = cls.product('Old phone', cls.phones)
+
+    @classmethod
+    def product(cls, name, category, **fields):
+        fields = {'image': 'phones/sample', **fields}
+        return Product.objects.create(name=name, slug=slugify(name), price=Decimal('10'), category=category, **fields)
+
+    def cover(self, category):
+        return Category.objects.get(pk=category.pk).cover_product
+
+    def test_newest_available_product_with_an_image_is_the_cover(self):
+        self.assertEqual(self.cover(self.phones), self.old)
+        new = self.product('New phone', self.phones)
+        self.product('Hidden phone', self.phones, is_available=False)
+        self.product('Plain phone', self.phones, image=None)
+        self.assertEqual(self.cover(self.phones), new)
+        self.assertIsNone(self.cover(self.cases))
+
+    def test_cover_follows_product_changes(self):
+        new = self.product('New phone', self.phones)
+        new.is_available = False
+        new.save()
+        self.assertEqual(self.cover(self.phones), self.old)
+
+        self.old.category = self.cases
+        self.old.save()
+        self.assertIsNone(self.cover(self.phones))
+        self.assertEqual(self.cover(self.cases), self.old)
+
+        self.old.delete()
+        self.assertIsNone(self.cover(self.cases))
+
+    def test_saving_a_stale_category_keeps_its_cover(self):
+        stale = Category.objects.get(pk=self.cases.pk)
+        moved = self.product('Case', self.cases)
+        stale.name = 'Covers'
+        stale.save()
+        self.assertEqual(self.cover(self.cases), moved)
+
+    def test_home_page_queries_do_not_grow_with_categories(self):
+        def home_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+            return len(context.captured_queries)
+
+        before = home_queries()
+        for index in range(5):
+            category = Category.objects.create(name=f'Category {index}', slug=f'category-{index}')
+            self.product(f'Product {index}', category)
+        self.assertEqual(home_queries(), before)
+
+
+class CatalogVersionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.product = Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), category=cls.phones)
+
+    def setUp(self):
+        cache.clear()
+
+    def bump_elsewhere(self):
+        """What another worker's bump looks like to this process: only the row changes."""
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1000)
+        return CatalogVersion.objects.get(pk=1).version
+
+    def test_bump_is_stored_in_the_database(self):
+        first = bump_catalog_version()
+        self.assertEqual(CatalogVersion.objects.get(pk=1).version, first)
+        second = bump_catalog_version()
+        self.assertGreater(second, first)
+        self.assertEqual(get_catalog_version(), second)
+
+    def test_saving_a_product_bumps_the_shared_version(self):
+        before = get_catalog_version()
+        self.product.save()
+        self.assertGreater(CatalogVersion.objects.get(pk=1).version, before)
+
+    def test_other_workers_bumps_are_seen_after_the_check_interval(self):
+        with override_settings(CATALOG_VERSION_CHECK_INTERVAL=60):
+            before = get_catalog_version()
+            elsewhere = self.bump_elsewhere()
+            self.assertEqual(get_catalog_version(), before)
+        with override_settings(CATALOG_VERSION_CHECK_INTERVAL=0):
+            self.assertEqual(get_catalog_version(), elsewhere)
+
+    @override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+    def test_cached_pages_are_invalidated_by_other_workers(self):
+        url = reverse('products_list')
+        first = self.client.get(url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        self.bump_elsewhere()
+        again = self.client.get(url)
+        self.assertEqual(again['X-Cache'], 'MISS')
+        self.assertNotEqual(again['ETag'], first['ETag'])
+
+
+@override_settings(CATALOG_VERSION_CHECK_INTERVAL=0)
+class ConditionalPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.product = Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), category=cls.phones)
+        cls.user = User.objects.create_user('shopper', password='password')
+
+    def setUp(self):
+        cache.clear()
+        self.urls = [
+            reverse('home'),
+            reverse('products_list') + '?category=phones',
+            reverse('product_detail', args=[self.product.slug]),
+        ]
+
+    def forget_local_version(self):
+        """Start over like a freshly started worker, with only the database to go on."""
+        cache.clear()
+        cache_module._local.update(version=None, checked_at=None)
+
+    def test_validators_revalidate_on_any_worker(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.forget_local_version()
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+                self.forget_local_version()
+                repeat = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(repeat.status_code, 304)
+                self.assertEqual(repeat['ETag'], response['ETag'])
+
+    def test_catalog_changes_invalidate_validators(self):
+        responses = [self.client.get(url) for url in self.urls]
+        # Another worker edits the product; this one only sees the database row
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1000)
+        for url, response in zip(self.urls, responses):
+            with self.subTest(url=url):
+                fresh = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(fresh.status_code, 200)
+                self.assertNotEqual(fresh['ETag'], response['ETag'])
+
+    def test_logged_in_pages_carry_no_validators(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.urls[1])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class QueryPlanTests(TestCase):
+    def test_check_passes_on_a_seeded_catalog(self):
+        stdout = StringIO()
+        call_command('check_query_plans', '--seed', '300', stdout=stdout)
+        self.assertIn('All catalog queries use an index.', stdout.getvalue())
+        # The seed is rolled back
+        self.assertFalse(Product.objects.exists())
+
+    def test_shapes_are_the_queries_the_pages_run(self):
+        category = Category.objects.create(name='Phones', slug='phones')
+        Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), stock=2, category=category)
+        shapes = dict(query_shapes(category.pk))
+        for url, shape in [
+            (reverse('home'), 'home bestsellers'),
+            (reverse('products_list') + '?sort=name&in_stock=yes', 'list in-stock name'),
+            (reverse('products_list') + '?category=phones&sort=price-high', 'list category price-high'),
+        ]:
+            with self.subTest(url=url):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(url)
+                self.assertIn(str(shapes[shape].query), [query['sql'] for query in queries])
+
+
+
+class RatingAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones', slug='phones')
+        cls.users = [User.objects.create_user(f'reviewer{index}') for index in range(3)]
+        cls.product = Product.objects.create(name='Phone', slug='phone', price=Decimal('10'), category=cls.phones)
+        cls.other = Product.objects.create(name='Case', slug='case', price=Decimal('5'), category=cls.phones)
+
+    def review(self, user, rating, product=None):
+        return Review.objects.create(product=product or self.product, user=user, rating=rating, comment='Fine')
+
+    def assertAggregates(self, product, total, count, histogram):
+        product.refresh_from_db()
+        self.assertEqual(
+            (product.rating_sum, product.rating_count, [getattr(product, f'rating_{n}_count') for n in range(1, 6)]),
+            (total, count, histogram),
+        )
+
+    def test_creating_reviews_adds_to_aggregates(self):
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 4)
+        self.review(self.users[2], 4)
+        self.assertAggregates(self.product, 13, 3, [0, 0, 0, 2, 1])
+        self.assertEqual(self.product.get_average_rating(), 4.3)
+        self.assertEqual(self.product.get_rating_histogram()[1], (4, 2, 67))
+
+    def test_deleting_reviews_takes_them_off(self):
+        kept = self.review(self.users[0], 2)
+        self.review(self.users[1], 5).delete()
+        self.assertAggregates(self.product, 2, 1, [0, 1, 0, 0, 0])
+
+        Review.objects.get(pk=kept.pk).delete()
+        self.assertAggregates(self.product, 0, 0, [0, 0, 0, 0, 0])
+        self.assertEqual(self.product.get_average_rating(), 0)
+
+    def test_saving_a_stale_product_keeps_the_counters(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.review(self.users[0], 4)
+        Product.objects.filter(pk=self.product.pk).update(units_sold=F('units_sold') + 3)
+        stale.name = 'Renamed phone'
+        stale.save()
+        self.assertAggregates(self.product, 4, 1, [0, 0, 0, 1, 0])
+        self.assertEqual((self.product.name, self.product.units_sold), ('Renamed phone', 3))
+
+    def test_editing_a_review_moves_its_rating(self):
+        review = self.review(self.users[0], 1)
+        review = Review.objects.get(pk=review.pk)
+        review.rating = 3
+        review.save()
+        self.assertAggregates(self.product, 3, 1, [0, 0, 1, 0, 0])
+
+        review.product = self.other
+        review.save()
+        self.assertAggregates(self.product, 0, 0, [0, 0, 0, 0, 0])
+        self.assertAggregates(self.other, 3, 1, [0, 0, 1, 0, 0])
+
+    def test_rebuild_matches_incremental_aggregates(self):
+        for user, rating in zip(self.users, [1, 3, 5]):
+            self.review(user, rating)
+        Product.objects.update(rating_sum=0, rating_count=0, rating_1_count=7)
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.assertAggregates(self.product, 9, 3, [1, 0, 1, 0, 1])
+        self.assertAggregates(self.other, 0, 0, [0, 0, 0, 0, 0])
+
+
+class LocalImageBackendTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        overrides = override_settings(
+            MEDIA_ROOT=directory.name, MEDIA_URL='/media/', PRODUCT_IMAGE_BACKEND='store.images.LocalImageBackend',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        for cached in (get_image_backend, images._variant_url):
+            cached.cache_clear()
+            self.addCleanup(cached.cache_clear)
+
+        (self.root / 'products').mkdir()
+        Image.new('RGB', (1000, 500), 'red').save(self.root / 'products' / 'phone.jpg')
+        self.image = SimpleNamespace(public_id='products/phone', version='7', url='/original/phone.jpg')
+
+    def variant_size(self, url):
+        with Image.open(self.root / url.removeprefix('/media/')) as variant:
+            return variant.format, variant.size
+
+    def test_variants_are_resized_webp_and_never_enlarged(self):
+        url = image_url(self.image, 120)
+        self.assertEqual(url, '/media/variants/products/phone_v7_120w.webp')
+        self.assertEqual(self.variant_size(url), ('WEBP', (120, 60)))
+        self.assertEqual(self.variant_size(image_url(self.image, 2000)), ('WEBP', (1000, 500)))
+
+    def test_srcset_lists_every_width_of_a_size(self):
+        src, srcset, sizes = image_srcset(self.image, 'card')
+        self.assertEqual(src, '/media/variants/products/phone_v7_320w.webp')
+        self.assertEqual(srcset, ', '.join(
+            f'/media/variants/products/phone_v7_{width}w.webp {width}w' for width in IMAGE_SIZES['card'].widths
+        ))
+        self.assertEqual(sizes, IMAGE_SIZES['card'].sizes)
+        self.assertEqual(self.variant_size(src)[1], (320, 160))
+
+    def test_missing_original_falls_back_until_it_appears(self):
+        image = SimpleNamespace(public_id='products/case', version=None, url='/original/case.png')
+        self.assertEqual(image_url(image, 240), '/original/case.png')
+        Image.new('RGBA', (300, 300)).save(self.root / 'products' / 'case.png')
+        self.assertEqual(image_url(image, 240), '/media/variants/products/case_240w.webp')
+
+    def test_upload_replaces_the_original(self):
+        source = self.root / 'new.png'
+        Image.new('RGB', (50, 50)).save(source)
+        value = get_image_backend().upload(str(source), 'products/phone')
+        self.assertRegex(value, r'^image/upload/v\d+/products/phone\.png$')
+        self.assertEqual(sorted(path.name for path in (self.root / 'products').iterdir()), ['phone.png'])
+
+        text = self.root / 'notes.jpg'
+        text.write_text('not an image')
+        with self.assertRaises(OSError):
+            get_image_backend().upload(str(text), 'products/phone')
+        self.assertEqual(sorted(path.name for path in (self.root / 'products').iterdir()), ['phone.png'])
+
+
+class DashboardMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        phones = Category.objects.create(name='Phones', slug='phones')
+        for index, stock in enumerate((0, 4, 2, 50)):
+            Product.objects.create(name=f'Phone {index}', slug=f'phone-{index}', price=Decimal('10'), stock=stock, category=phones)
+        for payment_status, total in [('completed', '100'), ('cod_pending', '30'), ('pending', '999')]:
+            Order.objects.create(full_name='Customer', phone='1', payment_status=payment_status, total_amount=Decimal(total))
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_snapshot_figures(self):
+        metrics = get_dashboard_metrics()
+        self.assertEqual(metrics['total_revenue'], Decimal('130'))
+        self.assertEqual((metrics['total_orders'], metrics['pending_orders']), (3, 3))
+        self.assertEqual((metrics['total_products'], metrics['out_of_stock_count'], metrics['low_stock_count']), (4, 1, 2))
+        self.assertEqual([row['name'] for row in metrics['low_stock_products']], ['Phone 2', 'Phone 1'])
+
+    def test_fresh_snapshot_is_reused(self):
+        with self.assertNumQueries(3):
+            first = get_dashboard_metrics()
+        Order.objects.create(full_name='Customer', phone='1', payment_status='completed', total_amount=Decimal('5'))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_metrics(), first)
+
+    def test_stale_or_refreshed_snapshot_is_recomputed(self):
+        computed_at = get_dashboard_metrics()['computed_at']
+        Order.objects.create(full_name='Customer', phone='1', payment_status='completed', total_amount=Decimal('5'))
+        refreshed = get_dashboard_metrics(refresh=True)
+        self.assertEqual(refreshed['total_revenue'], Decimal('135'))
+        self.assertGreater(refreshed['computed_at'], computed_at)
+
+        Order.objects.create(full_name='Customer', phone='1', payment_status='completed', total_amount=Decimal('5'))
+        with override_settings(DASHBOARD_METRICS_TTL=0):
+            self.assertEqual(get_dashboard_metrics()['total_revenue'], Decimal('140'))
+
+    def test_stale_snapshot_is_served_while_another_request_recomputes(self):
+        stale = get_dashboard_metrics()
+        cache.add(dashboard.LOCK_KEY, 1)
+        with override_settings(DASHBOARD_METRICS_TTL=0), self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_metrics(), stale)
+
+    def test_failed_recompute_releases_the_lock(self):
+        with mock.patch.object(dashboard, 'compute_dashboard_metrics', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                get_dashboard_metrics()
+        self.assertIsNone(cache.get(dashboard.LOCK_KEY))
+        self.assertEqual(get_dashboard_metrics()['total_orders'], 3)
+
+    def test_dashboard_page_refresh(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse('admin_dashboard'))
+        Order.objects.create(full_name='Customer', phone='1', payment_status='completed', total_amount=Decimal('5'))
+        cached = self.client.get(reverse('admin_dashboard'))
+        self.assertContains(cached, '130')
+        self.assertNotContains(cached, '135')
+        self.assertContains(self.client.get(reverse('admin_dashboard'), {'refresh': '1'}), '135')
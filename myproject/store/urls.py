@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.home, name="home"),
@@ -7,4 +7,12 @@ urlpatterns = [
     path("products/", views.products_list, name="products_list"),
     path("product/<slug:slug>/", views.product_detail, name="product_detail"),
     path("admin-dashboard/", views.admin_dashboard, name="admin_dashboard"),
+    path("admin-dashboard/sales/", views.admin_sales_series, name="admin_sales_series"),
+
+    # Read-only JSON API (see store.api)
+    path("api/products/", api.product_list, name="api_product_list"),
+    path("api/products/batch/", api.product_batch, name="api_product_batch"),
+    path("api/products/<slug:slug>/", api.product_detail, name="api_product_detail"),
+    path("api/categories/", api.category_list, name="api_category_list"),
+    path("api/suggest/", api.suggest, name="api_suggest"),
 ]
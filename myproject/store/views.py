@@ -1,21 +1,35 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from .models import Product, Category
+from .bestsellers import trending_products
+from .cache import cache_catalog_page, get_cache_stats
+from .dashboard import get_dashboard_metrics, get_metrics_ttl
+from .facets import (
+    PRICE_RANGES, compute_facets, filter_products, get_catalog_facets, get_price_filter, get_sort_ordering,
+)
 from .forms import ReviewForm
+from .pagination import InvalidCursor, KeysetPaginator, approximate_count
+from .related import get_related_products
+from .search import search_products
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Sum, Count, Q
+from django.http import JsonResponse
 from django.utils import timezone
 from orders.models import Order
-from decimal import Decimal
+from orders.rollups import GRANULARITIES, sales_series
+import datetime
 
 
+# Longest range the sales chart may ask for (about ten years of days)
+MAX_SERIES_DAYS = 3660
+
+
+@cache_catalog_page
 def home(request):
-    # Smart Trending: Best Sellers -> Newest (Top 6)
-    products = Product.objects.filter(is_available=True).annotate(
-        total_sales=Sum('orderitem__quantity')
-    ).order_by('-total_sales', '-created_at')[:6]
-    categories = Category.objects.all()
+    # Smart Trending: Recent Best Sellers -> All-time -> Newest (Top 6),
+    # read from the materialized sales counters (indexed top-N lookup)
+    products = trending_products(6)
+    categories = Category.objects.select_related('cover_product')
     context = {
         "products": products,
         "categories": categories
@@ -28,16 +42,14 @@ def about(request):
     return render(request, "store/about.html")
 
 
+@cache_catalog_page
 def product_detail(request, slug):
     product = get_object_or_404(Product, slug=slug, is_available=True)
-    # Get related products from same category
-    related_products = Product.objects.filter(
-        category=product.category,
-        is_available=True
-    ).exclude(id=product.id).order_by('?')[:4]
+    # Related products: random rotation of the precomputed list
+    related_products = get_related_products(product, limit=4)
     
     # Get reviews
-    reviews = product.reviews.all()
+    reviews = product.reviews.select_related('user')
     user_review = None
     if request.user.is_authenticated:
         user_review = reviews.filter(user=request.user).first()
@@ -66,64 +78,77 @@ def product_detail(request, slug):
         'review_form': form,
         'average_rating': product.get_average_rating(),
         'review_count': product.get_review_count(),
+        'rating_histogram': product.get_rating_histogram(),
     }
     return render(request, "store/product_detail.html", context)
 
 
+def _query_with_cursor(request, cursor):
+    """Current query string with the pagination cursor swapped for ``cursor``."""
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return params.urlencode()
+
+
+@cache_catalog_page
 def products_list(request):
     """Product listing page with filters and search"""
     products = Product.objects.filter(is_available=True)
-    categories = Category.objects.all()
+    categories = list(Category.objects.all())
     
-    # Search
+    # Search (full-text index, ranked by relevance)
     search_query = request.GET.get('search', '')
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
+        products = search_products(products, search_query)
+        facets = compute_facets(products, categories)
+    else:
+        facets = get_catalog_facets(products, categories)
+    
+    # Facet counts for the current search, shown next to each filter
+    for category in categories:
+        category.facet_count = facets['categories'].get(category.pk, 0)
+    price_facets = [
+        (value, label, facets['price'][value]) for value, label, _condition in PRICE_RANGES
+    ]
     
-    # Category filter
+    # Category, price (Premium Ranges) and stock filters
     category_slug = request.GET.get('category', '')
     selected_category = None
     if category_slug:
         selected_category = get_object_or_404(Category, slug=category_slug)
-        products = products.filter(category=selected_category)
-    
-    # Price filter (Premium Ranges)
     price_range = request.GET.get('price', '')
-    if price_range == 'under-5000':
-        products = products.filter(price__lt=5000)
-    elif price_range == '5000-10000':
-        products = products.filter(price__gte=5000, price__lt=10000)
-    elif price_range == 'above-10000':
-        products = products.filter(price__gte=10000)
+    in_stock = request.GET.get('in_stock', '')
+    products = filter_products(
+        products, category=selected_category, price_filter=get_price_filter(price_range), in_stock=in_stock == 'yes',
+    )
     
     # Sorting
-    sort_by = request.GET.get('sort', 'newest')
-    if sort_by == 'price-low':
-        products = products.order_by('price')
-    elif sort_by == 'price-high':
-        products = products.order_by('-price')
-    elif sort_by == 'name':
-        products = products.order_by('name')
-    else:  # newest
-        products = products.order_by('-created_at')
+    sort_by = request.GET.get('sort', 'relevance' if search_query else 'newest')
+    ordering = get_sort_ordering(sort_by, searching=bool(search_query))
     
-    # Stock filter
-    in_stock = request.GET.get('in_stock', '')
-    if in_stock == 'yes':
-        products = products.filter(stock__gt=0)
+    # Keyset pagination: deep pages cost the same as the first one
+    paginator = KeysetPaginator(products, ordering, per_page=request.GET.get('per_page'))
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page = paginator.page()
     
     context = {
-        'products': products,
+        'products': page.object_list,
+        'page': page,
+        'next_page_query': _query_with_cursor(request, page.next_cursor),
+        'previous_page_query': _query_with_cursor(request, page.previous_cursor),
         'categories': categories,
+        'facets': facets,
+        'price_facets': price_facets,
         'selected_category': selected_category,
         'search_query': search_query,
         'price_range': price_range,
         'sort_by': sort_by,
         'in_stock': in_stock,
-        'total_products': products.count()
+        'total_products': approximate_count(products),
     }
     
     return render(request, 'store/products_list.html', context)
@@ -133,72 +158,45 @@ def products_list(request):
 def admin_dashboard(request):
     """Admin dashboard with sales analytics and key metrics"""
     
-    # Date filters
-    today = timezone.now().date()
-    month_start = today.replace(day=1)
-    
-    # Revenue calculations
-    total_revenue = Order.objects.filter(
-        payment_status__in=['completed', 'cod_pending']
-    ).aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-    
-    month_revenue = Order.objects.filter(
-        created_at__gte=month_start,
-        payment_status__in=['completed', 'cod_pending']
-    ).aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-    
-    today_revenue = Order.objects.filter(
-        created_at__date=today,
-        payment_status__in=['completed', 'cod_pending']
-    ).aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-    
-    # Order counts
-    total_orders = Order.objects.count()
-    month_orders = Order.objects.filter(created_at__gte=month_start).count()
-    today_orders = Order.objects.filter(created_at__date=today).count()
-    pending_orders = Order.objects.filter(status='pending').count()
-    
-    # Product stats
-    total_products = Product.objects.count()
-    available_products = Product.objects.filter(is_available=True).count()
-    total_categories = Product.objects.values('category').distinct().count()
-    
-    # Low stock alerts
-    low_stock_products = Product.objects.filter(
-        stock__lte=5,
-        stock__gt=0
-    ).select_related('category').order_by('stock')[:10]
-    
-    out_of_stock_products = Product.objects.filter(stock=0).count()
+    # Revenue, order, product and stock figures from the cached snapshot
+    metrics = get_dashboard_metrics(refresh='refresh' in request.GET)
     
     # Recent orders
     recent_orders = Order.objects.select_related('user').prefetch_related('items__product').order_by('-created_at')[:10]
     
-    # Status breakdown
-    status_breakdown = Order.objects.values('status').annotate(count=Count('id'))
-    
     context = {
-        # Revenue
-        'total_revenue': total_revenue,
-        'month_revenue': month_revenue,
-        'today_revenue': today_revenue,
-        
-        # Orders
-        'total_orders': total_orders,
-        'month_orders': month_orders,
-        'today_orders': today_orders,
-        'pending_orders': pending_orders,
-        
-        # Products
-        'total_products': total_products,
-        'available_products': available_products,
-        'total_categories': total_categories,
-        'out_of_stock_count': out_of_stock_products,
-        
-        # Alerts & Lists
-        'low_stock_products': low_stock_products,
+        **metrics,
+        'metrics_ttl': get_metrics_ttl(),
         'recent_orders': recent_orders,
-        'status_breakdown': status_breakdown,
+        
+        # Catalog page cache
+        'page_cache': get_cache_stats(),
     }
     
     return render(request, 'admin/dashboard.html', context)
+
+
+@staff_member_required
+def admin_sales_series(request):
+    """Sales over time for the dashboard chart, read from the daily rollups only"""
+    try:
+        end = datetime.date.fromisoformat(request.GET['end']) if request.GET.get('end') else timezone.localdate()
+        days = int(request.GET.get('days', 30))
+        category_id = int(request.GET['category']) if request.GET.get('category') else None
+        product_id = int(request.GET['product']) if request.GET.get('product') else None
+    except ValueError:
+        return JsonResponse({'error': 'end must be YYYY-MM-DD; days, category and product numbers.'}, status=400)
+    if not 1 <= days <= MAX_SERIES_DAYS:
+        return JsonResponse({'error': f'days must be between 1 and {MAX_SERIES_DAYS}.'}, status=400)
+    granularity = request.GET.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return JsonResponse({'error': f"granularity must be one of {', '.join(GRANULARITIES)}."}, status=400)
+    
+    start = end - datetime.timedelta(days=days - 1)
+    series = sales_series(start, end, granularity, category_id=category_id, product_id=product_id)
+    return JsonResponse({
+        'start': start,
+        'end': end,
+        'granularity': granularity,
+        'series': series,
+    })